@@ -0,0 +1,184 @@
+// cam/bench_spotting.js
+//
+// Per-frame cost and detection quality of trigger-free gesture spotting
+// (public/GestureSpotter.js) on synthetic streams:
+//
+//   node bench_spotting.js
+//   node bench_spotting.js --templates 300 --gestures 100
+//
+// Templates are random joint angle and distance trajectories that start
+// from a shared resting pose. The stream alternates idle stretches with
+// noisy, re-timed performances of templates and of unrelated motions. A
+// detection is correct when it names the motion being performed, no later
+// than half a second after it ends.
+const GestureSpotter = require("./public/GestureSpotter.js");
+
+const FRAME_INTERVAL = 1000 / 30; // The camera page samples poses at 30 fps
+const FEATURES = 21; // 9 joint angles and 12 joint distances
+const MOTION_COOLDOWN = 1000; // ms, as in the motion recorder
+
+function parseArgs() {
+  const args = { templates: [10, 50, 100, 300], gestures: 200, seed: 1 };
+  const argv = process.argv.slice(2);
+  for (let i = 0; i < argv.length; i += 2) {
+    const name = argv[i].replace(/^--/, "");
+    args[name] = name === "templates" ? argv[i + 1].split(",").map(Number) : Number(argv[i + 1]);
+  }
+  return args;
+}
+
+// Small deterministic generator so runs are comparable
+function makeRandom(seed) {
+  let state = seed >>> 0;
+  const next = () => {
+    state = (state + 0x6d2b79f5) >>> 0;
+    let t = state;
+    t = Math.imul(t ^ (t >>> 15), t | 1);
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+  next.uniform = (low, high) => low + (high - low) * next();
+  next.normal = (sigma) =>
+    sigma * Math.sqrt(-2 * Math.log(next() || 1e-12)) * Math.cos(2 * Math.PI * next());
+  return next;
+}
+
+function randomMotion(random, rest) {
+  const active = [];
+  const count = 3 + Math.floor(random() * 6);
+  while (active.length < count) {
+    const feature = Math.floor(random() * FEATURES);
+    if (!active.includes(feature)) active.push(feature);
+  }
+  return {
+    rest,
+    active,
+    amplitude: active.map(() => random.uniform(-0.6, 0.6)),
+    frequency: active.map(() => random.uniform(0.5, 1.5)),
+    phase: active.map(() => random.uniform(0, Math.PI)),
+    duration: random.uniform(600, 2500),
+  };
+}
+
+// Feature frames of one performance, starting and ending near the rest pose
+function perform(random, motion, { tempo = 1, scale = 1, noise = 0 } = {}) {
+  const duration = motion.duration * tempo;
+  const frames = [];
+  for (let time = 0; time <= duration; time += FRAME_INTERVAL * random.uniform(0.9, 1.1)) {
+    const progress = time / duration;
+    const frame = motion.rest.map((value) => value + random.normal(noise));
+    motion.active.forEach((feature, i) => {
+      const angle = 2 * Math.PI * motion.frequency[i] * progress + motion.phase[i];
+      frame[feature] += motion.amplitude[i] * scale * (Math.sin(angle) - Math.sin(motion.phase[i]));
+    });
+    frames.push({ time, frame });
+  }
+  return frames;
+}
+
+function run(random, templateCount, gestureCount) {
+  const rest = Array.from({ length: FEATURES }, (_, i) =>
+    i < 9 ? random.uniform(1, 2.5) : random.uniform(0.5, 1.2)
+  );
+  const motions = Array.from({ length: templateCount }, () => randomMotion(random, rest));
+  const spotter = new GestureSpotter();
+  spotter.setTemplates(
+    motions.map((motion, index) => {
+      const frames = perform(random, motion, { noise: 0.01 });
+      return {
+        name: `motion${index}`,
+        frames: frames.map(({ frame }) => frame),
+        timestamps: frames.map(({ time }) => time),
+        weights: new Array(FEATURES).fill(1),
+      };
+    })
+  );
+
+  // Idle stretches alternating with gestures, 20% of them unrelated motions
+  let clock = 0;
+  const gestures = [];
+  const timings = [];
+  const detections = [];
+  const push = (frame) => {
+    const started = process.hrtime.bigint();
+    const match = spotter.push(frame, clock);
+    timings.push(Number(process.hrtime.bigint() - started) / 1e6);
+    const last = detections[detections.length - 1];
+    if (match && !(last && clock - last.time < MOTION_COOLDOWN)) {
+      detections.push({ time: clock, name: match.name });
+    }
+    clock += FRAME_INTERVAL;
+  };
+  for (let g = 0; g < gestureCount; g++) {
+    const idle = random.uniform(1000, 3000);
+    for (let time = 0; time < idle; time += FRAME_INTERVAL) {
+      push(rest.map((value) => value + random.normal(0.02)));
+    }
+    const unrelated = random() < 0.2;
+    const index = Math.floor(random() * templateCount);
+    const motion = unrelated ? randomMotion(random, rest) : motions[index];
+    const start = clock;
+    for (const { frame } of perform(random, motion, {
+      tempo: random.uniform(0.8, 1.25),
+      scale: random.uniform(0.85, 1.15),
+      noise: 0.03,
+    })) {
+      push(frame);
+    }
+    gestures.push({ name: unrelated ? null : `motion${index}`, start, end: clock });
+  }
+
+  let correct = 0;
+  let wrong = 0;
+  let spurious = 0;
+  const latencies = [];
+  for (const detection of detections) {
+    const gesture = gestures.find(
+      ({ start, end }) => detection.time >= start && detection.time <= end + 500
+    );
+    if (!gesture || gesture.name === null) {
+      spurious++;
+    } else if (gesture.name === detection.name) {
+      correct++;
+      latencies.push(detection.time - gesture.end);
+    } else {
+      wrong++;
+    }
+  }
+
+  timings.sort((a, b) => a - b);
+  const performed = gestures.filter(({ name }) => name !== null).length;
+  return {
+    cells: spotter.getStats().cells,
+    meanMs: timings.reduce((sum, t) => sum + t, 0) / timings.length,
+    p99Ms: timings[Math.min(timings.length - 1, Math.floor(timings.length * 0.99))],
+    detected: correct / performed,
+    wrong,
+    spurious,
+    minutes: clock / 60000,
+    latency: latencies.length
+      ? latencies.reduce((sum, t) => sum + t, 0) / latencies.length
+      : 0,
+  };
+}
+
+const args = parseArgs();
+console.log(
+  "templates  cells  mean ms  p99 ms  budget  detected  wrong  spurious/min  latency ms"
+);
+for (const templateCount of args.templates) {
+  const result = run(makeRandom(args.seed), templateCount, args.gestures);
+  console.log(
+    [
+      String(templateCount).padStart(9),
+      String(result.cells).padStart(6),
+      result.meanMs.toFixed(3).padStart(8),
+      result.p99Ms.toFixed(3).padStart(7),
+      `${((result.p99Ms / FRAME_INTERVAL) * 100).toFixed(1)}%`.padStart(7),
+      `${(result.detected * 100).toFixed(1)}%`.padStart(9),
+      String(result.wrong).padStart(6),
+      (result.spurious / result.minutes).toFixed(2).padStart(13),
+      result.latency.toFixed(0).padStart(11),
+    ].join(" ")
+  );
+}
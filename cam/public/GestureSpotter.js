@@ -0,0 +1,270 @@
+// Continuous gesture spotting without the trigger.
+//
+// Every saved motion is a template of per-frame feature vectors. Each new
+// camera frame extends one column of a subsequence-DTW cost matrix per
+// template (the SPRING algorithm): a match may start at any frame, and the
+// best alignment of the whole template ending at the current frame is known
+// after every frame. An alignment is a candidate when it is close enough,
+// relative to how far the template's own frames spread around their mean,
+// the matched stretch of the stream lasted a plausible time and moved about
+// as much as the template does. The best candidate fires as soon as no
+// overlapping alignment still in progress can beat it, which is usually a
+// few frames after the motion ends. Work per frame is
+// O(templates x template length x features), independent of how long the
+// stream has been running.
+class GestureSpotter {
+  constructor({
+    bufferSize = 300, // Frames kept, 10 s at 30 fps; longer matches are ignored
+    threshold = 0.6, // Score (0-1) a match needs to fire
+    costScale = 1.5, // Mean per-frame distance scoring 0, in template spreads
+    minEnergyRatio = 0.5, // Matched stretch must move at least this much of the template
+    minDurationRatio = 0.5, // Matched stretch duration relative to the template
+    maxDurationRatio = 2.0,
+  } = {}) {
+    this.bufferSize = bufferSize;
+    this.threshold = threshold;
+    this.costScale = costScale;
+    this.minEnergyRatio = minEnergyRatio;
+    this.minDurationRatio = minDurationRatio;
+    this.maxDurationRatio = maxDurationRatio;
+
+    this.templates = [];
+    this.featureCount = 0;
+    this.frameCount = 0; // Frames pushed since the last reset
+    this.timestamps = new Float64Array(bufferSize);
+    this.energy = new Float64Array(bufferSize); // Cumulative movement at each frame
+    this.features = null; // Ring buffer of frame features
+    this.stats = { frames: 0, fired: 0, totalMs: 0, maxMs: 0 };
+  }
+
+  // templates: [{ name, frames: [[feature, ...], ...], timestamps: [...], weights: [...] }]
+  setTemplates(templates) {
+    this.featureCount = templates.length > 0 ? templates[0].frames[0].length : 0;
+    this.features = new Float32Array(this.bufferSize * this.featureCount);
+    // Movement is measured over all features alike, in the stream and templates
+    this.uniformWeights = new Float32Array(this.featureCount).fill(
+      1 / (this.featureCount || 1)
+    );
+    this.templates = templates
+      .filter((template) => template.frames.length >= 2)
+      .map((template) => {
+        const length = template.frames.length;
+        const frames = new Float32Array(length * this.featureCount);
+        template.frames.forEach((frame, i) =>
+          frames.set(frame, i * this.featureCount)
+        );
+
+        // Weights are normalized so distances are weighted means
+        const weightSum = template.weights.reduce((sum, w) => sum + w, 0);
+        const weights = Float32Array.from(
+          template.weights,
+          (w) => w / (weightSum || 1)
+        );
+
+        const prepared = {
+          name: template.name,
+          length,
+          frames,
+          weights,
+          duration:
+            template.timestamps[length - 1] - template.timestamps[0],
+          energy: 0,
+          cost: new Float64Array(length).fill(Infinity),
+          start: new Float64Array(length),
+          previousCost: new Float64Array(length).fill(Infinity),
+          previousStart: new Float64Array(length),
+          candidate: null, // Best match not yet confirmed
+        };
+        // How far frames stray from the template's mean frame
+        const mean = new Float32Array(this.featureCount);
+        for (let i = 0; i < length; i++) {
+          for (let k = 0; k < this.featureCount; k++) {
+            mean[k] += frames[i * this.featureCount + k] / length;
+          }
+        }
+        prepared.spread = 0;
+        for (let i = 0; i < length; i++) {
+          prepared.spread +=
+            this.distance(frames, i * this.featureCount, mean, 0, weights) / length;
+        }
+        for (let i = 1; i < length; i++) {
+          prepared.energy += this.distance(
+            frames,
+            i * this.featureCount,
+            frames,
+            (i - 1) * this.featureCount,
+            this.uniformWeights
+          );
+        }
+        return prepared;
+      });
+    this.reset();
+  }
+
+  // Forget the stream, e.g. after a detection consumed it
+  reset() {
+    this.frameCount = 0;
+    for (const template of this.templates) {
+      template.cost.fill(Infinity);
+      template.previousCost.fill(Infinity);
+      template.candidate = null;
+    }
+  }
+
+  // Weighted root-mean-square distance between two feature vectors
+  distance(a, aOffset, b, bOffset, weights) {
+    let sum = 0;
+    for (let k = 0; k < weights.length; k++) {
+      const diff = a[aOffset + k] - b[bOffset + k];
+      sum += weights[k] * diff * diff;
+    }
+    return Math.sqrt(sum);
+  }
+
+  // Add a frame, returns the best template that fired on it or null
+  push(frameFeatures, timestamp) {
+    if (this.templates.length === 0) return null;
+    const started = performance.now();
+    const f = this.featureCount;
+    const t = this.frameCount++;
+    const slot = t % this.bufferSize;
+    this.features.set(frameFeatures, slot * f);
+    this.timestamps[slot] = timestamp;
+
+    // Movement up to this frame, for the energy check of matches
+    const previousSlot = (t - 1 + this.bufferSize) % this.bufferSize;
+    this.energy[slot] =
+      t === 0
+        ? 0
+        : this.energy[previousSlot] +
+          this.distance(
+            this.features,
+            slot * f,
+            this.features,
+            previousSlot * f,
+            this.uniformWeights
+          );
+
+    let best = null;
+    for (const template of this.templates) {
+      const { frames, weights, length } = template;
+
+      // The previous column becomes this one's predecessor
+      const previousCost = template.cost;
+      const previousStart = template.start;
+      const cost = template.previousCost;
+      const start = template.previousStart;
+      template.cost = cost;
+      template.start = start;
+      template.previousCost = previousCost;
+      template.previousStart = previousStart;
+
+      // A match may begin at this frame
+      cost[0] = this.distance(this.features, slot * f, frames, 0, weights);
+      start[0] = t;
+      for (let j = 1; j < length; j++) {
+        // Best of: stream advances, template advances, both advance
+        let prior = previousCost[j];
+        let priorStart = previousStart[j];
+        if (cost[j - 1] < prior) {
+          prior = cost[j - 1];
+          priorStart = start[j - 1];
+        }
+        if (previousCost[j - 1] <= prior) {
+          prior = previousCost[j - 1];
+          priorStart = previousStart[j - 1];
+        }
+        cost[j] =
+          prior + this.distance(this.features, slot * f, frames, j * f, weights);
+        start[j] = priorStart;
+      }
+
+      const match = this.evaluate(template, t, slot);
+      if (match && (!template.candidate || match.cost < template.candidate.cost)) {
+        template.candidate = match;
+      }
+      if (
+        template.candidate &&
+        this.confirmed(template) &&
+        (!best || template.candidate.score > best.score)
+      ) {
+        best = template.candidate;
+      }
+    }
+
+    if (best) {
+      this.stats.fired++;
+      this.reset();
+    }
+
+    const elapsed = performance.now() - started;
+    this.stats.frames++;
+    this.stats.totalMs += elapsed;
+    this.stats.maxMs = Math.max(this.stats.maxMs, elapsed);
+    return best;
+  }
+
+  // Whether no alignment in progress that overlaps the candidate can still
+  // end with a lower cost; costs only grow along a path
+  confirmed(template) {
+    const { cost, start, candidate } = template;
+    for (let j = 0; j < template.length; j++) {
+      if (cost[j] < candidate.cost && start[j] <= candidate.frame) return false;
+    }
+    return true;
+  }
+
+  // The alignment of the whole template ending at frame t, if it is a candidate
+  evaluate(template, t, slot) {
+    const end = template.length - 1;
+    const first = template.start[end];
+    if (!Number.isFinite(template.cost[end]) || t - first >= this.bufferSize) {
+      return null;
+    }
+
+    const score = Math.max(
+      0,
+      1 - template.cost[end] / template.length / (this.costScale * template.spread)
+    );
+    if (score < this.threshold) return null;
+
+    const firstSlot = first % this.bufferSize;
+    const duration = this.timestamps[slot] - this.timestamps[firstSlot];
+    if (
+      duration < template.duration * this.minDurationRatio ||
+      duration > template.duration * this.maxDurationRatio
+    ) {
+      return null;
+    }
+
+    // A still pose close to the template's resting pose is not the motion
+    const moved = this.energy[slot] - this.energy[firstSlot];
+    if (moved < template.energy * this.minEnergyRatio) return null;
+
+    return {
+      name: template.name,
+      score,
+      cost: template.cost[end],
+      frame: t,
+      start: this.timestamps[firstSlot],
+      end: this.timestamps[slot],
+      duration,
+    };
+  }
+
+  getStats() {
+    const { frames, fired, totalMs, maxMs } = this.stats;
+    return {
+      templates: this.templates.length,
+      cells: this.templates.reduce((sum, template) => sum + template.length, 0),
+      frames,
+      fired,
+      meanFrameMs: frames > 0 ? totalMs / frames : 0,
+      maxFrameMs: maxMs,
+    };
+  }
+}
+
+if (typeof module !== "undefined") {
+  module.exports = GestureSpotter;
+}
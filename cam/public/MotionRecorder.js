@@ -43,6 +43,32 @@ class MotionRecorder {
     this.activeHeldKeys = new Set(); // Track keys being held
     this.toggledKeys = new Set(); // Track keys that are toggled on
 
+    // Match on the input server instead of in the page (?recognition=server)
+    this.SERVER_RECOGNITION =
+      new URLSearchParams(window.location.search).get("recognition") ===
+      "server";
+    this.serverLibraryDirty = true; // Library must be sent before the next match
+
+    // Spot motions in the live stream without the trigger (?spotting=1)
+    this.SPOTTING =
+      new URLSearchParams(window.location.search).get("spotting") === "1";
+    this.spotter = new GestureSpotter();
+    this.spotterDirty = true; // Templates must be rebuilt before the next frame
+    this.lastSpotTime = 0;
+
+    // Motions persist in the input server's motion store
+    this.MOTION_STORE_URL = "http://localhost:5000/motions";
+    this.STORE_FETCH_CONCURRENCY = 4; // Motion frames downloaded at a time
+    this.STORE_DELAY = 500; // ms without changes before a motion is saved
+    this.storedMotions = new Set(); // Names the store has frames for
+    this.unloadedMotions = new Map(); // Stored motion name -> manifest entry, frames not fetched yet
+    this.motionLoads = new Map(); // Motion name -> its pending frame download
+    this.failedMotions = new Map(); // Motion name -> when its download last failed
+    this.STORE_RETRY_DELAY = 10000; // ms before matching retries a failed download
+    this.storeLoad = null; // Pending download of every unloaded motion
+    this.storeQueue = new Map(); // Motion name -> whether its frames changed
+    this.storeTimer = null;
+
     // Key joints to track for motion detection
     this.KEY_JOINTS = [
       11,
@@ -64,6 +90,16 @@ class MotionRecorder {
     this.MOTION_PHASES = 3; // Beginning, middle, end phases for better temporal analysis
     this.NOISE_THRESHOLD = 0.003; // Filter out tiny movements as noise
     this.KEY_PHASE_WEIGHT = 1.8; // Give more weight to the "key phase" of a motion
+    this.PREFILTER_CANDIDATES = 0; // Motions compared in full per detection, 0 compares all
+
+    // Saved motions smoothed and resampled for comparison, least recently used first
+    this.TEMPLATE_CACHE_SIZE = 256;
+    this.templateCache = new Map();
+    this.templateCacheStats = { hits: 0, misses: 0, evictions: 0 };
+    this.motionVersions = new Map(); // Bumped whenever a motion or its importance changes
+    // The gesture being matched, preprocessed once per sample count
+    this.sequenceSamples = new WeakMap();
+    this.motionSummaries = new WeakMap(); // relativeMotion -> summary for the pre-filter
 
     // Key joint pairs for relative movement tracking
     this.JOINT_PAIRS = [
@@ -101,7 +137,25 @@ class MotionRecorder {
         return this.MOTION_COOLDOWN;
       },
       getMotionCooldown: () => this.MOTION_COOLDOWN,
+      setServerRecognition: (enabled) => {
+        this.SERVER_RECOGNITION = Boolean(enabled);
+        this.serverLibraryDirty = true;
+        this.logDebug(
+          `Motion recognition on the ${enabled ? "server" : "page"}`
+        );
+        return this.SERVER_RECOGNITION;
+      },
+      getServerRecognition: () => this.SERVER_RECOGNITION,
+      setSpotting: (enabled) => {
+        this.SPOTTING = Boolean(enabled);
+        this.spotter.reset();
+        this.logDebug(`Trigger-free spotting ${enabled ? "on" : "off"}`);
+        return this.SPOTTING;
+      },
+      getSpotting: () => this.SPOTTING,
     };
+
+    this.loadMotionStore();
   }
 
   getJointImportance(motionName, jointKey) {
@@ -120,6 +174,8 @@ class MotionRecorder {
 
     const motionImportance = this.jointImportance.get(motionName);
     motionImportance[jointKey] = Math.max(0, Math.min(1, value)); // Clamp between 0-1
+    this.invalidateMotion(motionName);
+    this.storeMotion(motionName);
 
     this.logDebug(
       `Set joint importance for ${motionName}, ${jointKey}: ${value}`
@@ -236,6 +292,13 @@ class MotionRecorder {
     controls.appendChild(toggleBtn);
     this.debugContainer.appendChild(controls);
 
+    // Template cache hit rate, updated after every detection
+    const cacheStats = document.createElement("div");
+    cacheStats.id = "motion-debug-cache";
+    cacheStats.style.marginBottom = "10px";
+    cacheStats.style.color = "#aaa";
+    this.debugContainer.appendChild(cacheStats);
+
     // Add log container
     const logContainer = document.createElement("div");
     logContainer.id = "motion-debug-log";
@@ -246,6 +309,19 @@ class MotionRecorder {
     this.logDebug("Debug panel initialized");
   }
 
+  updateCacheStatsUI() {
+    if (!this.DEBUG || !this.debugContainer) return;
+    const cacheStats = this.debugContainer.querySelector("#motion-debug-cache");
+    if (!cacheStats) return;
+
+    const { hits, misses, evictions } = this.templateCacheStats;
+    const hitRate = hits + misses > 0 ? (hits / (hits + misses)) * 100 : 0;
+    cacheStats.textContent =
+      `Template cache: ${this.templateCache.size}/${this.TEMPLATE_CACHE_SIZE}, ` +
+      `${hits} hits, ${misses} misses (${hitRate.toFixed(1)}% hit rate), ` +
+      `${evictions} evicted`;
+  }
+
   clearDebugLog() {
     if (!this.DEBUG || !this.debugContainer) return;
     const logContainer = this.debugContainer.querySelector("#motion-debug-log");
@@ -362,6 +438,8 @@ class MotionRecorder {
 
     // Initialize default joint importance values
     this.initializeDefaultJointImportance(this.currentMotionName);
+    this.invalidateMotion(this.currentMotionName);
+    this.storeMotion(this.currentMotionName, true);
 
     this.logDebug(
       `Saved motion "${this.currentMotionName}" with ${normalizedSequence.length} frames`,
@@ -635,6 +713,11 @@ class MotionRecorder {
       }
     }
 
+    // Without the trigger, every frame may complete a motion
+    if (this.SPOTTING && !this.isRecording && !this.isTriggerHeld) {
+      this.spotFrame(poseLandmarks, currentTime);
+    }
+
     // Handle trigger buffer for motion detection
     // Check if left trigger is held down
     const leftTriggerValue =
@@ -647,6 +730,8 @@ class MotionRecorder {
       this.triggerHoldStartTime = currentTime;
       this.triggerBuffer = [];
       this.logDebug("Left trigger pressed - starting motion capture");
+      // Stored motions are needed by the time the trigger is released
+      if (this.unloadedMotions.size > 0) this.loadStoredMotions();
     }
 
     // If trigger is being held, add frames to buffer
@@ -691,6 +776,78 @@ class MotionRecorder {
     }
   }
 
+  // Feed one frame to the spotter and run the mapping of a spotted motion
+  spotFrame(poseLandmarks, currentTime) {
+    if (currentTime - this.lastSpotTime < 1000 / this.FRAME_RATE) return;
+    this.lastSpotTime = currentTime;
+    if (this.unloadedMotions.size > 0) this.loadStoredMotions();
+    if (this.spotterDirty) this.rebuildSpotter();
+
+    const pose = poseLandmarks.map((landmark) => ({
+      x: landmark.x,
+      y: landmark.y,
+      z: landmark.z || 0,
+    }));
+    const match = this.spotter.push(
+      this.spottingFeatures(
+        this.calculateJointAngles(pose),
+        this.calculateJointDistances(pose)
+      ),
+      currentTime
+    );
+    if (!match || currentTime - this.lastDetectionTime < this.MOTION_COOLDOWN) {
+      return;
+    }
+
+    this.lastDetectionTime = currentTime;
+    this.lastDetectedMotion = match.name;
+    this.executeKeyMapping(match.name);
+    this.logDebug(
+      `MOTION SPOTTED: ${match.name} (score: ${match.score.toFixed(2)})`,
+      {
+        timestamp: new Date(currentTime).toLocaleTimeString(),
+        duration: Math.round(match.duration),
+        spotter: this.spotter.getStats(),
+      }
+    );
+  }
+
+  // Joint angles, then joint distances in torso lengths so they do not
+  // depend on how far the player stands from the camera
+  spottingFeatures(jointAngles, jointDistances) {
+    const torso =
+      (jointDistances.dist_11_23 + jointDistances.dist_12_24) / 2 || 1;
+    return [
+      ...Object.values(jointAngles),
+      ...Object.values(jointDistances).map((distance) => distance / torso),
+    ];
+  }
+
+  rebuildSpotter() {
+    const templates = [];
+    for (const [motionName, motionData] of this.savedMotions) {
+      const frames = motionData.relativeMotion;
+      if (!frames || frames.length < this.MIN_SEQUENCE_LENGTH) continue;
+
+      const importance = this.jointImportance.get(motionName) || {};
+      const keys = [
+        ...Object.keys(frames[0].jointAngles),
+        ...Object.keys(frames[0].jointDistances),
+      ];
+      templates.push({
+        name: motionName,
+        frames: frames.map((frame) =>
+          this.spottingFeatures(frame.jointAngles, frame.jointDistances)
+        ),
+        timestamps: frames.map((frame) => frame.timestamp),
+        weights: keys.map((key) => importance[key] || 0.5),
+      });
+    }
+    this.spotter.setTemplates(templates);
+    this.spotterDirty = false;
+    this.logDebug(`Spotting ${templates.length} motions without the trigger`);
+  }
+
   normalizeControllerData(controllerData) {
     if (!controllerData) return null;
 
@@ -730,6 +887,8 @@ class MotionRecorder {
 
   setMotionKeyMapping(motionName, keyConfig) {
     this.motionKeyMappings.set(motionName, keyConfig);
+    this.serverLibraryDirty = true;
+    this.storeMotion(motionName);
     this.logDebug(
       `Mapped motion "${motionName}" to key: ${JSON.stringify(keyConfig)}`
     );
@@ -755,6 +914,7 @@ class MotionRecorder {
   removeMotionKeyMapping(motionName) {
     const result = this.motionKeyMappings.delete(motionName);
     if (result) {
+      this.serverLibraryDirty = true;
       this.logDebug(`Removed key mapping for motion: ${motionName}`);
     }
     return result;
@@ -937,6 +1097,7 @@ class MotionRecorder {
 
       // Save motion data
       this.savedMotions.set(motionName, motionData);
+      this.invalidateMotion(motionName);
 
       // Import joint importance if available, otherwise initialize defaults
       if (motionData.importance) {
@@ -955,6 +1116,8 @@ class MotionRecorder {
         );
       }
 
+      this.storeMotion(motionName, true);
+
       this.logDebug(`Imported motion: ${motionName}`, {
         frames: motionData.sequence.length,
         metrics: motionData.metrics,
@@ -966,8 +1129,379 @@ class MotionRecorder {
     }
   }
 
+  // List the server's stored motions. Their frames are downloaded the first
+  // time a motion is used, so a large library costs nothing at startup
+  async loadMotionStore() {
+    let manifest;
+    try {
+      const response = await fetch(this.MOTION_STORE_URL);
+      manifest = await response.json();
+    } catch (error) {
+      this.logDebug(`Motion store unavailable: ${error.message}`);
+      return;
+    }
+
+    for (const motion of manifest.motions) {
+      this.storedMotions.add(motion.name);
+      // Motions recorded or imported meanwhile win over stored ones
+      if (this.savedMotions.has(motion.name)) continue;
+      if (motion.keyMapping) {
+        this.motionKeyMappings.set(motion.name, motion.keyMapping);
+      }
+      this.unloadedMotions.set(motion.name, motion);
+    }
+    this.logDebug(
+      `Motion store lists ${manifest.motions.length} motions, frames load on first use`
+    );
+  }
+
+  // A stored motion's data, downloading its frames the first time. A failed
+  // download rejects and leaves the motion listed, so it can be retried
+  loadStoredMotion(motionName) {
+    const motion = this.unloadedMotions.get(motionName);
+    if (motion && !this.motionLoads.has(motionName)) {
+      this.motionLoads.set(
+        motionName,
+        this.fetchStoredMotion(motion)
+          .then(
+            () => {
+              this.unloadedMotions.delete(motionName);
+              this.failedMotions.delete(motionName);
+            },
+            (error) => {
+              this.failedMotions.set(motionName, Date.now());
+              this.logDebug(
+                `Could not load stored motion ${motionName}: ${error.message}`
+              );
+              throw error;
+            }
+          )
+          .finally(() => this.motionLoads.delete(motionName))
+      );
+    }
+    return Promise.resolve(this.motionLoads.get(motionName)).then(() =>
+      this.savedMotions.get(motionName)
+    );
+  }
+
+  // Download every stored motion not loaded yet, once matching needs them all.
+  // Motions that failed recently wait STORE_RETRY_DELAY unless retryFailed.
+  // Resolves to the names that could not be loaded.
+  loadStoredMotions(retryFailed = false) {
+    if (!this.storeLoad) {
+      const now = Date.now();
+      const pending = Array.from(this.unloadedMotions.keys()).filter(
+        (motionName) =>
+          retryFailed ||
+          !(now - this.failedMotions.get(motionName) < this.STORE_RETRY_DELAY)
+      );
+      // Spotting asks on every frame while failed motions wait for a retry
+      if (pending.length === 0) return Promise.resolve([]);
+      const failed = [];
+      const download = async () => {
+        while (pending.length > 0) {
+          const motionName = pending.shift();
+          try {
+            await this.loadStoredMotion(motionName);
+          } catch (error) {
+            failed.push(motionName);
+          }
+        }
+      };
+      this.logDebug(`Loading ${pending.length} motions from the motion store`);
+      this.storeLoad = Promise.all(
+        Array.from({ length: this.STORE_FETCH_CONCURRENCY }, download)
+      ).then(() => {
+        this.storeLoad = null;
+        this.logDebug(
+          failed.length > 0
+            ? `Motion store loaded, ${failed.length} motions failed and stay listed for a retry`
+            : "Motion store loaded"
+        );
+        return failed;
+      });
+    }
+    return this.storeLoad;
+  }
+
+  // A motion the user asked for could not be downloaded
+  reportStoreError(motionName, error) {
+    alert(`Could not load stored motion ${motionName}: ${error.message}`);
+  }
+
+  async fetchStoredMotion(motion) {
+    const response = await fetch(
+      `${this.MOTION_STORE_URL}/${encodeURIComponent(motion.name)}`
+    );
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    const sequence = this.unpackMotion(await response.arrayBuffer());
+    if (this.savedMotions.has(motion.name)) return false;
+
+    this.savedMotions.set(motion.name, {
+      sequence,
+      metrics: this.calculateMotionMetrics(sequence),
+      relativeMotion: this.calculateRelativeMotionData(sequence),
+    });
+    if (Object.keys(motion.importance || {}).length > 0) {
+      this.jointImportance.set(motion.name, motion.importance);
+    } else {
+      this.initializeDefaultJointImportance(motion.name);
+    }
+    this.invalidateMotion(motion.name);
+    return true;
+  }
+
+  // Frames of a motion file, laid out as described in input/motion_store.py
+  unpackMotion(buffer) {
+    const header = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    const version = header.getUint16(4, true);
+    if (magic !== "MMOT" || version !== 1) {
+      throw new Error("Not a version 1 motion file");
+    }
+    const landmarks = header.getUint16(6, true);
+    const frames = header.getUint32(8, true);
+    const values = new Float32Array(buffer, 12, frames * (1 + landmarks * 4));
+
+    const size = frames * landmarks;
+    const sequence = [];
+    for (let i = 0; i < frames; i++) {
+      const pose = [];
+      for (let j = i * landmarks; j < (i + 1) * landmarks; j++) {
+        pose.push({
+          x: values[frames + j],
+          y: values[frames + size + j],
+          z: values[frames + 2 * size + j],
+          visibility: values[frames + 3 * size + j],
+        });
+      }
+      sequence.push({ timestamp: values[i], pose, controller: null });
+    }
+    return sequence;
+  }
+
+  // Save a motion in the motion store, with its frames when they changed
+  storeMotion(motionName, withFrames = false) {
+    this.storeQueue.set(
+      motionName,
+      withFrames || this.storeQueue.get(motionName) === true
+    );
+    // Importance sliders move many times a second, save once they settle
+    clearTimeout(this.storeTimer);
+    this.storeTimer = setTimeout(
+      () => this.flushMotionStore(),
+      this.STORE_DELAY
+    );
+  }
+
+  // Send queued motions to the store, called again once the server connects
+  flushMotionStore() {
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+
+    for (const [motionName, framesChanged] of this.storeQueue) {
+      const motionData = this.savedMotions.get(motionName);
+      if (!motionData) continue;
+
+      const message = {
+        type: "store_motion",
+        name: motionName,
+        keyMapping: this.motionKeyMappings.get(motionName) || null,
+        importance: this.jointImportance.get(motionName) || {},
+      };
+      if (framesChanged || !this.storedMotions.has(motionName)) {
+        message.timestamps = motionData.sequence.map((frame) => frame.timestamp);
+        message.poses = motionData.sequence.map((frame) =>
+          frame.pose.flatMap((landmark) => [
+            landmark.x,
+            landmark.y,
+            landmark.z || 0,
+            landmark.visibility ?? 1,
+          ])
+        );
+        this.storedMotions.add(motionName);
+      }
+      ws.send(JSON.stringify(message));
+    }
+    this.logDebug(`Saved ${this.storeQueue.size} motions to the motion store`);
+    this.storeQueue.clear();
+  }
+
+  // Matching settings, named like DEFAULT_SETTINGS in input/motion_recognition.py
+  getMatchSettings() {
+    return {
+      threshold: this.SEQUENCE_MATCH_THRESHOLD,
+      cooldown: this.MOTION_COOLDOWN,
+      minMovement: this.MIN_MOVEMENT_MAGNITUDE,
+      minDuration: this.MIN_MOTION_DURATION,
+      durationWeight: this.DURATION_MATCH_WEIGHT,
+      durationTolerance: this.DURATION_TOLERANCE,
+      keyPhaseWeight: this.KEY_PHASE_WEIGHT,
+      candidates: this.PREFILTER_CANDIDATES,
+    };
+  }
+
+  // Saved motions as a motion_library message for server-side recognition
+  getServerMotionLibrary() {
+    const motions = [];
+    for (const [motionName, motionData] of this.savedMotions.entries()) {
+      motions.push({
+        name: motionName,
+        frames: motionData.relativeMotion.map((frame) => ({
+          timestamp: frame.timestamp,
+          jointAngles: frame.jointAngles,
+          jointDistances: frame.jointDistances,
+        })),
+        importance: this.jointImportance.get(motionName) || {},
+        keyMapping: this.motionKeyMappings.get(motionName) || null,
+      });
+    }
+    return {
+      type: "motion_library",
+      motions: motions,
+      settings: this.getMatchSettings(),
+    };
+  }
+
+  // Send a trigger sequence to the server, which matches it and presses the keys
+  requestServerRecognition(sequence) {
+    if (!ws || ws.readyState !== WebSocket.OPEN) {
+      this.logDebug("WebSocket not connected, can't recognize on the server");
+      return null;
+    }
+
+    // The library only travels when it changed, sequences reference it
+    if (this.serverLibraryDirty) {
+      ws.send(JSON.stringify(this.getServerMotionLibrary()));
+      this.serverLibraryDirty = false;
+      this.logDebug(`Sent ${this.savedMotions.size} motions to the server`);
+    }
+
+    ws.send(
+      JSON.stringify({
+        type: "pose_sequence",
+        timestamps: sequence.map((frame) => frame.timestamp),
+        poses: sequence.map((frame) =>
+          frame.pose.flatMap((landmark) => [landmark.x, landmark.y, landmark.z])
+        ),
+        settings: this.getMatchSettings(),
+      })
+    );
+    this.logDebug(`Sent ${sequence.length} frames for server recognition`);
+    return null;
+  }
+
+  // Handle a motion_result message from the server
+  handleServerResult(result) {
+    if (result.motion) {
+      this.lastDetectionTime = Date.now();
+      this.lastDetectedMotion = result.motion;
+      this.logDebug(
+        `MOTION DETECTED (server): ${result.motion} (score: ${result.score.toFixed(
+          2
+        )})`,
+        { allMatches: result.matches }
+      );
+    } else {
+      this.logDebug(`No motion matched on the server (${result.reason})`, {
+        bestMatches: result.matches,
+      });
+    }
+  }
+
+  // Coarse features for the candidate pre-filter: the share of all movement
+  // per angle and distance, the net direction of each, and the log duration
+  calculateMotionSummary(relativeMotion) {
+    if (this.motionSummaries.has(relativeMotion)) {
+      return this.motionSummaries.get(relativeMotion);
+    }
+    if (relativeMotion.length < 2) return null;
+
+    const angleKeys = Object.keys(relativeMotion[1].angleChanges);
+    const distanceKeys = Object.keys(relativeMotion[1].distanceChanges);
+    const energy = new Array(angleKeys.length + distanceKeys.length).fill(0);
+    const net = new Array(energy.length).fill(0);
+    for (let i = 1; i < relativeMotion.length; i++) {
+      const frame = relativeMotion[i];
+      const changes = [
+        ...angleKeys.map((key) => frame.angleChanges[key]),
+        ...distanceKeys.map((key) => frame.distanceChanges[key] * 10),
+      ];
+      changes.forEach((change, j) => {
+        energy[j] += Math.abs(change);
+        net[j] += change;
+      });
+    }
+
+    const total = energy.reduce((sum, value) => sum + value, 0);
+    const duration =
+      relativeMotion[relativeMotion.length - 1].timestamp -
+      relativeMotion[0].timestamp;
+    const summary = [
+      ...energy.map((value) => (total > 0 ? value / total : 0)),
+      ...net.map((value, j) => (value / Math.max(energy[j], 1e-9)) * 0.5),
+      Math.log1p(Math.max(duration, 0) / 1000) * 0.5,
+    ];
+    this.motionSummaries.set(relativeMotion, summary);
+    return summary;
+  }
+
+  // Saved motions worth comparing in full: the PREFILTER_CANDIDATES with the
+  // nearest summaries, skipping those whose duration alone rules out a match
+  selectCandidateMotions(relativeMotion) {
+    const motionNames = Array.from(this.savedMotions.keys());
+    const summary = this.calculateMotionSummary(relativeMotion);
+    if (
+      !summary ||
+      !this.PREFILTER_CANDIDATES ||
+      motionNames.length <= this.PREFILTER_CANDIDATES
+    ) {
+      return motionNames;
+    }
+
+    const durationOf = (motion) =>
+      motion[motion.length - 1].timestamp - motion[0].timestamp;
+    const currentDuration = durationOf(relativeMotion);
+    const ranked = [];
+    motionNames.forEach((motionName, index) => {
+      const savedRelativeMotion = this.savedMotions.get(motionName).relativeMotion;
+      const saved = this.calculateMotionSummary(savedRelativeMotion);
+      if (!saved) return;
+
+      const savedDuration = durationOf(savedRelativeMotion);
+      const maxDuration = Math.max(currentDuration, savedDuration);
+      if (
+        Math.abs(currentDuration - savedDuration) / maxDuration > 0.7 &&
+        maxDuration > 500
+      ) {
+        return;
+      }
+
+      let distance = 0;
+      for (let j = 0; j < summary.length; j++) {
+        distance += (summary[j] - saved[j]) ** 2;
+      }
+      ranked.push({ index, distance });
+    });
+
+    // Keep library order so ties resolve as without the pre-filter
+    return ranked
+      .sort((a, b) => a.distance - b.distance)
+      .slice(0, this.PREFILTER_CANDIDATES)
+      .sort((a, b) => a.index - b.index)
+      .map(({ index }) => motionNames[index]);
+  }
+
   // Process a motion sequence after trigger release
   processMotionSequence(sequence) {
+    if (this.unloadedMotions.size > 0) {
+      this.logDebug(
+        `${this.unloadedMotions.size} stored motions are not loaded yet`
+      );
+    }
+    if (this.SERVER_RECOGNITION) {
+      return this.requestServerRecognition(sequence);
+    }
+
     const currentTime = Date.now();
 
     // Check for cooldown period
@@ -1023,7 +1557,15 @@ class MotionRecorder {
     // Store all matches above a minimum threshold for debugging
     const allMatches = [];
 
-    for (const [motionName, motionData] of this.savedMotions.entries()) {
+    const candidates = this.selectCandidateMotions(relativeMotionData);
+    if (candidates.length < this.savedMotions.size) {
+      this.logDebug(
+        `Comparing ${candidates.length} of ${this.savedMotions.size} motions`
+      );
+    }
+
+    for (const motionName of candidates) {
+      const motionData = this.savedMotions.get(motionName);
       const {
         sequence: savedSequence,
         metrics: savedMetrics,
@@ -1077,6 +1619,8 @@ class MotionRecorder {
       }
     }
 
+    this.updateCacheStatsUI();
+
     if (bestMatch) {
       this.lastDetectionTime = currentTime;
       this.lastDetectedMotion = bestMatch;
@@ -1229,6 +1773,78 @@ class MotionRecorder {
     return result;
   }
 
+  // A motion was recorded, imported or had its importance changed
+  invalidateMotion(motionName) {
+    this.unloadedMotions.delete(motionName);
+    this.motionVersions.set(
+      motionName,
+      (this.motionVersions.get(motionName) || 0) + 1
+    );
+    for (const [key, entry] of this.templateCache) {
+      if (entry.motionName === motionName) {
+        this.templateCache.delete(key);
+      }
+    }
+    this.serverLibraryDirty = true;
+    this.spotterDirty = true;
+  }
+
+  // Resampled frames and phase importance for comparing at sampleCount
+  preprocessMotion(relativeMotion, sampleCount) {
+    return {
+      sampled: this.resampleRelativeMotion(relativeMotion, sampleCount),
+      phaseImportance: this.resampleArray(
+        this.calculatePhaseImportance(relativeMotion),
+        relativeMotion.length,
+        sampleCount
+      ),
+    };
+  }
+
+  // The gesture side, reused while it is compared with every saved motion
+  getPreprocessedSequence(relativeMotion, sampleCount) {
+    let byCount = this.sequenceSamples.get(relativeMotion);
+    if (!byCount) {
+      byCount = new Map();
+      this.sequenceSamples.set(relativeMotion, byCount);
+    }
+    if (!byCount.has(sampleCount)) {
+      byCount.set(sampleCount, this.preprocessMotion(relativeMotion, sampleCount));
+    }
+    return byCount.get(sampleCount);
+  }
+
+  // The saved side of compareRelativeMotions(): resampled frames and phase
+  // importance, which only change when the motion is edited
+  getPreprocessedTemplate(motionName, savedRelativeMotion, sampleCount) {
+    const key = JSON.stringify([
+      motionName,
+      sampleCount,
+      this.motionVersions.get(motionName) || 0,
+      this.KEY_PHASE_WEIGHT,
+    ]);
+    const cached = this.templateCache.get(key);
+    if (cached) {
+      // Move to the back of the Map, the most recently used end
+      this.templateCache.delete(key);
+      this.templateCache.set(key, cached);
+      this.templateCacheStats.hits++;
+      return cached;
+    }
+
+    this.templateCacheStats.misses++;
+    const entry = {
+      motionName,
+      ...this.preprocessMotion(savedRelativeMotion, sampleCount),
+    };
+    this.templateCache.set(key, entry);
+    while (this.templateCache.size > this.TEMPLATE_CACHE_SIZE) {
+      this.templateCache.delete(this.templateCache.keys().next().value);
+      this.templateCacheStats.evictions++;
+    }
+    return entry;
+  }
+
   compareRelativeMotions(
     currentRelativeMotion,
     savedRelativeMotion,
@@ -1282,38 +1898,28 @@ class MotionRecorder {
       }
     }
 
-    // Calculate phase importance for both motions
-    const currentPhaseImportance = this.calculatePhaseImportance(
-      currentRelativeMotion
-    );
-    const savedPhaseImportance =
-      this.calculatePhaseImportance(savedRelativeMotion);
-
-    // Resample to have same number of frames for comparison
+    // Resample both motions (and their phase importance) to the same
+    // number of frames. The saved side comes from the template cache when
+    // this is a saved motion.
     const sampleCount = Math.min(
       20,
       Math.min(currentRelativeMotion.length, savedRelativeMotion.length)
     );
-    const currentSampled = this.resampleRelativeMotion(
-      currentRelativeMotion,
-      sampleCount
-    );
-    const savedSampled = this.resampleRelativeMotion(
-      savedRelativeMotion,
-      sampleCount
-    );
-
-    // Resample phase importance arrays to match new sample count
-    const currentPhaseImportanceResampled = this.resampleArray(
-      currentPhaseImportance,
-      currentRelativeMotion.length,
-      sampleCount
-    );
-    const savedPhaseImportanceResampled = this.resampleArray(
-      savedPhaseImportance,
-      savedRelativeMotion.length,
-      sampleCount
-    );
+    const {
+      sampled: currentSampled,
+      phaseImportance: currentPhaseImportanceResampled,
+    } = this.getPreprocessedSequence(currentRelativeMotion, sampleCount);
+    const {
+      sampled: savedSampled,
+      phaseImportance: savedPhaseImportanceResampled,
+    } =
+      this.savedMotions.get(motionName)?.relativeMotion === savedRelativeMotion
+        ? this.getPreprocessedTemplate(
+            motionName,
+            savedRelativeMotion,
+            sampleCount
+          )
+        : this.preprocessMotion(savedRelativeMotion, sampleCount);
 
     // Track component-wise similarity scores
     const angleScores = [];
@@ -1782,6 +2388,13 @@ class MotionRecorder {
   }
 
   startPlayback(motionName) {
+    if (this.unloadedMotions.has(motionName)) {
+      this.loadStoredMotion(motionName).then(
+        () => this.startPlayback(motionName),
+        (error) => this.reportStoreError(motionName, error)
+      );
+      return;
+    }
     const motionData = this.savedMotions.get(motionName);
     if (
       !motionData ||
@@ -2184,6 +2797,13 @@ class MotionRecorder {
 
   // Visualization and export methods
   visualizeMotion(motionName) {
+    if (this.unloadedMotions.has(motionName)) {
+      this.loadStoredMotion(motionName).then(
+        () => this.visualizeMotion(motionName),
+        (error) => this.reportStoreError(motionName, error)
+      );
+      return;
+    }
     const motionData = this.savedMotions.get(motionName);
     if (!motionData || !motionData.sequence) {
       this.logDebug(`No motion data found for: ${motionName}`);
@@ -2419,6 +3039,13 @@ class MotionRecorder {
   }
 
   exportMotion(motionName) {
+    if (this.unloadedMotions.has(motionName)) {
+      this.loadStoredMotion(motionName).then(
+        () => this.exportMotion(motionName),
+        (error) => this.reportStoreError(motionName, error)
+      );
+      return;
+    }
     const motionData = this.savedMotions.get(motionName);
     if (!motionData) {
       this.logDebug(`Cannot export: No motion data for ${motionName}`);
@@ -2469,6 +3096,7 @@ class MotionRecorder {
 
       // Save motion data
       this.savedMotions.set(motionName, motionData);
+      this.invalidateMotion(motionName);
 
       // Import joint importance if available, otherwise initialize defaults
       if (motionData.importance) {
@@ -2479,6 +3107,8 @@ class MotionRecorder {
         this.logDebug("Initialized default joint importance (none in import)");
       }
 
+      this.storeMotion(motionName, true);
+
       this.logDebug(`Imported motion: ${motionName}`, {
         frames: motionData.sequence.length,
         metrics: motionData.metrics,
@@ -2490,6 +3120,6 @@ class MotionRecorder {
     }
   }
   listSavedMotions() {
-    return Array.from(this.savedMotions.keys());
+    return [...this.savedMotions.keys(), ...this.unloadedMotions.keys()];
   }
 }
@@ -39,6 +39,9 @@ function logDebug(message) {
   }
 }
 
+// Controller snapshots per second requested from the input server
+const CONTROLLER_RATE = 30;
+
 let lastControllerData = {
   leftController: null,
   rightController: null,
@@ -50,6 +53,18 @@ function connectWebSocket() {
   ws.onopen = () => {
     console.log("WebSocket connection established");
     logDebug("WebSocket connected");
+    // The server may have restarted without our motions
+    motionRecorder.serverLibraryDirty = true;
+    motionRecorder.flushMotionStore();
+    // Controller state is sampled once per camera frame, more is wasted.
+    // Presses and releases still arrive at once.
+    ws.send(
+      JSON.stringify({
+        type: "subscribe",
+        topics: ["leftController", "rightController"],
+        rate: CONTROLLER_RATE,
+      })
+    );
   };
 
   ws.onclose = (event) => {
@@ -66,6 +81,30 @@ function connectWebSocket() {
   ws.onmessage = (event) => {
     try {
       const data = JSON.parse(event.data);
+
+      // Replies to server-side motion recognition, not controller data
+      if (data.type === "motion_result") {
+        motionRecorder.handleServerResult(data);
+        return;
+      }
+      if (data.type === "motion_library") {
+        if (data.error) {
+          logDebug(`Server motion recognition unavailable: ${data.error}`);
+        }
+        return;
+      }
+      if (data.type === "motion_stored") {
+        if (data.error) {
+          logDebug(`Could not store motion ${data.name}: ${data.error}`);
+        }
+        return;
+      }
+      if (data.type === "subscribed") {
+        if (data.error) {
+          logDebug(`Controller subscription failed: ${data.error}`);
+        }
+        return;
+      }
       lastControllerData = data;
 
       // Track left trigger state for motion detection
@@ -603,8 +642,12 @@ document.getElementById("exportMotionBtn").addEventListener("click", () => {
   }
 });
 
-document.getElementById("exportAllMotionsBtn").addEventListener("click", () => {
-  const savedMotions = motionRecorder.listSavedMotions();
+document.getElementById("exportAllMotionsBtn").addEventListener("click", async () => {
+  const failed = await motionRecorder.loadStoredMotions(true);
+  if (failed.length > 0) {
+    alert(`Could not load stored motions: ${failed.join(", ")}`);
+  }
+  const savedMotions = Array.from(motionRecorder.savedMotions.keys());
   if (savedMotions.length === 0) {
     alert("No saved motions available to export!");
     return;
@@ -1706,6 +1749,15 @@ function createMotionMappingUI() {
 
 // Joint Importance UI function
 function createJointImportanceUI(motionName) {
+  // The sliders are keyed by the motion's joints, stored frames load first
+  if (motionRecorder.unloadedMotions.has(motionName)) {
+    motionRecorder.loadStoredMotion(motionName).then(
+      () => createJointImportanceUI(motionName),
+      (error) => motionRecorder.reportStoreError(motionName, error)
+    );
+    return;
+  }
+
   // Check if UI already exists and remove it
   const existingUI = document.getElementById("joint-importance-ui");
   if (existingUI) {
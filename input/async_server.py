@@ -0,0 +1,266 @@
+# input/async_server.py
+"""asyncio server mode for the /ws protocol.
+
+Every connection is served by three tasks on one event loop: a reader that
+pulls messages off the socket into a bounded inbox, a processor that hands
+everything waiting in the inbox to the session at once, so stale controller
+frames are coalesced, and a writer that drains the client's broadcast
+queue. When the inbox is full the reader stops reading, so a slow handler
+pushes back on the client through TCP instead of buffering frames without
+limit. Batches the session reports as slow, motion recognition and file
+writes, are handled on an executor thread so the loop keeps serving the
+other connections.
+"""
+import asyncio
+import threading
+import time
+import urllib.parse
+
+from broadcast import Channel
+from event_log import log
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# Messages waiting to be processed per connection before the reader blocks
+INBOX_SIZE = 8
+# Messages waiting to be sent per connection before the oldest is dropped
+OUTBOX_SIZE = 16
+
+# Stats of the currently open connections, keyed by connection id
+connections = {}
+
+
+class ConnectionStats:
+    """Counters and timings for one connection"""
+
+    def __init__(self, connection_id, remote):
+        self.connection_id = connection_id
+        self.remote = remote
+        self.messages = 0
+        self.batches = 0
+        self.max_inbox_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_handle = 0.0
+        self.max_handle = 0.0
+
+    def as_dict(self):
+        count = self.messages or 1
+        batches = self.batches or 1
+        return {
+            'id': self.connection_id,
+            'remote': self.remote,
+            'messages': self.messages,
+            'max_inbox_depth': self.max_inbox_depth,
+            'avg_wait_ms': self.total_wait / count * 1000,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches': self.batches,
+            'avg_handle_ms': self.total_handle / batches * 1000,
+            'max_handle_ms': self.max_handle * 1000,
+        }
+
+
+class AsyncClient(Channel):
+    """Broadcast channel drained by a writer task on the event loop.
+
+    put() never awaits, so the session publishing a frame is not held up
+    by this client; the oldest queued message is dropped when it is full.
+    """
+
+    def __init__(self, websocket, outbox_size=OUTBOX_SIZE):
+        super().__init__(outbox_size)
+        self.websocket = websocket
+        self.ready = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.get_ident()
+
+    def put(self, message, droppable=True):
+        if threading.get_ident() != self.thread:
+            # Published from a server thread, e.g. metrics: the queue is only
+            # touched on the loop, which the writer drains without a lock
+            self.loop.call_soon_threadsafe(self.put, message, droppable)
+            return
+        self.push(message, droppable)
+        self.ready.set()
+
+    async def writer(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            if self.overflowed:
+                await self.websocket.close(code=1008, reason="Too many undelivered messages")
+                return
+            while self.queue:
+                message, _ = self.queue.popleft()
+                await self.websocket.send(message)
+                self.sent += 1
+
+
+def request_path(websocket):
+    request = getattr(websocket, 'request', None)
+    if request is not None:
+        return request.path
+    return getattr(websocket, 'path', '/ws')
+
+
+async def reader(websocket, inbox, stats):
+    async for message in websocket:
+        # Blocks when the processor is behind, which stops reading the socket
+        await inbox.put((message, time.perf_counter()))
+        stats.max_inbox_depth = max(stats.max_inbox_depth, inbox.qsize())
+
+
+async def processor(session, inbox, stats):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await inbox.get()]
+        # Frames that queued up while the last batch was handled are coalesced
+        while not inbox.empty():
+            batch.append(inbox.get_nowait())
+        started = time.perf_counter()
+        if session.is_slow(batch):
+            # Motion recognition and file writes would stall every other connection
+            handled = loop.run_in_executor(None, session.handle_messages, batch)
+            try:
+                await asyncio.shield(handled)
+            except asyncio.CancelledError:
+                # The session is closed after this, not while the thread still uses it
+                await handled
+                raise
+        else:
+            session.handle_messages(batch)
+        finished = time.perf_counter()
+
+        handle = finished - started
+        stats.messages += len(batch)
+        stats.batches += 1
+        for _, received_at in batch:
+            wait = started - received_at
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+        stats.total_handle += handle
+        stats.max_handle = max(stats.max_handle, handle)
+
+
+def make_handler(session_factory, inbox_size, outbox_size):
+    next_id = 0
+
+    async def handler(websocket, path=None):
+        nonlocal next_id
+        if (path or request_path(websocket)) != '/ws':
+            await websocket.close(code=1008, reason="Unknown path")
+            return
+
+        next_id += 1
+        stats = ConnectionStats(next_id, str(websocket.remote_address))
+        connections[stats.connection_id] = stats
+        client = AsyncClient(websocket, outbox_size)
+        inbox = asyncio.Queue(inbox_size)
+        session = session_factory(client)
+        session.open()
+
+        tasks = [
+            asyncio.ensure_future(reader(websocket, inbox, stats)),
+            asyncio.ensure_future(processor(session, inbox, stats)),
+            asyncio.ensure_future(client.writer()),
+        ]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None or isinstance(error, websockets.ConnectionClosed):
+                    log.info('closed', "WebSocket connection closed normally", connection=stats.connection_id)
+                else:
+                    log.warning('websocket_error', "WebSocket error: {error}",
+                                connection=stats.connection_id, error=error)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            session.close()
+            del connections[stats.connection_id]
+            log.info('connection_stats', "Connection stats: {stats} outbound: {outbound}",
+                     connection=stats.connection_id, stats=stats.as_dict(), outbound=client.stats())
+
+    return handler
+
+
+def find_route(http_routes, path):
+    """The route answering a request path and its arguments.
+
+    A route ending in '/' answers every path below it and gets the rest of
+    the path, unquoted, as its argument.
+    """
+    path = urllib.parse.urlsplit(path).path
+    if path in http_routes:
+        return http_routes[path], ()
+    for prefix, route in http_routes.items():
+        if prefix.endswith('/') and path.startswith(prefix) and len(path) > len(prefix):
+            return route, (urllib.parse.unquote(path[len(prefix):]),)
+    return None, ()
+
+
+def route_response(route, args):
+    """(status, headers, body) of a route, text is served as JSON and bytes as binary"""
+    body = route(*args)
+    # The camera page is served from another port
+    headers = [('Access-Control-Allow-Origin', '*')]
+    if body is None:
+        return 404, headers + [('Content-Type', 'text/plain')], b"Not found"
+    if isinstance(body, str):
+        return 200, headers + [('Content-Type', 'application/json')], body.encode()
+    return 200, headers + [('Content-Type', 'application/octet-stream')], bytes(body)
+
+
+def make_process_request(http_routes):
+    """Answer plain HTTP GETs such as /metrics on the websocket port.
+
+    Supports both the current websockets API, process_request(connection,
+    request), and the legacy one, process_request(path, headers).
+    """
+    def process_request(*args):
+        if hasattr(args[0], 'respond'):
+            connection, request = args
+            route, route_args = find_route(http_routes, request.path)
+            if route is None:
+                return None
+            status, headers, body = route_response(route, route_args)
+            response = connection.respond(status, "")
+            response.body = body
+            for name, value in headers + [('Content-Length', str(len(body)))]:
+                response.headers.pop(name, None)
+                response.headers[name] = value
+            return response
+
+        path, _ = args
+        route, route_args = find_route(http_routes, path)
+        if route is None:
+            return None
+        return route_response(route, route_args)
+
+    return process_request
+
+
+async def serve(session_factory, host, port, inbox_size, outbox_size, http_routes):
+    handler = make_handler(session_factory, inbox_size, outbox_size)
+    # max_queue bounds the library's own receive buffer so backpressure
+    # reaches the client instead of piling up frames in memory
+    async with websockets.serve(handler, host, port, max_queue=inbox_size,
+                                process_request=make_process_request(http_routes)):
+        await asyncio.Future()
+
+
+def run_async_server(session_factory, host='127.0.0.1', port=5000,
+                     inbox_size=INBOX_SIZE, outbox_size=OUTBOX_SIZE, http_routes=None):
+    """Serve /ws on a single asyncio event loop until interrupted.
+
+    http_routes maps paths to functions returning a JSON string or bytes,
+    served to plain HTTP requests on the same port. Paths ending in '/'
+    match every path below them, see find_route().
+    """
+    if websockets is None:
+        raise RuntimeError("asyncio mode needs the websockets package (pip install websockets)")
+    asyncio.run(serve(session_factory, host, port, inbox_size, outbox_size, http_routes or {}))
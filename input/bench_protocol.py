@@ -0,0 +1,96 @@
+# input/bench_protocol.py
+"""Decode throughput of JSON versus binary controller frames.
+
+Generates a synthetic session of controller frames at the headset frame rate
+(sticks sweeping, buttons pressed now and then), encodes it both ways and
+times decoding plus the field reads the frame handler does.
+
+    python bench_protocol.py --frames 120000
+"""
+import argparse
+import json
+import math
+import time
+
+from controller_protocol import ControllerFrameDecoder, ControllerFrameEncoder
+
+
+def generate_frames(count, rate=120):
+    frames = []
+    for i in range(count):
+        t = i / rate
+        # Move the left stick for a few seconds, then rest, like walking around
+        moving = (i // (rate * 3)) % 2 == 0
+        left_x = round(math.sin(t * 1.3), 4) if moving else 0
+        left_y = round(-abs(math.cos(t * 0.7)), 4) if moving else 0
+        # Camera turns on the right stick come in short bursts
+        turning = (i // (rate // 2)) % 4 == 0
+        right_x = round(math.sin(t * 4.0) * 0.8, 4) if turning else 0
+        pressed = 1 if (i // 45) % 7 == 0 else 0
+        frames.append({
+            'seq': i & 0xFFFF,
+            't': 1.7e12 + t * 1000,
+            'leftController': {
+                'axes': [left_x, left_y],
+                'buttons': {'X': 0, 'Y': pressed, 'trigger': 0, 'grip': 0, 'thumbstick': 0},
+            },
+            'rightController': {
+                'axes': [right_x, 0],
+                'buttons': {'A': 0, 'B': 0, 'trigger': pressed * 0.8, 'grip': 0, 'thumbstick': 0},
+            },
+        })
+    return frames
+
+
+def read_fields(data):
+    """Touch the same fields the frame handler reads"""
+    left = data['leftController']
+    right = data['rightController']
+    total = data['seq'] + data['t']
+    total += left['axes'][0] + left['axes'][1] + right['axes'][0] + right['axes'][1]
+    buttons = left['buttons']
+    total += buttons.get('Y', 0) + buttons.get('X', 0) + buttons.get('thumbstick', 0)
+    buttons = right['buttons']
+    total += buttons.get('grip', 0) + buttons.get('trigger', 0) + buttons.get('thumbstick', 0)
+    return total
+
+
+def bench(name, messages, decode, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            read_fields(decode(message))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    size = sum(len(message) for message in messages) / len(messages)
+    per_frame = best / len(messages) * 1e6
+    print(f"{name:8} {size:8.1f} B/frame {per_frame:8.2f} us/frame "
+          f"{len(messages) / best:12,.0f} frames/s")
+    return per_frame, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=60000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keyframe-interval', type=int, default=90)
+    args = parser.parse_args()
+
+    frames = generate_frames(args.frames)
+    json_messages = [json.dumps(frame) for frame in frames]
+    encoder = ControllerFrameEncoder(args.keyframe_interval)
+    binary_messages = [encoder.encode(frame, frame['t']) for frame in frames]
+
+    json_time, json_size = bench('json', json_messages, json.loads, args.repeat)
+
+    def decode_binary(message, decoder=ControllerFrameDecoder()):
+        return decoder.decode(message)
+
+    binary_time, binary_size = bench('binary', binary_messages, decode_binary, args.repeat)
+    print(f"binary is {json_time / binary_time:.2f}x faster to decode "
+          f"and {json_size / binary_size:.1f}x smaller on the wire")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# input/bench_recognition.py
+"""Recognition latency and candidate pre-filter recall on synthetic libraries.
+
+Builds motion libraries of several sizes from random synthetic motions,
+half of them variants of others (same joints, different swings and
+timing), then recognizes noisy, re-timed performances of library motions
+and some unrelated motions with the pre-filter keeping different numbers
+of candidates. Recall is the share of performances whose motion is among
+the candidates, agreement the share of queries with the same outcome as
+scoring every template, correct the share recognized as what was
+performed.
+
+    python bench_recognition.py
+    python bench_recognition.py --sizes 500 --candidates 0 16 32
+"""
+import argparse
+import time
+
+from motion_recognition import (KEY_JOINTS, LANDMARKS, MotionLibrary, MotionRecognizer, Template,
+                                frame_changes, joint_features, motion_summary, np, require_numpy)
+
+FRAME_INTERVAL = 33.3  # ms, the camera page records at 30 fps
+
+
+def random_motion(rng, like=None):
+    """A motion: a resting pose and a few joints swinging along their own paths.
+
+    With `like`, a variant moving the same joints differently.
+    """
+    if like is not None:
+        return dict(like,
+                    amplitude=like['amplitude'] * rng.uniform(0.5, 1.5, like['amplitude'].shape),
+                    phase=like['phase'] + rng.uniform(-0.5, 0.5, len(like['joints'])),
+                    duration=like['duration'] * rng.uniform(0.7, 1.3))
+    base = rng.uniform(0.3, 0.7, (LANDMARKS, 3))
+    base[:, 2] *= 0.2
+    joints = rng.choice(KEY_JOINTS, size=rng.integers(2, 6), replace=False)
+    return {
+        'base': base,
+        'joints': joints,
+        'amplitude': rng.uniform(-0.15, 0.15, (len(joints), 3)),
+        'frequency': rng.uniform(0.5, 2.0, len(joints)),
+        'phase': rng.uniform(0, np.pi, len(joints)),
+        'duration': rng.uniform(400, 2500),
+    }
+
+
+def perform(rng, motion, tempo=1.0, scale=1.0, noise=0.0):
+    """Timestamps and flat poses of one performance of a motion"""
+    duration = motion['duration'] * tempo
+    frames = max(5, int(duration / FRAME_INTERVAL) + 1)
+    times = np.cumsum(np.r_[0, rng.uniform(0.8, 1.2, frames - 1) * FRAME_INTERVAL])
+    progress = times / times[-1]
+    poses = np.repeat(motion['base'][None], frames, axis=0)
+    swing = np.sin(2 * np.pi * motion['frequency'][None] * progress[:, None] + motion['phase'][None])
+    poses[:, motion['joints']] += swing[:, :, None] * motion['amplitude'][None] * scale
+    poses += rng.normal(0, noise, poses.shape)
+    return times, poses
+
+
+def build_library(rng, size, variants=0.5):
+    motions = []
+    for _ in range(size):
+        like = motions[rng.integers(len(motions))] if motions and rng.random() < variants else None
+        motions.append(random_motion(rng, like))
+    templates = []
+    for index, motion in enumerate(motions):
+        times, poses = perform(rng, motion, noise=0.002)
+        angles, distances = joint_features(poses)
+        templates.append(Template(f"motion{index}", times, angles, distances))
+    return motions, MotionLibrary(templates)
+
+
+def build_queries(rng, motions, count, unrelated=0.2):
+    """(expected name or None, timestamps, poses) for each query"""
+    queries = []
+    for _ in range(count):
+        if rng.random() < unrelated:
+            times, poses = perform(rng, random_motion(rng), noise=0.004)
+            queries.append((None, times, poses))
+        else:
+            index = int(rng.integers(len(motions)))
+            times, poses = perform(rng, motions[index], tempo=rng.uniform(0.85, 1.15),
+                                   scale=rng.uniform(0.85, 1.15), noise=0.004)
+            queries.append((f"motion{index}", times, poses))
+    return queries
+
+
+def candidate_recall(library, queries, candidates):
+    """Share of library motion performances whose template is among the candidates"""
+    names = [template.name for template in library.templates]
+    found = total = 0
+    for name, times, poses in queries:
+        if name is None:
+            continue
+        angles, distances = joint_features(poses)
+        duration = times[-1] - times[0]
+        indexes = library.candidates(motion_summary(duration, *frame_changes(angles, distances)),
+                                     duration, candidates)
+        total += 1
+        found += indexes is None or names.index(name) in indexes
+    return found / max(total, 1)
+
+
+def run(recognizer, queries, candidates):
+    """Outcome and latency of each query with a candidate count"""
+    settings = dict(recognizer.settings, candidates=candidates)
+    outcomes = []
+    timings = []
+    for _, times, poses in queries:
+        recognizer.last_detection = None
+        started = time.perf_counter()
+        result = recognizer.recognize(times, poses.reshape(len(times), -1), 0, settings)
+        timings.append(time.perf_counter() - started)
+        outcomes.append(result['motion'])
+    timings.sort()
+    return outcomes, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 300, 600],
+                        help="Library sizes to test")
+    parser.add_argument('--candidates', type=int, nargs='+', default=[0, 8, 16, 24, 48],
+                        help="Candidate counts to test, 0 scores every template")
+    parser.add_argument('--queries', type=int, default=200, help="Queries per library")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    require_numpy()
+
+    print(f"{'templates':>9} {'candidates':>10} {'mean ms':>8} {'p99 ms':>7} {'recall':>7} "
+          f"{'agree':>6} {'correct':>8}")
+    for size in args.sizes:
+        rng = np.random.default_rng(args.seed)
+        motions, library = build_library(rng, size)
+        queries = build_queries(rng, motions, args.queries)
+        recognizer = MotionRecognizer()
+        recognizer.library = library
+
+        # Warm the resampled template cache so every run measures scoring only
+        run(recognizer, queries[:20], 0)
+        reference, _ = run(recognizer, queries, 0)
+        for candidates in args.candidates:
+            outcomes, timings = run(recognizer, queries, candidates)
+            recall = candidate_recall(library, queries, candidates)
+            agree = sum(a == b for a, b in zip(outcomes, reference)) / len(queries)
+            correct = sum(outcome == query[0] for outcome, query in zip(outcomes, queries)) / len(queries)
+            mean = sum(timings) / len(timings) * 1000
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+            print(f"{size:>9} {candidates or 'all':>10} {mean:>8.2f} {p99:>7.2f} {recall:>7.1%} "
+                  f"{agree:>6.1%} {correct:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
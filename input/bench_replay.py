@@ -0,0 +1,150 @@
+# input/bench_replay.py
+"""Handler throughput on a fixed set of synthetic session captures.
+
+Each scenario is written as a capture file and replayed as fast as possible
+through the frame handler (see replay.py). The digest column hashes the
+injected event stream, so a change in behaviour shows up as a new digest
+even when throughput looks the same. The _busy scenarios model a handler
+that falls behind, so their digests cover frame coalescing.
+
+    python bench_replay.py
+    python bench_replay.py --scenario click_drag --save captures/
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import tempfile
+
+from capture import CaptureWriter
+from controller_protocol import PROTOCOL_NAME, ControllerFrameEncoder
+from replay import format_events, replay
+
+RATE = 90  # Headset frame rate
+
+
+def frame(seq, t, left_axes=(0, 0), right_axes=(0, 0), left_buttons=None, right_buttons=None):
+    left = {'X': 0, 'Y': 0, 'trigger': 0, 'grip': 0, 'thumbstick': 0}
+    right = {'A': 0, 'B': 0, 'trigger': 0, 'grip': 0, 'thumbstick': 0}
+    left.update(left_buttons or {})
+    right.update(right_buttons or {})
+    return {
+        'seq': seq & 0xFFFF,
+        't': 1.7e12 + t * 1000,
+        'leftController': {'axes': list(left_axes), 'buttons': left},
+        'rightController': {'axes': list(right_axes), 'buttons': right},
+    }
+
+
+def movement_frames(seconds):
+    """Walking with the left stick and turning the camera in short bursts"""
+    for i in range(int(seconds * RATE)):
+        t = i / RATE
+        moving = (i // (RATE * 3)) % 2 == 0
+        left = (round(math.sin(t * 1.3), 4), round(-abs(math.cos(t * 0.7)), 4)) if moving else (0, 0)
+        turning = (i // (RATE // 2)) % 4 == 0
+        right = (round(math.sin(t * 4.0) * 0.8, 4), 0) if turning else (0, 0)
+        jump = 1 if (i // 45) % 11 == 0 else 0
+        yield t, frame(i, t, left, right, left_buttons={'Y': jump})
+
+
+def click_drag_frames(seconds):
+    """Quick clicks, trigger and grip drags, and held scroll, in a 3 s cycle"""
+    for i in range(int(seconds * RATE)):
+        t = i / RATE
+        phase = t % 3.0
+        right_axes = (0, 0)
+        buttons = {}
+        if phase < 0.2:
+            buttons['trigger'] = 1.0
+        elif 0.5 <= phase < 1.5:
+            buttons['trigger'] = 1.0
+            right_axes = (round(math.sin(phase * 6) * 0.7, 4), 0.3)
+        elif 1.7 <= phase < 2.5:
+            buttons['grip'] = 1.0
+            right_axes = (-0.5, round(math.cos(phase * 5) * 0.6, 4))
+        elif 2.6 <= phase < 2.9:
+            buttons['thumbstick'] = 1
+        yield t, frame(i, t, right_axes=right_axes, right_buttons=buttons)
+
+
+def motion_key_frames(seconds):
+    """Idle controller frames with bursts of recognized motions every half second"""
+    keys = ['1', '2', '3', 'q', 'e']
+    for i in range(int(seconds * RATE)):
+        t = i / RATE
+        yield t, frame(i, t)
+        if i % (RATE // 2) == 0:
+            for n, key in enumerate(keys):
+                modifiers = ['shift'] if n % 2 else []
+                for action in ('press', 'release'):
+                    yield t, {'type': 'motion_key_command', 'key': key,
+                              'modifiers': modifiers, 'action': action}
+
+
+def write_text_session(path, frames, observers=0):
+    capture = CaptureWriter(path)
+    start = capture.started
+    capture.open_connection(1, start)
+    for observer in range(observers):
+        capture.open_connection(2 + observer, start)
+    for t, data in frames:
+        capture.message(1, json.dumps(data), start + t)
+    capture.close()
+
+
+def write_binary_session(path, frames):
+    capture = CaptureWriter(path)
+    start = capture.started
+    capture.open_connection(1, start)
+    capture.message(1, json.dumps({'type': 'hello', 'protocols': [PROTOCOL_NAME, 'json']}), start)
+    encoder = ControllerFrameEncoder()
+    for t, data in frames:
+        capture.message(1, encoder.encode(data, data['t']), start + t)
+    capture.close()
+
+
+SCENARIOS = {
+    'movement': lambda path, seconds: write_text_session(path, movement_frames(seconds)),
+    'movement_binary': lambda path, seconds: write_binary_session(path, movement_frames(seconds)),
+    'click_drag': lambda path, seconds: write_text_session(path, click_drag_frames(seconds)),
+    'motion_keys': lambda path, seconds: write_text_session(path, motion_key_frames(seconds)),
+    'multi_client': lambda path, seconds: write_text_session(path, movement_frames(seconds), observers=3),
+    'movement_busy': lambda path, seconds: write_text_session(path, movement_frames(seconds)),
+    'click_drag_busy': lambda path, seconds: write_text_session(path, click_drag_frames(seconds)),
+}
+# Scenarios replayed with a handler busy for this long per batch, so about
+# two frames queue up each time and are coalesced
+HANDLER_TIMES = {'movement_busy': 0.02, 'click_drag_busy': 0.02}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60, help="Captured time per scenario")
+    parser.add_argument('--repeat', type=int, default=3, help="Replays per scenario, the best is kept")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Scenario to run, may be repeated (default: all)")
+    parser.add_argument('--save', metavar='DIR', help="Keep the generated captures in DIR")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.save or tmp
+        os.makedirs(directory, exist_ok=True)
+        print(f"{'scenario':16} {'messages':>9} {'msgs/s':>10} {'mean us':>8} "
+              f"{'p99 us':>8} {'events':>7}  digest")
+        for name in args.scenario or SCENARIOS:
+            path = os.path.join(directory, f"{name}.mcap")
+            SCENARIOS[name](path, args.seconds)
+            best = None
+            for _ in range(args.repeat):
+                events, stats = replay(path, handler_time=HANDLER_TIMES.get(name, 0.0))
+                if best is None or stats['elapsed_seconds'] < best['elapsed_seconds']:
+                    best = stats
+            digest = hashlib.sha1(format_events(events).encode()).hexdigest()[:12]
+            print(f"{name:16} {best['messages']:9d} {best['messages_per_sec']:10,.0f} "
+                  f"{best['mean_us']:8.1f} {best['p99_us']:8.1f} {best['events']:7d}  {digest}")
+
+
+if __name__ == '__main__':
+    main()
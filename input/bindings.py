@@ -0,0 +1,242 @@
+# input/bindings.py
+"""Controller-to-key bindings loaded from a JSON profile.
+
+A profile lists actions, each with an optional controller source, a key or
+mouse button and a press threshold. It is compiled into a BindingTable:
+flat per-action lists of thresholds, outputs and pressed state, plus a
+small program per controller saying which axis or button feeds which
+action. The frame handler runs that program with integer indexes only.
+
+Sources are written as '<side>.<input>': 'left.x-' / 'left.x+' are the
+negative and positive halves of the thumbstick x axis (likewise y), and
+'left.Y', 'right.trigger', ... are buttons.
+
+Keys and buttons pressed by several connections are merged by the input
+router (see input_router.py). The profile sets its policy with 'merge',
+for all actions at the top level or per binding, and the priority of each
+kind of source ('controller', 'motion') with 'priorities'.
+
+BindingStore watches the profile file and hands a freshly compiled table
+to the server when it changes, so profiles can be edited or replaced while
+the server runs.
+"""
+import copy
+import json
+import os
+import threading
+import time
+
+from event_log import log
+
+SIDES = {'left': 'leftController', 'right': 'rightController'}
+AXES = {'x': 0, 'y': 1}
+BUTTONS = {
+    'leftController': ('X', 'Y', 'trigger', 'grip', 'thumbstick'),
+    'rightController': ('A', 'B', 'trigger', 'grip', 'thumbstick'),
+}
+
+OUTPUT_KEY = 0
+OUTPUT_MOUSE = 1
+
+MERGE_POLICIES = ('max', 'priority', 'exclusive')
+DEFAULT_PRIORITIES = {'controller': 1, 'motion': 0}
+
+# How often the profile file is checked for changes, in seconds
+RELOAD_INTERVAL = 1.0
+
+DEFAULT_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bindings.json')
+
+
+class BindingError(ValueError):
+    pass
+
+
+def parse_source(source):
+    """Turn 'left.x-' or 'right.trigger' into (controller, axis, sign, button)"""
+    side, _, name = source.partition('.')
+    if side not in SIDES:
+        raise BindingError(f"Unknown controller in source {source!r}")
+    controller = SIDES[side]
+    if name[:1] in AXES and name[1:] in ('-', '+'):
+        return controller, AXES[name[0]], -1 if name[1] == '-' else 1, None
+    if name in BUTTONS[controller]:
+        return controller, None, 0, name
+    raise BindingError(f"Unknown input in source {source!r}")
+
+
+def parse_merge(policy, owner):
+    if policy not in MERGE_POLICIES:
+        raise BindingError(f"Unknown merge policy {policy!r} for {owner}")
+    return policy
+
+
+class BindingTable:
+    """Compiled bindings with per-action edge detection state"""
+
+    def __init__(self, profile):
+        if not isinstance(profile, dict):
+            raise BindingError("A binding profile must be a JSON object")
+        self.name = profile.get('name', 'unnamed')
+        self.grip_threshold = float(profile.get('grip_threshold', 0.5))
+        self.trigger_threshold = float(profile.get('trigger_threshold', 0.1))
+        self.default_merge = parse_merge(profile.get('merge', 'max'), 'the profile')
+        self.priorities = dict(DEFAULT_PRIORITIES, **profile.get('priorities', {}))
+        # Merge policy per (kind, code) output that differs from the default
+        self.merge_policies = {}
+
+        self.actions = []
+        self.thresholds = []
+        self.outputs = []
+        self.index = {}
+        # Per controller: [(action, axis, sign)] and [(action, button)]
+        self.axis_program = {controller: [] for controller in BUTTONS}
+        self.button_program = {controller: [] for controller in BUTTONS}
+
+        for binding in profile.get('bindings', []):
+            action = binding['action']
+            if action in self.index:
+                raise BindingError(f"Action {action!r} is bound twice")
+            if 'mouse' in binding:
+                if binding['mouse'] not in ('left', 'right'):
+                    raise BindingError(f"Unknown mouse button for {action!r}")
+                output = (OUTPUT_MOUSE, binding['mouse'])
+            elif 'key' in binding:
+                output = (OUTPUT_KEY, binding['key'])
+            else:
+                raise BindingError(f"Action {action!r} has no key or mouse button")
+
+            index = len(self.actions)
+            self.index[action] = index
+            self.actions.append(action)
+            self.thresholds.append(float(binding.get('threshold', 0.5)))
+            self.outputs.append(output)
+            if 'merge' in binding:
+                self.merge_policies[output] = parse_merge(binding['merge'], repr(action))
+
+            if binding.get('source'):
+                controller, axis, sign, button = parse_source(binding['source'])
+                if button is None:
+                    self.axis_program[controller].append((index, axis, sign))
+                else:
+                    self.button_program[controller].append((index, button))
+
+        self.values = [0.0] * len(self.actions)
+        self.pressed = bytearray(len(self.actions))
+
+    def for_session(self):
+        """A copy with its own action values and pressed state, sharing the compiled program"""
+        table = copy.copy(self)
+        table.values = [0.0] * len(self.actions)
+        table.pressed = bytearray(len(self.actions))
+        return table
+
+    def threshold(self, action):
+        return self.thresholds[self.index[action]]
+
+    def update(self, index, value, output):
+        """Store an action value and press or release its output on a threshold edge"""
+        is_pressed = value >= self.thresholds[index]
+        if is_pressed != self.pressed[index]:
+            self.pressed[index] = is_pressed
+            kind, code = self.outputs[index]
+            if kind == OUTPUT_KEY:
+                if is_pressed:
+                    output.key_down(code)
+                else:
+                    output.key_up(code)
+            elif is_pressed:
+                output.mouse_down(code)
+            else:
+                output.mouse_up(code)
+        self.values[index] = value
+
+    def update_controller(self, controller, data, output):
+        """Run the bindings sourced from one controller's frame data"""
+        if 'axes' in data:
+            axes = data['axes']
+            for index, axis, sign in self.axis_program[controller]:
+                value = axes[axis] * sign
+                self.update(index, value if value > 0 else 0, output)
+        if 'buttons' in data:
+            buttons = data['buttons']
+            for index, button in self.button_program[controller]:
+                self.update(index, buttons.get(button, 0), output)
+
+    def pressed_by(self, controller, data):
+        """Which of one controller's bindings its frame data would press, without pressing them"""
+        pressed = []
+        if 'axes' in data:
+            axes = data['axes']
+            pressed.extend(max(axes[axis] * sign, 0) >= self.thresholds[index]
+                           for index, axis, sign in self.axis_program[controller])
+        if 'buttons' in data:
+            buttons = data['buttons']
+            pressed.extend(buttons.get(button, 0) >= self.thresholds[index]
+                           for index, button in self.button_program[controller])
+        return tuple(pressed)
+
+    def release_all(self, output):
+        """Release every pressed output and reset all values"""
+        for index in range(len(self.actions)):
+            self.update(index, 0, output)
+
+    def describe(self):
+        lines = []
+        for action, threshold, (kind, code) in zip(self.actions, self.thresholds, self.outputs):
+            if kind == OUTPUT_MOUSE:
+                lines.append(f"  {action}: {code.capitalize()} Mouse Button (threshold: {threshold})")
+            else:
+                lines.append(f"  {action}: {code} (threshold: {threshold})")
+        return "\n".join(lines)
+
+
+def load_bindings(path):
+    with open(path) as f:
+        return BindingTable(json.load(f))
+
+
+class BindingStore:
+    """Holds the latest BindingTable and hot-reloads it from its profile file.
+
+    A reload compiles the new profile first and then passes the finished
+    table to on_reload. The old table is left alone: pressed state belongs
+    to the session writing it, which releases it when it switches tables.
+    """
+
+    def __init__(self, path=DEFAULT_PROFILE):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        self.table = load_bindings(path)
+        self.thread = None
+
+    def reload(self):
+        """Compile the profile, returns the new table or None on errors"""
+        try:
+            table = load_bindings(self.path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            log.error('bindings_error', "Error reloading bindings from {path}: {error}", path=self.path, error=e)
+            return None
+
+        self.table = table
+        log.info('bindings_reloaded', "Reloaded bindings: {name} ({actions} actions)",
+                 name=table.name, actions=len(table.actions))
+        return table
+
+    def watch(self, on_reload, interval=RELOAD_INTERVAL):
+        """Poll the profile file and reload it whenever it changes"""
+        while True:
+            time.sleep(interval)
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                continue
+            if mtime != self.mtime:
+                self.mtime = mtime
+                table = self.reload()
+                if table is not None:
+                    on_reload(table)
+
+    def start_watching(self, on_reload):
+        self.thread = threading.Thread(target=self.watch, args=(on_reload,),
+                                       name="bindings-reload", daemon=True)
+        self.thread.start()
@@ -0,0 +1,324 @@
+# input/broadcast.py
+"""Fan-out of controller frames to observer connections.
+
+Each frame is encoded once and appended to a bounded queue per client. The
+queues drop their oldest message when full and are drained by a dedicated
+sender per client, so a slow observer only ever loses its own stale frames
+and never delays the connection that produced them.
+
+A client that sends a subscribe message only gets the topics it asks for:
+
+    {"type": "subscribe", "topics": ["leftController", "buttons"], "rate": 30}
+
+    leftController   the left controller's state, at most `rate` times a
+    rightController  second (0 for every frame) and at once when one of its
+                     buttons is pressed or released
+    buttons          {"type": "buttons", "edges": [...]} for every press and
+                     release of any controller button
+    motion           motion key commands and motions detected on the server
+    metrics          what /metrics serves, at most `rate` times a second
+
+Button edges, motion events and direct replies are never dropped from a
+queue. A client that lets HARD_QUEUE_LIMIT of them pile up is disconnected
+instead. Clients that never subscribe keep getting every frame in full.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from event_log import log
+
+# Messages kept per client before the oldest one is dropped
+MAX_QUEUE_DEPTH = 16
+# Messages that must arrive queued for one client before it is disconnected
+HARD_QUEUE_LIMIT = 256
+
+TOPICS = ('leftController', 'rightController', 'buttons', 'motion', 'metrics')
+CONTROLLERS = ('leftController', 'rightController')
+# Button value at which the buttons topic reports a press
+PRESS_THRESHOLD = 0.5
+
+
+class SubscriptionError(ValueError):
+    pass
+
+
+class Subscription:
+    """Topics one client subscribed to and when its rate allows the next snapshot"""
+
+    def __init__(self, topics, rate):
+        if not isinstance(topics, list) or any(topic not in TOPICS for topic in topics):
+            raise SubscriptionError(f"Topics must be a list of {', '.join(TOPICS)}")
+        if not isinstance(rate, (int, float)) or rate < 0:
+            raise SubscriptionError("Rate must be a number of messages per second, 0 for no limit")
+        self.topics = frozenset(topics)
+        self.controllers = tuple(controller for controller in CONTROLLERS if controller in self.topics)
+        self.interval = 1 / rate if rate else 0
+        self.due = {}  # Rate-limited topic -> earliest time of its next message
+        # Several connection threads publish at once in the Flask mode
+        self.lock = threading.Lock()
+
+    def take(self, topic, now):
+        """Whether a rate-limited message on topic may be sent now"""
+        with self.lock:
+            if now < self.due.get(topic, 0):
+                return False
+            self.due[topic] = now + self.interval
+            return True
+
+
+class Channel:
+    """Bounded drop-oldest send queue for one client"""
+
+    def __init__(self, max_depth=MAX_QUEUE_DEPTH, hard_limit=HARD_QUEUE_LIMIT):
+        self.name = None
+        self.max_depth = max_depth
+        self.hard_limit = hard_limit
+        self.queue = deque()  # (message, droppable) pairs
+        self.subscription = None
+        self.sent = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.closed = False
+        self.overflowed = False
+
+    def push(self, message, droppable=True):
+        """Append a message, dropping the oldest droppable one if the queue is full.
+
+        Messages that must arrive may take the queue past max_depth, up to
+        hard_limit. Then the channel closes and its sender disconnects the
+        client.
+        """
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_depth:
+            for queued in self.queue:
+                if queued[1]:
+                    self.queue.remove(queued)
+                    self.dropped += 1
+                    break
+        if len(self.queue) >= self.hard_limit:
+            log.warning('queue_overflow', "Disconnecting {client}, {depth} messages it has not received",
+                        client=self.name, depth=len(self.queue))
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.overflowed = True
+            self.closed = True
+            return
+        self.queue.append((message, droppable))
+
+    def put(self, message, droppable=True):
+        raise NotImplementedError
+
+    def close(self):
+        self.closed = True
+
+    def stats(self):
+        return {
+            'client': self.name,
+            'depth': len(self.queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'skipped': self.skipped,
+            'topics': sorted(self.subscription.topics) if self.subscription is not None else None,
+        }
+
+
+class ThreadedChannel(Channel):
+    """Channel drained by its own sender thread calling client.send()"""
+
+    def __init__(self, client, on_error, max_depth=MAX_QUEUE_DEPTH):
+        super().__init__(max_depth)
+        self.client = client
+        self.on_error = on_error
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="broadcast-sender", daemon=True)
+        self.thread.start()
+
+    def put(self, message, droppable=True):
+        with self.condition:
+            self.push(message, droppable)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    break
+                message, _ = self.queue.popleft()
+            try:
+                self.client.send(message)
+                self.sent += 1
+            except Exception as e:
+                self.on_error(self.client, e)
+                return
+        if self.overflowed:
+            # The connection's handler sees the socket close and removes the client
+            try:
+                self.client.close()
+            except Exception as e:
+                self.on_error(self.client, e)
+
+
+class Broadcaster:
+    """Registry of client channels with serialize-once publishing"""
+
+    def __init__(self, max_depth=MAX_QUEUE_DEPTH, clock=time.monotonic):
+        self.max_depth = max_depth
+        self.clock = clock
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.subscribers = 0
+        # Sender -> {controller: {button: pressed}}, for the buttons topic,
+        # updated with every frame so a new subscriber gets no stale edges
+        self.pressed = {}
+
+    def add(self, client):
+        """Register a client, clients that are already channels queue for themselves"""
+        if isinstance(client, Channel):
+            channel = client
+        else:
+            channel = ThreadedChannel(client, self.send_failed, self.max_depth)
+        with self.lock:
+            self.next_id += 1
+            channel.name = f"client-{self.next_id}"
+            self.channels[client] = channel
+        return channel
+
+    def remove(self, client):
+        with self.lock:
+            channel = self.channels.pop(client, None)
+            self.pressed.pop(client, None)
+            if channel is not None and channel.subscription is not None:
+                self.subscribers -= 1
+        if channel is not None:
+            channel.close()
+        return channel
+
+    def subscribe(self, client, topics, rate=0):
+        """Send client only the given topics from now on, see the module docstring"""
+        subscription = Subscription(topics, rate)
+        with self.lock:
+            channel = self.channels.get(client)
+            if channel is None:
+                return
+            if channel.subscription is None:
+                self.subscribers += 1
+            channel.subscription = subscription
+
+    def send_failed(self, client, error):
+        log.warning('broadcast_error', "Error broadcasting to client: {error}", error=error)
+        self.remove(client)
+
+    def publish(self, data, sender=None):
+        """Queue a controller frame for every client except sender.
+
+        Clients without a subscription get the frame as it is, subscribers
+        the parts they subscribed to. Each distinct message is encoded once.
+        """
+        with self.lock:
+            channels = [channel for client, channel in self.channels.items() if client is not sender]
+            edges = self.button_edges(data, sender)
+        if not self.subscribers:
+            message = json.dumps(data)
+            for channel in channels:
+                channel.put(message)
+            return
+
+        edge_message = None
+        if edges:
+            edge_message = json.dumps({'type': 'buttons', 'edges': edges, 't': data.get('t')})
+        changed = {edge['controller'] for edge in edges}
+        encoded = {}
+        now = self.clock()
+        for channel in channels:
+            subscription = channel.subscription
+            if subscription is None:
+                key = None
+            elif not subscription.controllers:
+                key = False
+            elif changed.intersection(subscription.controllers) or subscription.take('controllers', now):
+                # A press or release goes out at once, whatever the rate
+                key = subscription.controllers
+            else:
+                channel.skipped += 1
+                key = False
+            if key is not False:
+                message = encoded.get(key)
+                if message is None:
+                    message = encoded[key] = json.dumps(data if key is None else self.snapshot(data, key))
+                channel.put(message)
+            if edge_message is not None and subscription is not None and 'buttons' in subscription.topics:
+                channel.put(edge_message, droppable=False)
+
+    def snapshot(self, data, controllers):
+        snapshot = {controller: data.get(controller) for controller in controllers}
+        for field in ('seq', 't'):
+            if field in data:
+                snapshot[field] = data[field]
+        return snapshot
+
+    def button_edges(self, data, sender):
+        """Buttons the sender pressed or released with this frame, called with the lock held"""
+        pressed = self.pressed.get(sender)
+        if pressed is None:
+            pressed = self.pressed[sender] = {controller: {} for controller in CONTROLLERS}
+        edges = []
+        for controller in CONTROLLERS:
+            buttons = (data.get(controller) or {}).get('buttons')
+            if not buttons:
+                continue
+            previous = pressed[controller]
+            for button, value in buttons.items():
+                is_pressed = value >= PRESS_THRESHOLD
+                if is_pressed != previous.get(button, False):
+                    previous[button] = is_pressed
+                    edges.append({'controller': controller, 'button': button, 'pressed': is_pressed})
+        return edges
+
+    def publish_topic(self, topic, data, sender=None, limited=False):
+        """Queue data for the subscribers of topic except sender.
+
+        Rate-limited topics skip subscribers whose rate does not allow
+        another message yet, the others are never dropped.
+        """
+        if not self.subscribers:
+            return
+        with self.lock:
+            channels = [channel for client, channel in self.channels.items()
+                        if client is not sender and channel.subscription is not None
+                        and topic in channel.subscription.topics]
+        now = self.clock()
+        message = None
+        for channel in channels:
+            if limited and not channel.subscription.take(topic, now):
+                continue
+            if message is None:
+                message = json.dumps(data)
+            channel.put(message, droppable=limited)
+
+    def has_subscribers(self, topic):
+        with self.lock:
+            return any(channel.subscription is not None and topic in channel.subscription.topics
+                       for channel in self.channels.values())
+
+    def send_to(self, client, data):
+        """Queue a reply for a single client, behind what is already queued"""
+        with self.lock:
+            channel = self.channels.get(client)
+        if channel is not None:
+            channel.put(json.dumps(data), droppable=False)
+
+    def stats(self):
+        with self.lock:
+            channels = list(self.channels.values())
+        return [channel.stats() for channel in channels]
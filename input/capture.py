@@ -0,0 +1,119 @@
+# input/capture.py
+"""Append-only capture files of /ws sessions.
+
+A capture holds every connection opening, message and close the server saw,
+with its arrival time, so a session can be replayed through the frame
+handler later (see replay.py). The layout is flat so a reader can mmap the
+file and walk it without parsing anything but fixed-size headers:
+
+    file header  4s magic 'MCAP', u16 version, u16 reserved,
+                 f64 wall-clock start time in seconds since the epoch
+    record       f64 arrival in seconds since the start, u16 connection id,
+                 u8 kind, u8 reserved, u32 payload length, then the payload
+
+Text messages are stored UTF-8 encoded, binary frames as they arrived.
+All values are little-endian. A record cut off by a crash at the end of
+the file is ignored when reading.
+"""
+import mmap
+import struct
+import threading
+import time
+
+MAGIC = b'MCAP'
+VERSION = 1
+
+FILE_HEADER = struct.Struct('<4sHHd')
+RECORD_HEADER = struct.Struct('<dHBxI')
+
+KIND_OPEN = 0
+KIND_CLOSE = 1
+KIND_TEXT = 2
+KIND_BINARY = 3
+
+# Records buffered before the file is flushed
+FLUSH_EVERY = 256
+
+
+class CaptureError(ValueError):
+    pass
+
+
+class CaptureWriter:
+    """Appends records to a capture file, safe to share between connection threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.lock = threading.Lock()
+        # Arrival times are perf_counter() values, stored relative to this
+        self.started = time.perf_counter()
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, 0, time.time()))
+        self.records = 0
+
+    def write(self, connection, kind, payload=b'', received=None):
+        if received is None:
+            received = time.perf_counter()
+        header = RECORD_HEADER.pack(received - self.started, connection, kind, len(payload))
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(header)
+            self.file.write(payload)
+            self.records += 1
+            if kind == KIND_CLOSE or self.records % FLUSH_EVERY == 0:
+                self.file.flush()
+
+    def open_connection(self, connection, received=None):
+        self.write(connection, KIND_OPEN, received=received)
+
+    def close_connection(self, connection, received=None):
+        self.write(connection, KIND_CLOSE, received=received)
+
+    def message(self, connection, message, received=None):
+        if isinstance(message, str):
+            self.write(connection, KIND_TEXT, message.encode('utf-8'), received)
+        else:
+            self.write(connection, KIND_BINARY, bytes(message), received)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class CaptureReader:
+    """Memory-maps a capture file and iterates over its records"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < FILE_HEADER.size:
+            raise CaptureError(f"{path} is too short to be a capture")
+        magic, version, _, self.started = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise CaptureError(f"{path} is not a capture file")
+        if version != VERSION:
+            raise CaptureError(f"Unsupported capture version {version}")
+
+    def __iter__(self):
+        """Yield (arrival, connection, kind, message), messages as str or bytes"""
+        data = self.map
+        offset = FILE_HEADER.size
+        end = len(data)
+        while offset + RECORD_HEADER.size <= end:
+            arrival, connection, kind, length = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > end:
+                break
+            payload = data[offset:offset + length]
+            offset += length
+            if kind == KIND_TEXT:
+                yield arrival, connection, kind, payload.decode('utf-8')
+            elif kind == KIND_BINARY:
+                yield arrival, connection, kind, payload
+            else:
+                yield arrival, connection, kind, None
+
+    def close(self):
+        self.map.close()
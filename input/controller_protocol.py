@@ -0,0 +1,211 @@
+# input/controller_protocol.py
+"""Compact binary wire format for controller frames.
+
+Clients that announce support with a hello message send controller frames
+as small binary packets instead of JSON. All values are little-endian:
+
+    header      u8 version, u8 flags, u16 sequence number
+    timestamp   f64 client time in ms since the epoch, only with FLAG_TIMESTAMP
+    controller  u8 field mask, then the fields present in the mask, in order:
+                  AXIS_X   i16  thumbstick x, quantized to [-32767, 32767]
+                  AXIS_Y   i16  thumbstick y
+                  TRIGGER  u8   trigger value, quantized to [0, 255]
+                  GRIP     u8   grip value
+                  BUTTONS  u8   bitfield: X/A, Y/B, thumbstick click
+
+A left controller block follows the header when FLAG_LEFT is set and a right
+one when FLAG_RIGHT is set. Keyframes carry every field. Delta frames
+(FLAG_DELTA) carry only the fields that changed since the previous frame,
+so a frame with the sticks and buttons at rest is six bytes.
+
+The decoder rebuilds the same dict the JSON path produces, so everything
+after decoding is shared between both formats.
+"""
+import math
+import struct
+
+PROTOCOL_VERSION = 1
+PROTOCOL_NAME = 'binary-v1'
+
+FLAG_LEFT = 0x01
+FLAG_RIGHT = 0x02
+FLAG_DELTA = 0x04
+FLAG_TIMESTAMP = 0x08
+
+FIELD_AXIS_X = 0x01
+FIELD_AXIS_Y = 0x02
+FIELD_TRIGGER = 0x04
+FIELD_GRIP = 0x08
+FIELD_BUTTONS = 0x10
+ALL_FIELDS = 0x1F
+
+BUTTON_PRIMARY = 0x01    # X on the left controller, A on the right
+BUTTON_SECONDARY = 0x02  # Y on the left controller, B on the right
+BUTTON_THUMBSTICK = 0x04
+
+AXIS_SCALE = 32767.0
+TRIGGER_SCALE = 255.0
+
+# Face button names per controller, indexed by (primary, secondary)
+BUTTON_NAMES = {
+    'leftController': ('X', 'Y'),
+    'rightController': ('A', 'B'),
+}
+
+HEADER = struct.Struct('<BBH')
+TIMESTAMP = struct.Struct('<d')
+
+# Struct format character for each field, in wire order
+FIELD_FORMATS = (
+    (FIELD_AXIS_X, 'h'),
+    (FIELD_AXIS_Y, 'h'),
+    (FIELD_TRIGGER, 'B'),
+    (FIELD_GRIP, 'B'),
+    (FIELD_BUTTONS, 'B'),
+)
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def compile_field_structs():
+    """Precompile one struct per field mask so decoding is a single unpack"""
+    structs = []
+    for mask in range(ALL_FIELDS + 1):
+        fields = tuple(index for index, (bit, _) in enumerate(FIELD_FORMATS) if mask & bit)
+        layout = '<' + ''.join(FIELD_FORMATS[index][1] for index in fields)
+        structs.append((struct.Struct(layout), fields))
+    return structs
+
+
+FIELD_STRUCTS = compile_field_structs()
+
+
+class ControllerFrameDecoder:
+    """Decodes binary frames for one connection, keeping state for deltas"""
+
+    def __init__(self):
+        # Quantized field values per controller, in FIELD_FORMATS order
+        self.state = {'leftController': None, 'rightController': None}
+        # Last decoded dict per controller, reused while nothing changes.
+        # Callers must treat decoded frames as read-only.
+        self.decoded = {'leftController': None, 'rightController': None}
+        self.last_sequence = None
+
+    def decode(self, packet):
+        version, flags, sequence = HEADER.unpack_from(packet, 0)
+        if version != PROTOCOL_VERSION:
+            raise ProtocolError(f"Unsupported binary protocol version {version}")
+        self.last_sequence = sequence
+
+        data = {'seq': sequence}
+        offset = HEADER.size
+        if flags & FLAG_TIMESTAMP:
+            data['t'] = TIMESTAMP.unpack_from(packet, offset)[0]
+            offset += TIMESTAMP.size
+        delta = flags & FLAG_DELTA
+        if flags & FLAG_LEFT:
+            offset = self.decode_controller(packet, offset, 'leftController', delta, data)
+        if flags & FLAG_RIGHT:
+            offset = self.decode_controller(packet, offset, 'rightController', delta, data)
+        if offset != len(packet):
+            raise ProtocolError(f"Frame has {len(packet) - offset} trailing bytes")
+        return data
+
+    def decode_controller(self, packet, offset, name, delta, data):
+        mask = packet[offset]
+        offset += 1
+        if delta and not mask and self.decoded[name] is not None:
+            data[name] = self.decoded[name]
+            return offset
+
+        layout, fields = FIELD_STRUCTS[mask & ALL_FIELDS]
+        values = layout.unpack_from(packet, offset)
+        offset += layout.size
+
+        state = self.state[name]
+        if not delta:
+            if mask != ALL_FIELDS:
+                raise ProtocolError("Keyframe must carry every field")
+            state = self.state[name] = list(values)
+        elif state is None:
+            raise ProtocolError("Delta frame received before a keyframe")
+        else:
+            for index, value in zip(fields, values):
+                state[index] = value
+
+        axis_x, axis_y, trigger, grip, buttons = state
+        primary, secondary = BUTTON_NAMES[name]
+        data[name] = self.decoded[name] = {
+            'axes': [axis_x / AXIS_SCALE, axis_y / AXIS_SCALE],
+            'buttons': {
+                primary: 1 if buttons & BUTTON_PRIMARY else 0,
+                secondary: 1 if buttons & BUTTON_SECONDARY else 0,
+                'trigger': trigger / TRIGGER_SCALE,
+                'grip': grip / TRIGGER_SCALE,
+                'thumbstick': 1 if buttons & BUTTON_THUMBSTICK else 0,
+            },
+        }
+        return offset
+
+
+class ControllerFrameEncoder:
+    """Python counterpart of the encoder in index.html, used by tools and benchmarks"""
+
+    def __init__(self, keyframe_interval=90):
+        self.keyframe_interval = keyframe_interval
+        self.sequence = 0
+        self.state = {'leftController': None, 'rightController': None}
+
+    @staticmethod
+    def quantize(name, controller):
+        primary, secondary = BUTTON_NAMES[name]
+        buttons = controller.get('buttons', {})
+        axes = controller.get('axes', [0, 0])
+        bits = 0
+        if buttons.get(primary, 0) >= 0.5:
+            bits |= BUTTON_PRIMARY
+        if buttons.get(secondary, 0) >= 0.5:
+            bits |= BUTTON_SECONDARY
+        if buttons.get('thumbstick', 0) >= 0.5:
+            bits |= BUTTON_THUMBSTICK
+        # floor(x + 0.5) rounds like Math.round() in the browser encoder
+        return [
+            math.floor(max(-1.0, min(1.0, axes[0])) * AXIS_SCALE + 0.5),
+            math.floor(max(-1.0, min(1.0, axes[1])) * AXIS_SCALE + 0.5),
+            math.floor(max(0.0, min(1.0, buttons.get('trigger', 0))) * TRIGGER_SCALE + 0.5),
+            math.floor(max(0.0, min(1.0, buttons.get('grip', 0))) * TRIGGER_SCALE + 0.5),
+            bits,
+        ]
+
+    def encode(self, data, timestamp=None):
+        controllers = [(name, flag, self.quantize(name, data[name]))
+                       for name, flag in (('leftController', FLAG_LEFT), ('rightController', FLAG_RIGHT))
+                       if data.get(name)]
+        # A controller without previous state needs a full block
+        keyframe = (self.sequence % self.keyframe_interval == 0 or
+                    any(self.state[name] is None for name, _, _ in controllers))
+
+        flags = 0 if keyframe else FLAG_DELTA
+        body = bytearray()
+        if timestamp is not None:
+            flags |= FLAG_TIMESTAMP
+            body += TIMESTAMP.pack(timestamp)
+        for name, flag, values in controllers:
+            mask = ALL_FIELDS
+            if not keyframe:
+                previous = self.state[name]
+                mask = 0
+                for index, (bit, _) in enumerate(FIELD_FORMATS):
+                    if values[index] != previous[index]:
+                        mask |= bit
+            layout, fields = FIELD_STRUCTS[mask]
+            body.append(mask)
+            body += layout.pack(*(values[index] for index in fields))
+            self.state[name] = values
+            flags |= flag
+
+        packet = HEADER.pack(PROTOCOL_VERSION, flags, self.sequence & 0xFFFF) + bytes(body)
+        self.sequence += 1
+        return packet
@@ -0,0 +1,269 @@
+# input/event_log.py
+"""Structured event log written by a background thread.
+
+Handlers used to print() to the console while they processed a frame, so
+a slow or redirected console held up input. They now record events, each
+with a level, a name, a message template and fields:
+
+    log.info('motion_key', "Motion key command: {action} {keys}", action=action, keys=keys)
+
+The level is checked before anything else and a record is only a tuple
+appended to a queue. The writer thread formats messages for the console
+and can also append every record to a JSONL or compact binary file,
+rotated by size. Warnings and errors repeated more than RATE_LIMIT times
+a second under the same name are counted instead of queued, and the next
+one let through says how many were suppressed. Until start() is called
+records are written at once by the calling thread, as tools like
+replay.py expect.
+
+Binary files start with the magic bytes 'EVLG', then hold one record
+after another:
+
+    u32 length of the rest, f64 unix time, u8 level, u8 name length,
+    name, fields as compact JSON
+
+    python event_log.py dump server.log
+"""
+import argparse
+import collections
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+QUEUE_LIMIT = 10000  # Records waiting for the writer before new ones are dropped
+FLUSH_INTERVAL = 0.05  # Seconds between writer passes
+RATE_LIMIT = 5  # Warnings or errors per name and second
+MAX_BYTES = 10 * 1024 * 1024  # Log file size before it is rotated
+BACKUPS = 3  # Rotated files kept as <path>.1 to <path>.3
+
+BINARY_MAGIC = b'EVLG'
+BINARY_HEADER = struct.Struct('<IdBB')
+
+
+def encode_jsonl(when, level, event, fields):
+    entry = {'time': when, 'level': LEVEL_NAMES[level], 'event': event}
+    entry.update(fields)
+    return json.dumps(entry, default=str, separators=(',', ':')).encode() + b'\n'
+
+
+def encode_binary(when, level, event, fields):
+    name = event.encode()[:255]
+    payload = json.dumps(fields, default=str, separators=(',', ':')).encode()
+    size = BINARY_HEADER.size - 4 + len(name) + len(payload)
+    return BINARY_HEADER.pack(size, when, level, len(name)) + name + payload
+
+
+FORMATS = {'jsonl': encode_jsonl, 'binary': encode_binary}
+
+
+def read_binary(f):
+    """(time, level, event, fields) of every record in a binary log file"""
+    if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("Not a binary event log")
+    while True:
+        header = f.read(BINARY_HEADER.size)
+        if len(header) < BINARY_HEADER.size:
+            return
+        size, when, level, name_length = BINARY_HEADER.unpack(header)
+        body = f.read(size - BINARY_HEADER.size + 4)
+        yield when, level, body[:name_length].decode(), json.loads(body[name_length:])
+
+
+class LogFile:
+    """Records appended to a file in one format, rotated when it gets too big"""
+
+    def __init__(self, path, format='jsonl', max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = path
+        self.encode = FORMATS[format]
+        self.magic = BINARY_MAGIC if format == 'binary' else b''
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, 'ab')
+        self.size = self.file.tell()
+        if not self.size:
+            self.start()
+
+    def write(self, when, level, event, fields):
+        data = self.encode(when, level, event, fields)
+        if self.size > len(self.magic) and self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backups, 0, -1):
+            source = self.path if index == 1 else f"{self.path}.{index - 1}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index}")
+        self.file = open(self.path, 'wb')
+        self.size = 0
+        self.start()
+
+    def start(self):
+        """Begin an empty file, binary logs with their magic bytes"""
+        self.file.write(self.magic)
+        self.size += len(self.magic)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class EventLog:
+    """Levelled, rate-limited event records, written off the caller's thread once started"""
+
+    def __init__(self, level=INFO):
+        self.console_level = level
+        self.file_level = level
+        self.level = level  # Lowest level any sink writes
+        self.file = None
+        self.queue = collections.deque()
+        self.dropped = 0
+        self.windows = {}  # Event name -> (start of its current second, records in it)
+        self.suppressed = {}  # Event name -> records suppressed since the last one let through
+        self.rate_lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def configure(self, level='info', path=None, format='jsonl', file_level='debug', max_bytes=MAX_BYTES):
+        """Set the console level and optionally a log file with its own level"""
+        self.console_level = LEVELS[level]
+        if path is not None:
+            self.file = LogFile(path, format, max_bytes)
+            self.file_level = LEVELS[file_level]
+            self.level = min(self.console_level, self.file_level)
+        else:
+            self.level = self.console_level
+
+    def debug(self, event, text, **fields):
+        self.record(DEBUG, event, text, fields)
+
+    def info(self, event, text, **fields):
+        self.record(INFO, event, text, fields)
+
+    def warning(self, event, text, **fields):
+        self.record(WARNING, event, text, fields)
+
+    def error(self, event, text, **fields):
+        self.record(ERROR, event, text, fields)
+
+    def record(self, level, event, text, fields):
+        if level < self.level:
+            return
+        if level >= WARNING:
+            suppressed = self.rate_limit(event)
+            if suppressed is None:
+                return
+            if suppressed:
+                fields['suppressed'] = suppressed
+        record = (time.time(), level, event, text, fields)
+        if self.thread is None:
+            self.write(record)
+        elif len(self.queue) < QUEUE_LIMIT:
+            # deque.append() is atomic, the writer pops from the other end
+            self.queue.append(record)
+        else:
+            self.dropped += 1
+
+    def rate_limit(self, event):
+        """None when the event is over its rate, else how many were suppressed before it"""
+        now = time.monotonic()
+        with self.rate_lock:
+            start, count = self.windows.get(event, (0.0, 0))
+            if now - start >= 1.0:
+                start, count = now, 0
+            elif count >= RATE_LIMIT:
+                self.suppressed[event] = self.suppressed.get(event, 0) + 1
+                return None
+            self.windows[event] = (start, count + 1)
+            return self.suppressed.pop(event, 0)
+
+    def write(self, record):
+        when, level, event, text, fields = record
+        if level >= self.console_level:
+            try:
+                line = text.format(**fields)
+            except (KeyError, IndexError, ValueError):
+                line = f"{text} {fields}"
+            if 'suppressed' in fields:
+                line += f" ({fields['suppressed']} similar suppressed)"
+            print(line)
+        if self.file is not None and level >= self.file_level:
+            self.file.write(when, level, event, fields)
+
+    def start(self):
+        """Write records on a background thread from now on"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='event-log', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(FLUSH_INTERVAL):
+            self.drain()
+        self.drain()
+
+    def drain(self):
+        if not self.queue:
+            return
+        try:
+            while self.queue:
+                self.write(self.queue.popleft())
+            if self.file is not None:
+                self.file.flush()
+            sys.stdout.flush()
+        except Exception as e:
+            # The writer has nowhere else to report to
+            sys.stderr.write(f"Event log writer error: {e}\n")
+
+    def stop(self):
+        """Write what is queued and close the log file"""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        with self.rate_lock:
+            suppressed = sum(self.suppressed.values())
+        return {'queued': len(self.queue), 'dropped': self.dropped, 'suppressed': suppressed}
+
+
+# Shared by every module of the server
+log = EventLog()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print an event log file as JSON lines")
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('dump', help="Print a binary or JSONL log file")
+    dump.add_argument('file')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            f.seek(0)
+            sys.stdout.write(f.read().decode())
+            return
+        f.seek(0)
+        for when, level, event, fields in read_binary(f):
+            sys.stdout.write(encode_jsonl(when, level, event, fields).decode())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# input/focus.py
+"""Notifications when the game window gains or loses focus.
+
+On Windows a WinEvent hook reports every foreground window change as it
+happens, so input stops the moment the player alt-tabs. Elsewhere, or if
+the hook cannot be installed, the probe is polled instead. The probe is any
+function returning whether the game is focused, so tests and replays can
+pass a fake one.
+"""
+import sys
+import threading
+import time
+
+from event_log import log
+
+try:
+    import ctypes
+    from ctypes import wintypes
+except ImportError:  # pragma: no cover - ctypes is always present on CPython
+    ctypes = None
+
+POLL_INTERVAL = 0.5  # Seconds between probes when polling
+# Probe this often even with the hook installed, in case a change is missed
+HOOK_POLL_INTERVAL = 5.0
+
+EVENT_SYSTEM_FOREGROUND = 0x0003
+WINEVENT_OUTOFCONTEXT = 0x0000
+
+
+class FocusWatcher:
+    """Calls on_change(focused) whenever the probe's answer changes"""
+
+    def __init__(self, probe, on_change, poll_interval=POLL_INTERVAL, use_hook=True):
+        self.probe = probe
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.use_hook = use_hook and ctypes is not None and sys.platform == 'win32'
+        self.focused = None
+        self.lock = threading.Lock()
+        self.hooked = threading.Event()
+        self.threads = []
+
+    def check(self):
+        """Probe now and report a change"""
+        try:
+            focused = bool(self.probe())
+        except Exception as e:
+            log.error('focus_error', "Error checking window focus: {error}", error=e)
+            return
+        with self.lock:
+            if focused == self.focused:
+                return
+            self.focused = focused
+        self.on_change(focused)
+
+    def poll(self):
+        while True:
+            self.check()
+            time.sleep(HOOK_POLL_INTERVAL if self.hooked.is_set() else self.poll_interval)
+
+    def run_hook(self):
+        """Install a foreground change hook and pump messages for it"""
+        user32 = ctypes.windll.user32
+        WinEventProc = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                          wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+
+        def callback(hook, event, hwnd, object_id, child_id, thread, timestamp):
+            self.check()
+
+        # Keep a reference, the hook must outlive this frame
+        self.callback = WinEventProc(callback)
+        hook = user32.SetWinEventHook(EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND, 0,
+                                      self.callback, 0, 0, WINEVENT_OUTOFCONTEXT)
+        if not hook:
+            log.warning('focus_hook', "Could not install the focus hook, polling window focus instead")
+            return
+        self.hooked.set()
+
+        message = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(message), 0, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(message))
+            user32.DispatchMessageW(ctypes.byref(message))
+
+    def start(self):
+        self.check()
+        targets = [self.poll]
+        if self.use_hook:
+            targets.append(self.run_hook)
+        for target in targets:
+            thread = threading.Thread(target=target, name=f"focus-{target.__name__}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
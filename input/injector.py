@@ -0,0 +1,72 @@
+# input/injector.py
+"""Entry point of the injector process started by the shm output backend.
+
+The process is spawned with this module as its target, so it imports the
+output backends and the event log but not the server. It drains the
+shared-memory ring SharedMemoryBackend writes into a native backend and
+reports its counters in the ring's header. Its own log records are written
+by a background thread like the server's, never inside the drain loop.
+"""
+import struct
+import time
+
+from event_log import log
+from output_backends import (INJECTED, LAST_IN_BATCH, MOUSE_MOVE, READ, RECORD, RECORD_KINDS,
+                             RING_HEADER, SCROLL, WRITTEN, create_backend, ring_counter,
+                             shared_memory)
+
+
+def run_injector(memory_name, capacity, target, wakeup, stopping, ready):
+    """Drain the ring into a native backend until stopped"""
+    log.start()
+    memory = shared_memory.SharedMemory(name=memory_name)
+    buffer = memory.buf
+    written = ring_counter(buffer, WRITTEN)
+    read = ring_counter(buffer, READ)
+    backend = create_backend(target)
+    log.info('injector_started', "Injector process started with the {backend} backend", backend=backend.name)
+    ready.set()
+
+    injected = batches = total_lag = max_lag = errors = 0
+    batch = []
+    position = read.value
+    try:
+        while not stopping.is_set():
+            end = written.value
+            if position == end:
+                # Clear before checking again, so a batch published meanwhile still wakes us
+                wakeup.clear()
+                if written.value == end:
+                    wakeup.wait(0.5)
+                continue
+            while position < end:
+                code, flags, a, b, queued, name = RECORD.unpack_from(
+                    buffer, RING_HEADER + position % capacity * RECORD.size)
+                position += 1
+                kind = RECORD_KINDS[code]
+                if kind == MOUSE_MOVE or kind == SCROLL:
+                    batch.append((kind, a, b))
+                else:
+                    batch.append((kind, name.rstrip(b'\0').decode(), 0))
+                if flags & LAST_IN_BATCH:
+                    try:
+                        backend.submit(batch)
+                    except Exception as e:
+                        errors += 1
+                        log.error('injection_error', "Error injecting input batch ({backend}): {error}",
+                                  backend=backend.name, error=e)
+                    # perf_counter() is a system-wide monotonic clock, comparable across processes
+                    lag = int((time.perf_counter() - queued) * 1e6)
+                    injected += len(batch)
+                    batches += 1
+                    total_lag += lag * len(batch)
+                    max_lag = max(max_lag, lag)
+                    batch = []
+                    # Hand the batch's slots back to the server
+                    read.value = position
+                    struct.pack_into('<5Q', buffer, INJECTED, injected, batches, total_lag, max_lag, errors)
+    finally:
+        backend.close()
+        del written, read, buffer
+        memory.close()
+        log.stop()
@@ -0,0 +1,178 @@
+# input/input_router.py
+"""Merge the keys and mouse buttons pressed by several input sources.
+
+Every /ws connection presses keys through its own InputSource: a headset
+through its binding table, the camera page through its motion keys, a
+second controller through its own table. A source only records what it
+holds itself, so one connection's frames or disconnect never release what
+another connection holds. The InputRouter merges the sources per key or
+mouse button with the policy the bindings profile sets for it:
+
+    max        down while any source holds it (the default)
+    priority   follows the highest-priority source pressing it. When that
+               source lets go it is released, and lower-priority sources
+               have to press again
+    exclusive  the first source to press it owns it until it lets go,
+               presses from other sources are ignored meanwhile
+
+Source priorities are set per kind of source ('controller', 'motion') in
+the profile. Merge state is sharded by key over several locks, so sources
+pressing different keys never wait on each other, and only press and
+release edges reach the router at all. Cursor moves and scrolling pass
+straight through to the backend.
+"""
+import threading
+
+from bindings import OUTPUT_KEY, OUTPUT_MOUSE
+
+SHARDS = 16
+
+
+class OutputState:
+    """Merge state of one key or mouse button"""
+    __slots__ = ('holders', 'owner', 'down')
+
+    def __init__(self):
+        self.holders = set()  # Sources currently pressing it
+        self.owner = None  # Source in control under priority and exclusive
+        self.down = False  # Whether the backend has it pressed
+
+
+class Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outputs = {}
+
+
+class InputSource:
+    """One connection's keys and buttons, with the backend's event methods.
+
+    The connection's handler and the scheduler thread's click releases and
+    scroll repeats both use it, so `held` is only touched under `lock`.
+    """
+
+    def __init__(self, router, kind, connection_id):
+        self.router = router
+        self.kind = kind
+        self.connection_id = connection_id
+        self.lock = threading.Lock()
+        self.held = set()
+
+    @property
+    def priority(self):
+        return self.router.priorities.get(self.kind, 0)
+
+    def key_down(self, key):
+        self.router.press(self, (OUTPUT_KEY, key))
+
+    def key_up(self, key):
+        self.router.release(self, (OUTPUT_KEY, key))
+
+    def mouse_down(self, button):
+        self.router.press(self, (OUTPUT_MOUSE, button))
+
+    def mouse_up(self, button):
+        self.router.release(self, (OUTPUT_MOUSE, button))
+
+    def move_cursor(self, dx, dy):
+        self.router.get_output().move_cursor(dx, dy)
+
+    def scroll(self, amount):
+        self.router.get_output().scroll(amount)
+
+    def release_all(self):
+        """Let go of everything this source holds"""
+        with self.lock:
+            held = list(self.held)
+        for target in held:
+            self.router.release(self, target)
+
+
+class InputRouter:
+    """Merges InputSources into the output backend"""
+
+    def __init__(self, get_output, shards=SHARDS):
+        self.get_output = get_output
+        self.shards = [Shard() for _ in range(shards)]
+        # Replaced as a whole on reconfiguration, read without locking
+        self.policies = {}
+        self.default_policy = 'max'
+        self.priorities = {}
+        self.sources = 0
+        self.ignored = 0
+
+    def configure(self, table):
+        """Take merge policies and source priorities from a BindingTable"""
+        self.policies = table.merge_policies
+        self.default_policy = table.default_merge
+        self.priorities = table.priorities
+
+    def add_source(self, kind, connection_id):
+        self.sources += 1
+        return InputSource(self, kind, connection_id)
+
+    def remove_source(self, source):
+        source.release_all()
+        self.sources -= 1
+
+    def press(self, source, target):
+        with source.lock:
+            source.held.add(target)
+        shard = self.shards[hash(target) % len(self.shards)]
+        with shard.lock:
+            state = shard.outputs.get(target)
+            if state is None:
+                state = shard.outputs[target] = OutputState()
+            state.holders.add(source)
+            policy = self.policies.get(target, self.default_policy)
+            if policy != 'max':
+                if state.owner is None or (policy == 'priority' and
+                                           source.priority >= state.owner.priority):
+                    state.owner = source
+                elif state.owner is not source:
+                    self.ignored += 1
+                    return
+            if not state.down:
+                state.down = True
+                self.emit(target, True)
+
+    def release(self, source, target):
+        with source.lock:
+            source.held.discard(target)
+        shard = self.shards[hash(target) % len(self.shards)]
+        with shard.lock:
+            state = shard.outputs.get(target)
+            if state is None:
+                return
+            state.holders.discard(source)
+            policy = self.policies.get(target, self.default_policy)
+            if policy == 'max':
+                release = not state.holders
+            else:
+                release = state.owner is source or state.owner is None
+            if release:
+                state.owner = None
+                if state.down:
+                    state.down = False
+                    self.emit(target, False)
+
+    def emit(self, target, pressed):
+        """Queue the merged edge on the backend, called with the shard lock held"""
+        kind, code = target
+        output = self.get_output()
+        if kind == OUTPUT_KEY:
+            if pressed:
+                output.key_down(code)
+            else:
+                output.key_up(code)
+        elif pressed:
+            output.mouse_down(code)
+        else:
+            output.mouse_up(code)
+
+    def stats(self):
+        down = 0
+        for shard in self.shards:
+            with shard.lock:
+                down += sum(state.down for state in shard.outputs.values())
+        return {'sources': self.sources, 'down': down, 'ignored_presses': self.ignored}
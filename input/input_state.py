@@ -0,0 +1,40 @@
+# input/input_state.py
+"""Immutable snapshot of what frame handlers need to decide on input.
+
+Whether the game has focus and the active binding table are read on every
+frame. They live together in one immutable InputSnapshot, and every change
+publishes a new snapshot with a single reference assignment. Handlers read
+`current` once per frame without taking a lock and see a consistent view
+for the whole frame. Only the rare writers (focus changes, binding
+reloads) serialize on a lock among themselves.
+
+Pressed keys and buttons are not part of the snapshot. Every session keeps
+its own and releases them when it loses focus, when the bindings are
+replaced and when it disconnects; input_router.py merges the sessions.
+"""
+import threading
+from collections import namedtuple
+
+InputSnapshot = namedtuple('InputSnapshot', 'focused table')
+
+
+class InputState:
+    """Holder of the current InputSnapshot"""
+
+    def __init__(self, table, focused=False):
+        self.current = InputSnapshot(focused, table)
+        self.lock = threading.Lock()
+
+    def update(self, **changes):
+        """Publish a snapshot with some fields replaced, returns the previous one"""
+        with self.lock:
+            previous = self.current
+            self.current = previous._replace(**changes)
+        return previous
+
+    def set_focused(self, focused):
+        previous = self.update(focused=focused)
+        return previous.focused != focused
+
+    def set_table(self, table):
+        self.update(table=table)
@@ -0,0 +1,247 @@
+# input/metrics.py
+"""Latency histograms and frame counters for the input pipeline.
+
+Recording is lock-free: every thread writes to its own shard of each
+histogram or counter, and shards are only summed when metrics are read.
+When a thread exits, its shard is folded into retained totals and
+dropped, so connection threads coming and going do not pile up shards.
+Histograms are HDR-style: values in microseconds go into log-linear buckets
+(16 per power of two, about 6% precision), so a fixed array of counts
+covers everything from a microsecond to minutes.
+"""
+import threading
+import weakref
+from collections import deque
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+# Enough buckets for values below 2**37 us, about 38 hours
+BUCKET_COUNT = (37 - SUB_BUCKET_BITS + 2) * SUB_BUCKET_HALF
+
+# Client clock offsets are re-estimated over windows of this many frames
+CLOCK_WINDOW = 1000
+
+
+def bucket_index(value):
+    """Bucket for a non-negative integer value"""
+    if value < 2 * SUB_BUCKET_HALF:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return min(BUCKET_COUNT - 1, shift * SUB_BUCKET_HALF + (value >> shift))
+
+
+def bucket_value(index):
+    """Upper bound of the values that fall into a bucket"""
+    if index < 2 * SUB_BUCKET_HALF:
+        return index
+    shift = index // SUB_BUCKET_HALF - 1
+    mantissa = index - shift * SUB_BUCKET_HALF
+    return ((mantissa + 1) << shift) - 1
+
+
+class ShardOwner:
+    """Kept in a thread's local storage, collected when the thread exits"""
+
+
+class Sharded:
+    """Base class giving each thread its own shard to write to"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.retired = self.new_shard()  # Totals of the threads that have exited
+        self.exited = deque()  # Shards of exited threads not folded in yet
+        self.lock = threading.Lock()
+
+    def new_shard(self):
+        raise NotImplementedError
+
+    def fold(self, total, shard):
+        """Add a shard's counts to total"""
+        raise NotImplementedError
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = self.new_shard()
+            self.local.owner = owner = ShardOwner()
+            # The finalizer may run inside a garbage collection on any
+            # thread, so it only queues the shard and never takes the lock
+            weakref.finalize(owner, self.exited.append, shard)
+            # Only taken once per thread, never on the recording path
+            with self.lock:
+                self.retire_exited()
+                self.shards.append(shard)
+        return shard
+
+    def retire_exited(self):
+        """Fold the shards of exited threads into the totals, called with the lock held"""
+        while self.exited:
+            shard = self.exited.popleft()
+            self.shards.remove(shard)
+            self.fold(self.retired, shard)
+
+    def merged(self):
+        """A shard holding everything recorded so far"""
+        total = self.new_shard()
+        with self.lock:
+            self.retire_exited()
+            self.fold(total, self.retired)
+            for shard in self.shards:
+                self.fold(total, shard)
+        return total
+
+
+class HistogramShard:
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class LatencyHistogram(Sharded):
+    """Lock-free latency histogram with microsecond resolution"""
+
+    def new_shard(self):
+        return HistogramShard()
+
+    def fold(self, total, shard):
+        for index, bucket in enumerate(shard.counts):
+            if bucket:
+                total.counts[index] += bucket
+        total.count += shard.count
+        total.total += shard.total
+        total.max = max(total.max, shard.max)
+
+    def record(self, seconds):
+        value = int(seconds * 1e6)
+        if value < 0:
+            value = 0
+        shard = self.shard()
+        shard.counts[bucket_index(value)] += 1
+        shard.count += 1
+        shard.total += value
+        if value > shard.max:
+            shard.max = value
+
+    def snapshot(self):
+        """Merged percentiles in milliseconds"""
+        merged = self.merged()
+        counts = merged.counts
+        count, total, maximum = merged.count, merged.total, merged.max
+
+        def percentile(p):
+            target = p * count
+            seen = 0
+            for index, bucket in enumerate(counts):
+                seen += bucket
+                if bucket and seen >= target:
+                    return min(bucket_value(index), maximum) / 1000
+            return 0.0
+
+        return {
+            'count': count,
+            'mean_ms': total / count / 1000 if count else 0.0,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': maximum / 1000,
+        }
+
+
+class Counters(Sharded):
+    """Lock-free named counters"""
+
+    def new_shard(self):
+        return {}
+
+    def fold(self, total, shard):
+        for name, value in list(shard.items()):
+            total[name] = total.get(name, 0) + value
+
+    def add(self, name, amount=1):
+        shard = self.shard()
+        shard[name] = shard.get(name, 0) + amount
+
+    def snapshot(self):
+        return self.merged()
+
+
+class SequenceTracker:
+    """Detects dropped, duplicate and reordered frames from 16-bit sequence numbers"""
+
+    def __init__(self, counters):
+        self.counters = counters
+        self.last = None
+
+    def track(self, sequence):
+        sequence &= 0xFFFF
+        if self.last is None:
+            self.last = sequence
+            return
+        gap = (sequence - self.last) & 0xFFFF
+        if gap == 0:
+            self.counters.add('duplicate')
+        elif gap < 0x8000:
+            if gap > 1:
+                self.counters.add('dropped', gap - 1)
+            self.last = sequence
+        else:
+            # Arrived after a newer frame was already handled
+            self.counters.add('reordered')
+
+
+class ClientClock:
+    """Maps client timestamps onto the server clock.
+
+    Headset and server clocks are not synchronized, so the offset is taken
+    as the smallest observed (arrival - client time) over a recent window.
+    Latencies relative to it are the delay on top of the fastest recent
+    frame, which is what regressions and load show up in.
+    """
+
+    def __init__(self):
+        self.offset = None
+        self.window_min = None
+        self.samples = 0
+
+    def observe(self, server_time, client_time):
+        sample = server_time - client_time
+        if self.window_min is None or sample < self.window_min:
+            self.window_min = sample
+        if self.offset is None or sample < self.offset:
+            self.offset = sample
+        self.samples += 1
+        if self.samples >= CLOCK_WINDOW:
+            # Follow clock drift by restarting from the last window's minimum
+            self.offset = self.window_min
+            self.window_min = None
+            self.samples = 0
+
+    def delay(self, server_time, client_time):
+        return server_time - client_time - self.offset
+
+
+class Metrics:
+    """Registry of latency histograms and counters"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counters()
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+        return histogram
+
+    def snapshot(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+        return {
+            'latency': {name: histogram.snapshot() for name, histogram in histograms.items()},
+            'counters': self.counters.snapshot(),
+        }
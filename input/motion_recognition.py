@@ -0,0 +1,551 @@
+# input/motion_recognition.py
+"""Motion recognition on the input server.
+
+A NumPy port of the matcher in cam/public/MotionRecorder.js. The browser
+syncs its motion library (templates, joint importance, key mappings) with a
+motion_library message and then sends each trigger-held pose sequence as a
+pose_sequence message instead of matching it itself.
+
+Scores follow MotionRecorder.compareRelativeMotions() step for step, so the
+same library and thresholds recognize the same motions on either side, but
+a sequence is compared with every template at once. Templates are
+preprocessed once into stacked float32 tensors of resampled angle and
+distance changes, joint importance and phase weights, grouped by sample
+count, and scoring a group is a handful of array operations however many
+templates it holds.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Landmark indexes of the MediaPipe pose model used by the browser
+KEY_JOINTS = (11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28)
+JOINT_PAIRS = (
+    (24, 26), (26, 28), (23, 25), (25, 27),
+    (12, 14), (14, 16), (11, 13), (13, 15),
+    (11, 12), (23, 24), (11, 23), (12, 24),
+)
+ANGLE_PAIRS = (
+    ((23, 24), (23, 25)), ((24, 23), (24, 26)),
+    ((23, 25), (25, 27)), ((24, 26), (26, 28)),
+    ((11, 12), (11, 13)), ((12, 11), (12, 14)),
+    ((11, 13), (13, 15)), ((12, 14), (14, 16)),
+    ((11, 12), (23, 24)),
+)
+ANGLE_KEYS = tuple(f"angle_{a}_{b}_{c}_{d}" for (a, b), (c, d) in ANGLE_PAIRS)
+DISTANCE_KEYS = tuple(f"dist_{a}_{b}" for a, b in JOINT_PAIRS)
+LANDMARKS = 33
+
+# Matching configuration, the defaults of MotionRecorder
+SEQUENCE_MATCH_THRESHOLD = 0.5
+MIN_SEQUENCE_LENGTH = 5
+MIN_MOTION_DURATION = 200  # ms
+MIN_MOVEMENT_MAGNITUDE = 0.02
+MOTION_COOLDOWN = 1000  # ms
+DURATION_MATCH_WEIGHT = 0.35
+DURATION_TOLERANCE = 0.4
+NOISE_THRESHOLD = 0.003
+KEY_PHASE_WEIGHT = 1.8
+MAX_SAMPLES = 20
+DEFAULT_IMPORTANCE = 0.5  # Used for keys without an importance, or with 0
+REPORTED_MATCH_SCORE = 0.3  # Matches above this are reported for debugging
+# Duration differences above this (of motions over DURATION_REJECT_MIN ms)
+# score too low to ever match
+DURATION_REJECT_DIFF = 0.7
+DURATION_REJECT_MIN = 500
+
+# Candidate pre-filter: templates are ranked by a coarse motion summary and
+# only the nearest are scored in full
+PREFILTER_CANDIDATES = 0  # 0 scores every template, see README for the trade-off
+SUMMARY_DIRECTION_WEIGHT = 0.5
+SUMMARY_DURATION_WEIGHT = 0.5
+
+# Settings the browser can change, keyed like its motion_library and
+# pose_sequence messages
+DEFAULT_SETTINGS = {
+    'threshold': SEQUENCE_MATCH_THRESHOLD,
+    'cooldown': MOTION_COOLDOWN,
+    'minMovement': MIN_MOVEMENT_MAGNITUDE,
+    'minDuration': MIN_MOTION_DURATION,
+    'durationWeight': DURATION_MATCH_WEIGHT,
+    'durationTolerance': DURATION_TOLERANCE,
+    'keyPhaseWeight': KEY_PHASE_WEIGHT,
+    'candidates': PREFILTER_CANDIDATES,
+}
+
+TWO_PI = 2 * math.pi
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("Server-side motion recognition needs numpy (pip install numpy)")
+
+
+def wrap_angle(diff):
+    """Bring angle differences into [-pi, pi] like calculateAngleDifference()"""
+    diff = np.where(diff > math.pi, diff - TWO_PI, diff)
+    return np.where(diff < -math.pi, diff + TWO_PI, diff)
+
+
+def joint_features(poses):
+    """Joint angles (L, 9) and joint distances (L, 12) of poses shaped (L, 33, 3)"""
+    v1 = poses[:, [b for (a, b), _ in ANGLE_PAIRS]] - poses[:, [a for (a, b), _ in ANGLE_PAIRS]]
+    v2 = poses[:, [d for _, (c, d) in ANGLE_PAIRS]] - poses[:, [c for _, (c, d) in ANGLE_PAIRS]]
+    dot = (v1 * v2).sum(axis=-1)
+    magnitudes = np.sqrt((v1 * v1).sum(axis=-1)) * np.sqrt((v2 * v2).sum(axis=-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        angles = np.arccos(np.clip(dot / magnitudes, -1, 1))
+    angles = np.where(magnitudes == 0, 0.0, angles)
+
+    first = poses[:, [a for a, _ in JOINT_PAIRS]]
+    second = poses[:, [b for _, b in JOINT_PAIRS]]
+    distances = np.sqrt(((second - first) ** 2).sum(axis=-1))
+    return angles, distances
+
+
+def frame_changes(angles, distances):
+    """Per-frame angle and distance changes, row 0 has no predecessor and stays zero"""
+    angle_changes = np.zeros_like(angles)
+    distance_changes = np.zeros_like(distances)
+    angle_changes[1:] = wrap_angle(angles[1:] - angles[:-1])
+    distance_changes[1:] = distances[1:] - distances[:-1]
+    return angle_changes, distance_changes
+
+
+def smooth_array(values, window=3):
+    if len(values) <= window:
+        return values
+    half = window // 2
+    result = values.copy()
+    for i in range(half, len(values) - half):
+        result[i] = values[i - half:i + half + 1].sum() / window
+    return result
+
+
+def phase_importance(angle_changes, distance_changes, key_phase_weight=KEY_PHASE_WEIGHT):
+    """Weights emphasizing the span with the most movement, see calculatePhaseImportance()"""
+    count = len(angle_changes)
+    importance = np.ones(count)
+    if count < 3:
+        return importance
+
+    measures = angle_changes.shape[1] + distance_changes.shape[1]
+    magnitudes = (np.abs(angle_changes[1:]).sum(axis=1) +
+                  (np.abs(distance_changes[1:]) * 10).sum(axis=1)) / measures
+    max_phase = int(np.argmax(magnitudes)) if magnitudes.max() > 0 else 0
+    magnitudes = np.where(magnitudes < NOISE_THRESHOLD, 0.0, magnitudes)
+    smoothed = smooth_array(magnitudes)
+
+    start = end = current_start = 0
+    current_sum = max_sum = 0.0
+    for i, value in enumerate(smoothed):
+        if value > NOISE_THRESHOLD:
+            if current_sum == 0:
+                current_start = i
+            current_sum += value
+        elif current_sum > 0:
+            if current_sum > max_sum:
+                max_sum = current_sum
+                start, end = current_start, i - 1
+            current_sum = 0.0
+    if current_sum > max_sum:
+        max_sum = current_sum
+        start, end = current_start, len(smoothed) - 1
+    if max_sum == 0:
+        start = max(0, max_phase - 1)
+        end = min(count - 2, max_phase + 1)
+
+    # The frame after each key phase frame shows the result of the movement
+    importance[start:min(end + 2, count)] = key_phase_weight
+    return importance
+
+
+def motion_summary(duration, angle_changes, distance_changes):
+    """Coarse features for the candidate pre-filter.
+
+    Which joints move (the share of all movement per angle and distance),
+    which way they move overall (net over total change, -1 to 1) and the
+    log duration. Similar motions have nearby summaries even where their
+    frames do not line up.
+    """
+    changes = np.concatenate([angle_changes[1:], distance_changes[1:] * 10], axis=1)
+    energy = np.abs(changes).sum(axis=0)
+    total = energy.sum()
+    profile = energy / total if total > 0 else energy
+    direction = changes.sum(axis=0) / np.maximum(energy, 1e-9)
+    return np.concatenate([
+        profile,
+        direction * SUMMARY_DIRECTION_WEIGHT,
+        [math.log1p(max(duration, 0) / 1000) * SUMMARY_DURATION_WEIGHT],
+    ]).astype(np.float32)
+
+
+def resample_array(values, count):
+    """Linear resampling by index, see resampleArray()"""
+    length = len(values)
+    if length <= 1 or count <= 1:
+        return np.full(count, values[0] if length else 1.0)
+    position = (np.arange(count) / (count - 1)) * (length - 1)
+    index = np.floor(position).astype(int)
+    fraction = position - index
+    following = np.minimum(index + 1, length - 1)
+    return np.where(index + 1 < length,
+                    values[index] * (1 - fraction) + values[following] * fraction,
+                    values[index])
+
+
+def resample_changes(times, angles, distances, count):
+    """Angle and distance changes at `count` evenly spaced times, and which are valid.
+
+    Mirrors resampleRelativeMotion(): sequences already `count` frames long
+    are used as they are, others are smoothed and interpolated in time. As in
+    the browser, interpolated angle changes are wrapped into [0, 2*pi).
+    """
+    length = len(times)
+    valid = np.ones(count, dtype=bool)
+    if length == count:
+        angle_changes, distance_changes = frame_changes(angles, distances)
+        valid[0] = False
+        return angle_changes, distance_changes, valid
+
+    smoothed_angles = angles.copy()
+    smoothed_distances = distances.copy()
+    smoothed_angles[1:-1] = (angles[:-2] + 3 * angles[1:-1] + angles[2:]) / 5
+    smoothed_distances[1:-1] = (distances[:-2] + 2 * distances[1:-1] + distances[2:]) / 4
+    angle_changes, distance_changes = frame_changes(smoothed_angles, smoothed_distances)
+
+    targets = times[0] + ((times[-1] - times[0]) * np.arange(count)) / (count - 1)
+    before = np.searchsorted(times[1:], targets, side='left')
+    found = before < length - 1
+    before = np.where(found, before, 0)
+    after = np.where(found, before + 1, 0)
+    same_time = times[after] == times[before]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(same_time, 0.0, (targets - times[before]) / (times[after] - times[before]))
+    ratio = ratio[:, None]
+
+    first = angle_changes[before]
+    diff = wrap_angle(angle_changes[after] - first)
+    interpolated = first + diff * ratio
+    interpolated = np.where(interpolated < 0, interpolated + TWO_PI, interpolated)
+    interpolated = np.where(interpolated >= TWO_PI, interpolated - TWO_PI, interpolated)
+    resampled_angles = np.where(same_time[:, None], first, interpolated)
+
+    first = distance_changes[before]
+    resampled_distances = first + (distance_changes[after] - first) * ratio
+
+    # Frame 0 has no changes, so neither has anything interpolated from it
+    valid = found & (before >= 1)
+    return resampled_angles, resampled_distances, valid
+
+
+class Template:
+    """One saved motion, preprocessed for matching"""
+
+    def __init__(self, name, times, angles, distances, importance=None, key_mapping=None,
+                 key_phase_weight=KEY_PHASE_WEIGHT):
+        self.name = name
+        self.times = np.asarray(times, dtype=np.float64)
+        self.angles = np.asarray(angles, dtype=np.float64)
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.duration = float(self.times[-1] - self.times[0]) if len(self.times) else 0.0
+        self.key_mapping = key_mapping
+
+        self.importance = importance = importance or {}
+        self.angle_importance = np.array([importance.get(key) or DEFAULT_IMPORTANCE
+                                          for key in ANGLE_KEYS], dtype=np.float32)
+        self.distance_importance = np.array([importance.get(key) or DEFAULT_IMPORTANCE
+                                             for key in DISTANCE_KEYS], dtype=np.float32)
+        changes = frame_changes(self.angles, self.distances)
+        self.phase = phase_importance(*changes, key_phase_weight)
+        self.summary = motion_summary(self.duration, *changes)
+        self.resampled = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def sampled(self, count):
+        """Changes, validity and phase weights resampled to `count`, cached"""
+        sampled = self.resampled.get(count)
+        if sampled is None:
+            angle_changes, distance_changes, valid = resample_changes(
+                self.times, self.angles, self.distances, count)
+            sampled = self.resampled[count] = (angle_changes, distance_changes, valid,
+                                               resample_array(self.phase, count))
+        return sampled
+
+
+def template_from_motion(motion, key_phase_weight=KEY_PHASE_WEIGHT):
+    """Build a Template from a motion_library entry.
+
+    Entries carry the browser's relativeMotion frames as `frames`, each with
+    a timestamp, jointAngles and jointDistances keyed like the browser.
+    """
+    frames = motion['frames']
+    times = [frame['timestamp'] for frame in frames]
+    angles = [[frame['jointAngles'][key] for key in ANGLE_KEYS] for frame in frames]
+    distances = [[frame['jointDistances'][key] for key in DISTANCE_KEYS] for frame in frames]
+    return Template(motion['name'], times, angles, distances,
+                    motion.get('importance'), motion.get('keyMapping'), key_phase_weight)
+
+
+class TemplateGroup:
+    """Templates compared at the same sample count, stacked for batched scoring"""
+
+    def __init__(self, indexes, templates, count):
+        self.indexes = np.array(indexes)
+        sampled = [templates[index].sampled(count) for index in indexes]
+        self.angle_changes = np.stack([s[0] for s in sampled]).astype(np.float32)
+        self.distance_changes = np.stack([s[1] for s in sampled]).astype(np.float32)
+        self.valid = np.stack([s[2] for s in sampled])
+        self.phase = np.stack([s[3] for s in sampled]).astype(np.float32)
+        self.angle_importance = np.stack([templates[index].angle_importance for index in indexes])
+        self.distance_importance = np.stack([templates[index].distance_importance for index in indexes])
+
+    def take(self, rows):
+        """The part of the group for some of its templates"""
+        part = TemplateGroup.__new__(TemplateGroup)
+        for name, value in vars(self).items():
+            setattr(part, name, value[rows])
+        return part
+
+
+def score_group(group, angle_changes, distance_changes, valid, phase):
+    """Angle and distance scores of one sequence against every template in a group"""
+    angle_changes = angle_changes.astype(np.float32)[None, 1:]
+    distance_changes = distance_changes.astype(np.float32)[None, 1:]
+    # Frame 0 only anchors the changes and is never compared
+    both_valid = valid[None, 1:] & group.valid[:, 1:]
+    phase_weight = (phase.astype(np.float32)[None, 1:] + group.phase[:, 1:]) / 2
+    frames = np.maximum(both_valid.sum(axis=1), 1)
+
+    saved = group.angle_changes[:, 1:]
+    difference = np.abs(angle_changes - saved)
+    magnitude = np.maximum(np.abs(angle_changes), np.abs(saved))
+    threshold = np.where(magnitude > 0.5, math.pi / 3,
+                         np.where(magnitude < 0.1, math.pi / 1.3, math.pi / 2))
+    similarity = np.maximum(0, 1 - difference / threshold)
+    weight = group.angle_importance[:, None, :] * phase_weight[:, :, None]
+    frame_scores = (similarity * weight).sum(axis=2) / weight.sum(axis=2)
+    angle_score = np.where(both_valid, frame_scores, 0).sum(axis=1) / frames
+
+    saved = group.distance_changes[:, 1:]
+    current = np.broadcast_to(distance_changes, saved.shape)
+    same_direction = ((current >= 0) & (saved >= 0)) | ((current <= 0) & (saved <= 0))
+    largest = np.maximum(np.abs(current), np.abs(saved))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.minimum(np.abs(current), np.abs(saved)) / largest
+        magnitude_similarity = np.where(largest > 0.1, ratio ** 0.75, np.sqrt(ratio))
+    magnitude_similarity = np.where((np.abs(saved) < 0.01) | (largest <= 0.001), 1.0, magnitude_similarity)
+    similarity = np.where(same_direction, 0.8 + 0.2 * magnitude_similarity, 0)
+    weight = group.distance_importance[:, None, :] * phase_weight[:, :, None]
+    frame_scores = (similarity * weight).sum(axis=2) / weight.sum(axis=2)
+    distance_score = np.where(both_valid, frame_scores, 0).sum(axis=1) / frames
+
+    return angle_score, distance_score
+
+
+class MotionLibrary:
+    """An immutable set of templates and the stacked groups built from it"""
+
+    def __init__(self, templates=()):
+        self.templates = list(templates)
+        self.durations = np.array([template.duration for template in self.templates])
+        self.summaries = np.stack([template.summary for template in self.templates]) if self.templates else None
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.templates)
+
+    def group(self, count, exact):
+        """Templates compared at `count` samples: all at least that long, or exactly that long"""
+        key = (count, exact)
+        group = self.groups.get(key)
+        if group is None and key not in self.groups:
+            indexes = [index for index, template in enumerate(self.templates)
+                       if (len(template) == count if exact else min(len(template), MAX_SAMPLES) >= count)]
+            group = self.groups[key] = TemplateGroup(indexes, self.templates, count) if indexes else None
+        return group
+
+    def candidates(self, summary, duration, count):
+        """Indexes of the `count` templates with the nearest summaries, None for all.
+
+        Templates whose duration alone rules out a match are dropped first.
+        """
+        longest = np.maximum(duration, self.durations)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rejected = ((np.abs(duration - self.durations) / longest > DURATION_REJECT_DIFF) &
+                        (longest > DURATION_REJECT_MIN))
+        if not count or len(self.templates) - rejected.sum() <= count:
+            return np.flatnonzero(~rejected) if rejected.any() else None
+        distance = ((self.summaries - summary) ** 2).sum(axis=1)
+        distance[rejected] = np.inf
+        nearest = np.argpartition(distance, count)[:count]
+        return np.sort(nearest[np.isfinite(distance[nearest])])
+
+    def scores(self, times, angles, distances, settings, candidates=None):
+        """Match scores of a sequence against every template, in library order.
+
+        With candidates, only those templates are scored and all others get 0.
+        """
+        count = len(times)
+        angle_score = np.zeros(len(self.templates))
+        distance_score = np.zeros(len(self.templates))
+        scored = self.templates if candidates is None else [self.templates[index] for index in candidates]
+
+        # Each pair is compared at min(20, both lengths) samples
+        full = min(MAX_SAMPLES, count)
+        counts = {(full, False)}
+        counts.update((len(template), True) for template in scored if len(template) < full)
+        phase = phase_importance(*frame_changes(angles, distances), settings['keyPhaseWeight'])
+        for sample_count, exact in counts:
+            group = self.group(sample_count, exact)
+            if group is None:
+                continue
+            if candidates is not None:
+                rows = np.isin(group.indexes, candidates)
+                if not rows.any():
+                    continue
+                group = group.take(rows)
+            angle_changes, distance_changes, valid = resample_changes(times, angles, distances, sample_count)
+            scores = score_group(group, angle_changes, distance_changes, valid,
+                                 resample_array(phase, sample_count))
+            angle_score[group.indexes], distance_score[group.indexes] = scores
+
+        boost = np.maximum(angle_score, distance_score)
+        boost = np.where(boost > 0.6, (boost - 0.6) * 0.5, 0)
+        score = angle_score * 0.75 + distance_score * 0.25 + boost
+        score = np.where((angle_score > 0.8) & (distance_score > 0.6), np.minimum(1.0, score * 1.15), score)
+
+        duration = times[-1] - times[0]
+        longest = np.maximum(duration, self.durations)
+        tolerance = settings['durationTolerance']
+        weight = settings['durationWeight']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            duration_diff = np.abs(duration - self.durations) / longest
+            duration_score = np.where(
+                duration_diff > tolerance,
+                np.maximum(0.2, 1 - np.sqrt((duration_diff - tolerance) / (1 - tolerance))),
+                1.0)
+        score = score * (1 - weight) + duration_score * weight
+        score = np.clip(score, 0, 1)
+        # Very different durations are rejected before comparing frames
+        mismatch = (duration_diff > DURATION_REJECT_DIFF) & (longest > DURATION_REJECT_MIN)
+        score = np.where(mismatch, 0.3 * duration_score, score)
+        if candidates is not None:
+            score[np.setdiff1d(np.arange(len(score)), candidates)] = 0
+        return score, angle_score, distance_score
+
+
+class MotionRecognizer:
+    """Matches pose sequences against a library of motion templates.
+
+    The library is replaced with a single assignment, so a recognition in
+    progress keeps using the library it started with.
+    """
+
+    def __init__(self):
+        require_numpy()
+        self.library = MotionLibrary()
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.last_detection = None
+
+    def load_library(self, data):
+        """Replace the library from a motion_library message, returns the template count"""
+        self.configure(data.get('settings', {}))
+        weight = self.settings['keyPhaseWeight']
+        templates = []
+        for motion in data.get('motions', []):
+            template = template_from_motion(motion, weight)
+            # Sequences shorter than two frames never match in the browser either
+            if len(template) >= 2:
+                templates.append(template)
+        self.library = MotionLibrary(templates)
+        return len(templates)
+
+    def configure(self, settings):
+        """Apply the matching settings the browser sends, named like MotionUIAPI"""
+        changed = {key: float(value) for key, value in settings.items()
+                   if key in DEFAULT_SETTINGS and value is not None and float(value) != self.settings[key]}
+        if not changed:
+            return
+        self.settings = dict(self.settings, **changed)
+        if 'keyPhaseWeight' in changed:
+            # Phase weights are part of the preprocessed templates
+            self.library = MotionLibrary(
+                Template(t.name, t.times, t.angles, t.distances, t.importance, t.key_mapping,
+                         self.settings['keyPhaseWeight'])
+                for t in self.library.templates)
+
+    def recognize(self, timestamps, poses, now, settings=None):
+        """Find the best matching motion for a pose sequence.
+
+        timestamps are in ms, poses a flat list of 33 x, y, z landmarks per
+        frame, `now` is the server time in ms for the cooldown. Returns a
+        result dict whose 'motion' is the matched template, or None with a
+        'reason', also for a malformed sequence.
+        """
+        if settings:
+            try:
+                self.configure(settings)
+            except (AttributeError, TypeError, ValueError):
+                return {'motion': None, 'reason': 'bad_settings'}
+        settings = self.settings
+        if self.last_detection is not None and now - self.last_detection < settings['cooldown']:
+            return {'motion': None, 'reason': 'cooldown'}
+        library = self.library
+        if not len(library):
+            return {'motion': None, 'reason': 'no_templates'}
+
+        try:
+            times = np.asarray(timestamps, dtype=np.float64)
+            poses = np.asarray(poses, dtype=np.float64)
+        except (TypeError, ValueError):
+            return {'motion': None, 'reason': 'bad_sequence'}
+        if times.ndim != 1 or poses.size != len(times) * LANDMARKS * 3:
+            return {'motion': None, 'reason': 'bad_sequence'}
+        if len(times) < MIN_SEQUENCE_LENGTH:
+            return {'motion': None, 'reason': 'too_few_frames'}
+        times = times - times[0]
+        poses = poses.reshape(len(times), LANDMARKS, 3)
+
+        # Largest frame-to-frame movement of any key joint
+        steps = np.diff(poses[:, KEY_JOINTS], axis=0)
+        displacement = float(np.sqrt((steps ** 2).sum(axis=-1)).max())
+        if displacement < settings['minMovement']:
+            return {'motion': None, 'reason': 'too_little_movement'}
+        duration = float(times[-1])
+        if duration < settings['minDuration']:
+            return {'motion': None, 'reason': 'too_short'}
+
+        angles, distances = joint_features(poses)
+        summary = motion_summary(duration, *frame_changes(angles, distances))
+        candidates = library.candidates(summary, duration, int(settings['candidates']))
+        score, angle_score, distance_score = library.scores(times, angles, distances, settings, candidates)
+        saved_durations = library.durations
+
+        # Short motions need more confidence, long ones a little less
+        threshold = np.full(len(score), settings['threshold'])
+        short = (duration < 500) | (saved_durations < 500)
+        threshold = np.where(short, np.minimum(0.6, threshold + 0.1), threshold)
+        long = (duration > 2000) & (saved_durations > 2000)
+        threshold = np.where(long, np.maximum(0.4, threshold - 0.05), threshold)
+
+        eligible = np.where((score >= threshold) & (score > 0), score, -1.0)
+        best = int(np.argmax(eligible))
+        order = np.argsort(-score, kind='stable')
+        matches = [{'name': library.templates[index].name, 'score': round(float(score[index]), 4),
+                    'angleScore': round(float(angle_score[index]), 4),
+                    'distanceScore': round(float(distance_score[index]), 4)}
+                   for index in order[:3] if score[index] > REPORTED_MATCH_SCORE]
+        scored = len(library) if candidates is None else len(candidates)
+        if eligible[best] < 0:
+            return {'motion': None, 'reason': 'no_match', 'matches': matches, 'scored': scored}
+
+        self.last_detection = now
+        template = library.templates[best]
+        return {'motion': template.name, 'score': float(score[best]),
+                'keyMapping': template.key_mapping, 'matches': matches, 'scored': scored}
@@ -0,0 +1,255 @@
+# input/motion_store.py
+"""Saved motions on disk as packed float32 columns with a JSON manifest.
+
+The camera page used to keep its motions only in memory and in exported
+JSON files with an object per landmark per frame. The store keeps every
+motion in its own file instead:
+
+    header   4s magic 'MMOT', u16 version, u16 landmarks, u32 frames
+    columns  f32 time in ms since the motion started, one per frame,
+             then x, y, z and visibility, frames x landmarks each
+
+All values are little-endian and every column starts on a 4-byte boundary,
+so a file can be mmapped and each column viewed as a float array without
+parsing. manifest.json holds everything the page needs before the frames:
+names, frame counts, durations, key mappings and joint importance. Listing
+the library reads only the manifest and motion files are read when a
+motion is fetched, so a large library opens at once.
+
+    python motion_store.py list
+    python motion_store.py import motion_wave.json all_motions.json
+"""
+import argparse
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import uuid
+from array import array
+
+from event_log import log
+
+MAGIC = b'MMOT'
+VERSION = 1
+LANDMARKS = 33
+CHANNELS = ('x', 'y', 'z', 'visibility')
+
+HEADER = struct.Struct('<4sHHI')
+MANIFEST = 'manifest.json'
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'motions')
+
+MAX_NAME_LENGTH = 200
+MAX_FRAMES = 30 * 60 * 10  # Ten minutes at the camera page's 30 fps
+
+
+class MotionStoreError(ValueError):
+    pass
+
+
+def pack_motion(timestamps, poses):
+    """File contents for a motion.
+
+    timestamps are in ms, poses one flat [x, y, z, visibility] * landmarks
+    list per frame, as the camera page sends them.
+    """
+    frames = len(timestamps)
+    if frames < 2 or frames > MAX_FRAMES:
+        raise MotionStoreError(f"A motion needs 2 to {MAX_FRAMES} frames, got {frames}")
+    if len(poses) != frames:
+        raise MotionStoreError(f"{frames} timestamps but {len(poses)} poses")
+    width = LANDMARKS * len(CHANNELS)
+    flat = []
+    for pose in poses:
+        if len(pose) != width:
+            raise MotionStoreError(f"A pose needs {width} values, got {len(pose)}")
+        flat.extend(pose)
+
+    start = timestamps[0]
+    try:
+        columns = [array('f', [t - start for t in timestamps])]
+        columns += [array('f', flat[channel::len(CHANNELS)]) for channel in range(len(CHANNELS))]
+    except TypeError as e:
+        raise MotionStoreError(f"Motion frames must be numbers: {e}")
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    return HEADER.pack(MAGIC, VERSION, LANDMARKS, frames) + b''.join(c.tobytes() for c in columns)
+
+
+def unpack_motion(data):
+    """(timestamps, poses) of a motion file, the inverse of pack_motion()"""
+    if len(data) < HEADER.size:
+        raise MotionStoreError("Motion file is truncated")
+    magic, version, landmarks, frames = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise MotionStoreError(f"Not a version {VERSION} motion file")
+    values = array('f')
+    values.frombytes(data[HEADER.size:HEADER.size + frames * (1 + landmarks * len(CHANNELS)) * 4])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    if len(values) != frames * (1 + landmarks * len(CHANNELS)):
+        raise MotionStoreError("Motion file is truncated")
+
+    timestamps = values[:frames].tolist()
+    size = frames * landmarks
+    columns = [values[frames + i * size:frames + (i + 1) * size] for i in range(len(CHANNELS))]
+    poses = []
+    for frame in range(frames):
+        pose = []
+        for landmark in range(frame * landmarks, (frame + 1) * landmarks):
+            pose.extend(column[landmark] for column in columns)
+        poses.append(pose)
+    return timestamps, poses
+
+
+class MotionStore:
+    """A directory of motion files and their manifest.
+
+    Safe to use from several connection threads. Files are written under a
+    new name and the manifest replaced afterwards, so a reader never sees
+    half a motion, also while a fetch still has the old file open.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.motions = {}
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != VERSION:
+                raise MotionStoreError(f"{path} is not a version {VERSION} manifest")
+            self.motions = manifest['motions']
+
+    def __len__(self):
+        return len(self.motions)
+
+    def list(self):
+        """The manifest, without file names"""
+        with self.lock:
+            motions = [dict(name=name, **entry) for name, entry in self.motions.items()]
+        for motion in motions:
+            del motion['file']
+        return {'version': VERSION, 'landmarks': LANDMARKS, 'motions': motions}
+
+    def read(self, name):
+        """The motion file's contents, or None for an unknown motion"""
+        with self.lock:
+            entry = self.motions.get(name)
+        if entry is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # Replaced by save() since the manifest was read
+            return None
+
+    def save(self, name, timestamps, poses, key_mapping=None, importance=None):
+        """Add or replace a motion with its frames"""
+        check_name(name)
+        data = pack_motion(timestamps, poses)
+        slug = re.sub(r'[^A-Za-z0-9_-]+', '_', name)[:40]
+        filename = f"{slug}-{uuid.uuid4().hex[:8]}.mmot"
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, filename), 'wb') as f:
+            f.write(data)
+
+        with self.lock:
+            previous = self.motions.get(name)
+            self.motions[name] = {
+                'file': filename,
+                'frames': len(timestamps),
+                'duration': timestamps[-1] - timestamps[0],
+                'bytes': len(data),
+                'keyMapping': key_mapping,
+                'importance': importance or {},
+            }
+            self.write_manifest()
+        if previous is not None:
+            self.remove_file(previous['file'])
+
+    def update(self, name, key_mapping=None, importance=None):
+        """Replace the key mapping and joint importance of a stored motion"""
+        with self.lock:
+            entry = self.motions.get(name)
+            if entry is None:
+                raise MotionStoreError(f"No stored motion named {name!r}")
+            entry['keyMapping'] = key_mapping
+            entry['importance'] = importance or {}
+            self.write_manifest()
+
+    def write_manifest(self):
+        """Replace manifest.json, called with the lock held"""
+        path = os.path.join(self.directory, MANIFEST)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION, 'motions': self.motions}, f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    def remove_file(self, filename):
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except OSError as e:
+            # Still open on Windows, left behind
+            log.warning('motion_file', "Could not remove old motion file {file}: {error}", file=filename, error=e)
+
+
+def check_name(name):
+    if not isinstance(name, str) or not 0 < len(name) <= MAX_NAME_LENGTH:
+        raise MotionStoreError(f"Motion names need 1 to {MAX_NAME_LENGTH} characters")
+
+
+def exported_motions(path, data):
+    """(name, motion) pairs of a file written by the page's export buttons"""
+    if 'sequence' in data:
+        name = re.sub(r'^motion_', '', os.path.splitext(os.path.basename(path))[0])
+        return [(name, data)]
+    return list(data.items())
+
+
+def import_exports(store, paths):
+    """Copy motions exported as JSON into the store"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        json_size = os.path.getsize(path)
+        stored_size = 0
+        motions = exported_motions(path, data)
+        for name, motion in motions:
+            sequence = motion['sequence']
+            poses = [[value for landmark in frame['pose']
+                      for value in (landmark['x'], landmark['y'], landmark.get('z') or 0,
+                                    landmark.get('visibility', 1.0))]
+                     for frame in sequence]
+            store.save(name, [frame['timestamp'] for frame in sequence], poses,
+                       motion.get('keyMapping'), motion.get('importance'))
+            stored_size += store.motions[name]['bytes']
+        print(f"{path}: {len(motions)} motions, {json_size / 1024:.1f} KB of JSON "
+              f"stored in {stored_size / 1024:.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--directory', default=DEFAULT_DIRECTORY, help="Motion store directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="List the stored motions")
+    importer = commands.add_parser('import', help="Add motions exported from the camera page")
+    importer.add_argument('files', nargs='+', help="Exported motion JSON files")
+    args = parser.parse_args()
+
+    store = MotionStore(args.directory)
+    if args.command == 'import':
+        import_exports(store, args.files)
+    else:
+        for motion in store.list()['motions']:
+            mapping = (motion['keyMapping'] or {}).get('key', '-')
+            print(f"{motion['name']:<30} {motion['frames']:>5} frames {motion['duration']:>7.0f} ms "
+                  f"{motion['bytes'] / 1024:>7.1f} KB  key {mapping}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# input/mouse_motion.py
+"""Fixed-rate cursor motion from thumbstick state.
+
+Frame handlers only store the latest stick position of their session. A
+single engine thread ticks at a fixed rate (500 Hz by default), turns every
+deflected stick into a cursor velocity and sends one relative move per
+tick. Movement is integrated over the real time between ticks and the
+fractional pixels are carried over to the next tick, so slow turns move
+smoothly instead of rounding down to nothing, and a late tick moves
+further rather than losing input.
+"""
+import math
+import sys
+import threading
+import time
+
+DEFAULT_RATE = 500  # Ticks per second
+DEADZONE = 0.05  # Stick values below this are treated as centered
+RESPONSE_EXPONENT = 1.5  # Finer control near the center
+# Share of the previous smoothed value kept per 1/60 s, the server's old
+# update interval
+SMOOTHING = 0.3
+# Longest time one tick integrates, so a stalled thread cannot jump the cursor
+MAX_TICK = 0.05
+
+
+class Stick:
+    """Latest stick position and smoothing state of one session"""
+
+    def __init__(self):
+        # Written by the session's handler as one tuple, read by the engine
+        self.axes = (0.0, 0.0)
+        self.smoothed_x = 0.0
+        self.smoothed_y = 0.0
+        self.remainder_x = 0.0
+        self.remainder_y = 0.0
+        self.moving = False
+
+    def set(self, x, y):
+        self.axes = (x if abs(x) >= DEADZONE else 0.0, y if abs(y) >= DEADZONE else 0.0)
+
+    def step(self, dt, speed):
+        """Whole pixels to move for a tick of dt seconds at full-deflection speed"""
+        x, y = self.axes
+        if x == 0 and y == 0:
+            # Stop at once when the stick is centered, like a released mouse
+            self.moving = False
+            self.smoothed_x = self.smoothed_y = 0.0
+            self.remainder_x = self.remainder_y = 0.0
+            return 0, 0
+
+        if not self.moving:
+            self.moving = True
+            self.smoothed_x, self.smoothed_y = x, y
+        else:
+            blend = 1 - SMOOTHING ** (dt * 60)
+            self.smoothed_x += (x - self.smoothed_x) * blend
+            self.smoothed_y += (y - self.smoothed_y) * blend
+
+        self.remainder_x += math.copysign(abs(self.smoothed_x) ** RESPONSE_EXPONENT, self.smoothed_x) * speed * dt
+        self.remainder_y += math.copysign(abs(self.smoothed_y) ** RESPONSE_EXPONENT, self.smoothed_y) * speed * dt
+        dx = int(self.remainder_x)
+        dy = int(self.remainder_y)
+        self.remainder_x -= dx
+        self.remainder_y -= dy
+        return dx, dy
+
+
+class MouseMotion:
+    """Moves the cursor at a fixed rate from the sticks of all sessions.
+
+    sensitivity is in pixels per 1/60 s at full deflection, matching the
+    server's MOUSE_SENSITIVITY. is_enabled gates movement, e.g. on window
+    focus.
+    """
+
+    def __init__(self, get_output, rate=DEFAULT_RATE, sensitivity=25, is_enabled=None):
+        self.get_output = get_output
+        self.period = 1.0 / rate
+        self.speed = sensitivity * 60
+        self.is_enabled = is_enabled
+        self.sticks = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.last_tick = None
+        self.thread = None
+        self.ticks = 0
+        self.moves = 0
+
+    def add_stick(self):
+        stick = Stick()
+        with self.lock:
+            self.sticks = self.sticks + [stick]
+        return stick
+
+    def remove_stick(self, stick):
+        stick.set(0, 0)
+        with self.lock:
+            self.sticks = [other for other in self.sticks if other is not stick]
+
+    def set_stick(self, stick, x, y):
+        """Store a stick position, returns True when it is outside the deadzone"""
+        stick.set(x, y)
+        active = stick.axes != (0.0, 0.0)
+        if active:
+            self.wake.set()
+        return active
+
+    def tick(self, now):
+        dt = self.period if self.last_tick is None else min(now - self.last_tick, MAX_TICK)
+        self.last_tick = now
+        self.ticks += 1
+        if self.is_enabled is not None and not self.is_enabled():
+            return
+        output = self.get_output()
+        moved = False
+        # The list is replaced, never mutated, so it can be read without the lock
+        for stick in self.sticks:
+            dx, dy = stick.step(dt, self.speed)
+            if dx or dy:
+                output.move_cursor(dx, dy)
+                moved = True
+        if moved:
+            self.moves += 1
+            output.flush()
+
+    def active(self):
+        return any(stick.axes != (0.0, 0.0) or stick.moving for stick in self.sticks)
+
+    def run(self):
+        if sys.platform == 'win32':
+            # Raise the system timer resolution to 1 ms for accurate sleeps
+            import ctypes
+            ctypes.windll.winmm.timeBeginPeriod(1)
+
+        next_tick = time.perf_counter()
+        while True:
+            self.wake.clear()
+            if not self.active():
+                # Idle until a stick leaves the deadzone
+                self.wake.wait()
+                self.last_tick = None
+                next_tick = time.perf_counter()
+            self.tick(time.perf_counter())
+            next_tick += self.period
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind, the next tick integrates the missed time
+                next_tick = time.perf_counter()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="mouse-motion", daemon=True)
+            self.thread.start()
+
+    def drive(self, scheduler):
+        """Tick from scheduler callbacks instead of a thread, replays use a ManualScheduler"""
+        def tick():
+            self.tick(scheduler.time())
+            scheduler.call_later(self.period, tick)
+        scheduler.call_later(self.period, tick)
+
+    def stats(self):
+        return {'rate': round(1.0 / self.period), 'ticks': self.ticks, 'moves': self.moves}
@@ -0,0 +1,494 @@
+# input/output_backends.py
+"""Output backends that turn key/mouse actions into OS input events.
+
+The server never talks to the OS directly. Handlers queue events on the
+active backend while they process a frame and call flush() once at the
+end, so every event a frame produces is submitted as a single batch.
+"""
+import multiprocessing
+import struct
+import sys
+import threading
+import time
+
+from event_log import log
+
+try:
+    import ctypes
+    from ctypes import wintypes
+except ImportError:  # pragma: no cover - ctypes is always present on CPython
+    ctypes = None
+
+try:
+    import keyboard
+except ImportError:
+    keyboard = None
+
+try:
+    from evdev import UInput, ecodes
+except ImportError:
+    UInput = None
+    ecodes = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+# Event kinds queued by the backends
+KEY_DOWN = 'key_down'
+KEY_UP = 'key_up'
+MOUSE_DOWN = 'mouse_down'
+MOUSE_UP = 'mouse_up'
+MOUSE_MOVE = 'mouse_move'
+SCROLL = 'scroll'
+
+# One notch of the mouse wheel, as used by Windows
+WHEEL_DELTA = 120
+
+
+class OutputBackend:
+    """Base class for input injection backends.
+
+    Events are queued per thread so that a frame handled on one connection
+    is never flushed half-way by another connection's flush() call.
+    """
+    name = 'base'
+
+    def __init__(self):
+        self._local = threading.local()
+        self.batch_count = 0
+        self.event_count = 0
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = []
+        return pending
+
+    def key_down(self, key):
+        self._pending().append((KEY_DOWN, key, 0))
+
+    def key_up(self, key):
+        self._pending().append((KEY_UP, key, 0))
+
+    def mouse_down(self, button):
+        """Press a mouse button ('left' or 'right')"""
+        self._pending().append((MOUSE_DOWN, button, 0))
+
+    def mouse_up(self, button):
+        """Release a mouse button ('left' or 'right')"""
+        self._pending().append((MOUSE_UP, button, 0))
+
+    def move_cursor(self, dx, dy):
+        """Move the cursor by a relative amount in pixels"""
+        self._pending().append((MOUSE_MOVE, dx, dy))
+
+    def scroll(self, amount):
+        """Scroll the wheel, positive values scroll up (zoom in)"""
+        self._pending().append((SCROLL, amount, 0))
+
+    def flush(self):
+        """Submit all events queued by the calling thread as one batch"""
+        pending = getattr(self._local, 'pending', None)
+        if not pending:
+            return 0
+        self._local.pending = []
+        self.batch_count += 1
+        self.event_count += len(pending)
+        try:
+            self.submit(pending)
+        except Exception as e:
+            log.error('injection_error', "Error injecting input batch ({backend}): {error}", backend=self.name, error=e)
+        return len(pending)
+
+    def submit(self, events):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'name': self.name, 'batches': self.batch_count, 'events': self.event_count}
+
+    def close(self):
+        pass
+
+
+class NullBackend(OutputBackend):
+    """Discards every event, useful for benchmarking the handler alone"""
+    name = 'null'
+
+    def submit(self, events):
+        pass
+
+
+class RecordingBackend(OutputBackend):
+    """Keeps every submitted batch in memory instead of injecting it"""
+    name = 'recording'
+
+    def __init__(self, max_events=None, clock=time.perf_counter):
+        super().__init__()
+        self.max_events = max_events
+        # Timestamps events, replays pass their virtual clock
+        self.clock = clock
+        self.events = []
+        self.lock = threading.Lock()
+
+    def submit(self, events):
+        now = self.clock()
+        with self.lock:
+            self.events.extend((now,) + event for event in events)
+            if self.max_events is not None and len(self.events) > self.max_events:
+                del self.events[:len(self.events) - self.max_events]
+
+    def clear(self):
+        with self.lock:
+            self.events = []
+
+
+if ctypes is not None and sys.platform == 'win32':
+    INPUT_MOUSE = 0
+    INPUT_KEYBOARD = 1
+
+    KEYEVENTF_EXTENDEDKEY = 0x0001
+    KEYEVENTF_KEYUP = 0x0002
+    KEYEVENTF_SCANCODE = 0x0008
+
+    MOUSEEVENTF_MOVE = 0x0001
+    MOUSEEVENTF_LEFTDOWN = 0x0002
+    MOUSEEVENTF_LEFTUP = 0x0004
+    MOUSEEVENTF_RIGHTDOWN = 0x0008
+    MOUSEEVENTF_RIGHTUP = 0x0010
+    MOUSEEVENTF_WHEEL = 0x0800
+
+    ULONG_PTR = ctypes.c_size_t
+
+    class MOUSEINPUT(ctypes.Structure):
+        _fields_ = [('dx', wintypes.LONG),
+                    ('dy', wintypes.LONG),
+                    ('mouseData', wintypes.DWORD),
+                    ('dwFlags', wintypes.DWORD),
+                    ('time', wintypes.DWORD),
+                    ('dwExtraInfo', ULONG_PTR)]
+
+    class KEYBDINPUT(ctypes.Structure):
+        _fields_ = [('wVk', wintypes.WORD),
+                    ('wScan', wintypes.WORD),
+                    ('dwFlags', wintypes.DWORD),
+                    ('time', wintypes.DWORD),
+                    ('dwExtraInfo', ULONG_PTR)]
+
+    class HARDWAREINPUT(ctypes.Structure):
+        _fields_ = [('uMsg', wintypes.DWORD),
+                    ('wParamL', wintypes.WORD),
+                    ('wParamH', wintypes.WORD)]
+
+    class _INPUTUNION(ctypes.Union):
+        _fields_ = [('mi', MOUSEINPUT),
+                    ('ki', KEYBDINPUT),
+                    ('hi', HARDWAREINPUT)]
+
+    class INPUT(ctypes.Structure):
+        _anonymous_ = ('u',)
+        _fields_ = [('type', wintypes.DWORD),
+                    ('u', _INPUTUNION)]
+
+    _MOUSE_BUTTON_FLAGS = {
+        ('left', MOUSE_DOWN): MOUSEEVENTF_LEFTDOWN,
+        ('left', MOUSE_UP): MOUSEEVENTF_LEFTUP,
+        ('right', MOUSE_DOWN): MOUSEEVENTF_RIGHTDOWN,
+        ('right', MOUSE_UP): MOUSEEVENTF_RIGHTUP,
+    }
+
+
+class Win32Backend(OutputBackend):
+    """Injects a whole batch with a single SendInput() call.
+
+    Keys are resolved to scan codes through the keyboard module, so the same
+    key names ('w', 'space', 'shift', 'f1', ...) keep working. Cursor moves
+    are relative mouse input, so games reading raw mouse deltas see them and
+    no GetCursorPos() round trip is needed.
+    """
+    name = 'win32'
+
+    def __init__(self):
+        super().__init__()
+        if ctypes is None or sys.platform != 'win32':
+            raise RuntimeError("Win32 backend is only available on Windows")
+        if keyboard is None:
+            raise RuntimeError("Win32 backend needs the keyboard package (pip install keyboard)")
+        self.send_input = ctypes.windll.user32.SendInput
+        self.scan_codes = {}
+
+    def scan_code(self, key):
+        code = self.scan_codes.get(key)
+        if code is None:
+            code = keyboard.key_to_scan_codes(key)[0]
+            self.scan_codes[key] = code
+        return code
+
+    def submit(self, events):
+        inputs = []
+        for kind, a, b in events:
+            if kind == KEY_DOWN or kind == KEY_UP:
+                try:
+                    code = self.scan_code(a)
+                except Exception as e:
+                    log.error('key_error', "Error resolving key {key}: {error}", key=a, error=e)
+                    continue
+                flags = KEYEVENTF_SCANCODE
+                if code > 0xFF:
+                    flags |= KEYEVENTF_EXTENDEDKEY
+                if kind == KEY_UP:
+                    flags |= KEYEVENTF_KEYUP
+                item = INPUT(type=INPUT_KEYBOARD)
+                item.ki = KEYBDINPUT(0, code & 0xFF, flags, 0, 0)
+                inputs.append(item)
+            elif kind == MOUSE_DOWN or kind == MOUSE_UP:
+                item = INPUT(type=INPUT_MOUSE)
+                item.mi = MOUSEINPUT(0, 0, 0, _MOUSE_BUTTON_FLAGS[(a, kind)], 0, 0)
+                inputs.append(item)
+            elif kind == SCROLL:
+                item = INPUT(type=INPUT_MOUSE)
+                # mouseData is a DWORD, negative wheel deltas wrap around
+                item.mi = MOUSEINPUT(0, 0, (a * WHEEL_DELTA) & 0xFFFFFFFF,
+                                     MOUSEEVENTF_WHEEL, 0, 0)
+                inputs.append(item)
+            elif kind == MOUSE_MOVE:
+                item = INPUT(type=INPUT_MOUSE)
+                item.mi = MOUSEINPUT(a, b, 0, MOUSEEVENTF_MOVE, 0, 0)
+                inputs.append(item)
+        self.send(inputs)
+
+    def send(self, inputs):
+        if not inputs:
+            return
+        array = (INPUT * len(inputs))(*inputs)
+        sent = self.send_input(len(inputs), array, ctypes.sizeof(INPUT))
+        if sent != len(inputs):
+            log.warning('injection_short', "SendInput injected {sent} of {events} events",
+                        sent=sent, events=len(inputs))
+
+
+# Key names used by the server and by motion key commands, mapped to evdev codes
+LINUX_KEY_ALIASES = {
+    'space': 'KEY_SPACE',
+    'tab': 'KEY_TAB',
+    'enter': 'KEY_ENTER',
+    'esc': 'KEY_ESC',
+    'escape': 'KEY_ESC',
+    'backspace': 'KEY_BACKSPACE',
+    'ctrl': 'KEY_LEFTCTRL',
+    'shift': 'KEY_LEFTSHIFT',
+    'alt': 'KEY_LEFTALT',
+    'up': 'KEY_UP',
+    'down': 'KEY_DOWN',
+    'left': 'KEY_LEFT',
+    'right': 'KEY_RIGHT',
+    '-': 'KEY_MINUS',
+    '=': 'KEY_EQUAL',
+}
+
+
+class LinuxBackend(OutputBackend):
+    """Injects events through a uinput virtual device (needs python-evdev).
+
+    A batch is written as raw events followed by a single SYN_REPORT, which is
+    how the kernel expects one input frame to be delivered.
+    """
+    name = 'linux'
+
+    def __init__(self):
+        super().__init__()
+        if UInput is None:
+            raise RuntimeError("Linux backend needs the evdev package")
+        keys = [code for name, code in ecodes.ecodes.items() if name.startswith('KEY_')]
+        capabilities = {
+            ecodes.EV_KEY: sorted(set(keys)) + [ecodes.BTN_LEFT, ecodes.BTN_RIGHT],
+            ecodes.EV_REL: [ecodes.REL_X, ecodes.REL_Y, ecodes.REL_WHEEL],
+        }
+        self.device = UInput(capabilities, name='motioncraft-input')
+        self.write_lock = threading.Lock()
+        self.key_codes = {}
+
+    def key_code(self, key):
+        code = self.key_codes.get(key)
+        if code is None:
+            name = LINUX_KEY_ALIASES.get(key, 'KEY_' + key.upper())
+            code = ecodes.ecodes[name]
+            self.key_codes[key] = code
+        return code
+
+    def submit(self, events):
+        with self.write_lock:
+            for kind, a, b in events:
+                if kind == KEY_DOWN or kind == KEY_UP:
+                    try:
+                        code = self.key_code(a)
+                    except KeyError:
+                        log.error('key_error', "Error resolving key {key}: unknown key", key=a)
+                        continue
+                    self.device.write(ecodes.EV_KEY, code, 1 if kind == KEY_DOWN else 0)
+                elif kind == MOUSE_DOWN or kind == MOUSE_UP:
+                    code = ecodes.BTN_LEFT if a == 'left' else ecodes.BTN_RIGHT
+                    self.device.write(ecodes.EV_KEY, code, 1 if kind == MOUSE_DOWN else 0)
+                elif kind == MOUSE_MOVE:
+                    if a:
+                        self.device.write(ecodes.EV_REL, ecodes.REL_X, a)
+                    if b:
+                        self.device.write(ecodes.EV_REL, ecodes.REL_Y, b)
+                elif kind == SCROLL:
+                    self.device.write(ecodes.EV_REL, ecodes.REL_WHEEL, a)
+            self.device.syn()
+
+    def close(self):
+        self.device.close()
+
+
+# Ring buffer of fixed-size event records shared with the injector process.
+# The header keeps each index on its own cache line: the server only writes
+# `written`, the injector only writes `read` and its own counters.
+RING_CAPACITY = 4096  # Records, a few seconds of input even at 1000 Hz cursor updates
+RECORD = struct.Struct('<BBxxiid20s')  # kind, flags, a, b, perf_counter() at flush, key or button
+RECORD_KINDS = [KEY_DOWN, KEY_UP, MOUSE_DOWN, MOUSE_UP, MOUSE_MOVE, SCROLL]
+RECORD_CODES = {kind: code for code, kind in enumerate(RECORD_KINDS)}
+LAST_IN_BATCH = 1
+WRITTEN = 0  # Records published by the server
+READ = 64  # Records injected or skipped by the injector
+INJECTED = 128  # Injector counters: events, batches, total and max lag in us, errors
+RING_HEADER = 192
+INJECTOR_START_TIMEOUT = 10
+
+
+def ring_counter(buffer, offset):
+    """An aligned uint64 in the ring's header, stored and loaded in one access"""
+    return ctypes.c_uint64.from_buffer(buffer, offset)
+
+
+class SharedMemoryBackend(OutputBackend):
+    """Hands batches to an injector process through a shared-memory ring buffer.
+
+    OS injection then never waits on this interpreter's GIL or garbage
+    collector. flush() packs the batch into fixed-size records and only
+    wakes the injector, which drains the ring and submits each batch
+    through its own native backend. The ring has a single writer, serialized
+    by a lock in this process, and a single reader, so the processes share
+    no lock. A batch that does not fit is dropped at once and counted, the
+    ring holds seconds of input so only a stalled injector fills it. The
+    injector reports how long events spent in the ring. Its entry point is
+    in injector.py, which the spawned process imports instead of the server.
+    """
+    name = 'shm'
+
+    def __init__(self, target='auto', capacity=RING_CAPACITY):
+        super().__init__()
+        if shared_memory is None or ctypes is None:
+            raise RuntimeError("Shared memory backend needs Python 3.8 or later")
+        self.capacity = capacity
+        self.memory = shared_memory.SharedMemory(create=True, size=RING_HEADER + capacity * RECORD.size)
+        self.written = ring_counter(self.memory.buf, WRITTEN)
+        self.read = ring_counter(self.memory.buf, READ)
+        self.write_lock = threading.Lock()
+        self.overflows = 0
+        self.dropped = 0
+
+        # injector.py imports this module, so it is imported once this one is loaded
+        from injector import run_injector
+
+        # Spawned rather than forked, the server already runs threads
+        context = multiprocessing.get_context('spawn')
+        self.wakeup = context.Event()
+        self.stopping = context.Event()
+        ready = context.Event()
+        self.injector = context.Process(target=run_injector, name='motioncraft-injector', daemon=True,
+                                        args=(self.memory.name, capacity, target, self.wakeup,
+                                              self.stopping, ready))
+        self.injector.start()
+        # Starting an interpreter takes a while, frames queued meanwhile would overflow the ring
+        if not ready.wait(INJECTOR_START_TIMEOUT):
+            self.close()
+            raise RuntimeError("Injector process did not start")
+
+    def submit(self, events):
+        records = []
+        for kind, a, b in events:
+            if kind == MOUSE_MOVE or kind == SCROLL:
+                records.append((RECORD_CODES[kind], a, b, b''))
+            else:
+                name = a.encode()
+                if len(name) > 20:
+                    log.error('key_error', "Error queuing key {key}: name too long", key=a)
+                    continue
+                records.append((RECORD_CODES[kind], 0, 0, name))
+        if not records:
+            return
+
+        with self.write_lock:
+            written = self.written.value
+            if written + len(records) - self.read.value > self.capacity:
+                # A stalled injector must not stall the frame handlers too
+                self.overflows += 1
+                self.dropped += len(records)
+                full = True
+            else:
+                full = False
+                now = time.perf_counter()
+                buffer = self.memory.buf
+                last = len(records) - 1
+                for i, (code, a, b, name) in enumerate(records):
+                    offset = RING_HEADER + (written + i) % self.capacity * RECORD.size
+                    RECORD.pack_into(buffer, offset, code, LAST_IN_BATCH if i == last else 0, a, b, now, name)
+                # Publish the records only once they are complete
+                self.written.value = written + len(records)
+        if full:
+            log.error('ring_overflow', "Injector ring full, dropped {events} events", events=len(records))
+        self.wakeup.set()
+
+    def stats(self):
+        stats = super().stats()
+        header = self.memory.buf
+        injected, batches, total_lag, max_lag, errors = struct.unpack_from('<5Q', header, INJECTED)
+        stats.update({
+            'queued': self.written.value - self.read.value,
+            'overflows': self.overflows,
+            'dropped': self.dropped,
+            'injected': injected,
+            'injector_batches': batches,
+            'injector_errors': errors,
+            'mean_lag_ms': total_lag / (injected or 1) / 1000,
+            'max_lag_ms': max_lag / 1000,
+            'injector_alive': self.injector.is_alive(),
+        })
+        return stats
+
+    def close(self):
+        self.stopping.set()
+        self.wakeup.set()
+        self.injector.join(timeout=1)
+        if self.injector.is_alive():
+            self.injector.terminate()
+        # The header views must go before the mapping can be closed
+        del self.written, self.read
+        self.memory.close()
+        self.memory.unlink()
+
+
+BACKENDS = {
+    'win32': Win32Backend,
+    'linux': LinuxBackend,
+    'shm': SharedMemoryBackend,
+    'recording': RecordingBackend,
+    'null': NullBackend,
+}
+
+
+def create_backend(name='auto'):
+    """Create an output backend by name, 'auto' picks the native one"""
+    if name != 'auto':
+        return BACKENDS[name]()
+
+    native = Win32Backend if sys.platform == 'win32' else LinuxBackend
+    try:
+        return native()
+    except Exception as e:
+        log.warning('backend_unavailable', "Native input backend unavailable ({error}), falling back to null backend",
+                    error=e)
+        return NullBackend()
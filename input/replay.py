@@ -0,0 +1,205 @@
+# input/replay.py
+"""Replay a /ws capture through the frame handler.
+
+Captures are recorded with `wow_input_server.py --capture FILE`. Every
+connection in the capture gets a fresh ControllerSession, messages are fed
+in at their recorded pace (or N times faster, or as fast as possible) and
+the injected events are kept by a RecordingBackend instead of reaching the
+OS. Click releases, scroll repeats and cursor motion ticks run on a
+virtual clock that follows the capture, so the injected event stream is
+identical at any speed and can be diffed between versions:
+
+    python replay.py session.mcap --events before.txt
+    python replay.py session.mcap --speed 1 --verbose
+
+With --handler-ms the handler is modelled as busy for that long per batch,
+so frames queue up and are coalesced like on a loaded server.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+import wow_input_server as server
+from bindings import DEFAULT_PROFILE, BindingStore
+from broadcast import Channel
+from capture import KIND_CLOSE, KIND_OPEN, CaptureReader
+from input_router import InputRouter
+from input_state import InputState
+from mouse_motion import MouseMotion
+from output_backends import RecordingBackend
+from scheduler import ManualScheduler
+
+# Virtual time allowed after the last message for pending click releases
+DRAIN_TIME = 1.0
+
+
+class ReplayClient(Channel):
+    """Stands in for a websocket and counts what the server sends to it"""
+
+    def put(self, message, droppable=True):
+        self.sent += 1
+
+
+def reset_server(profile):
+    """Point the server module at a virtual clock and a recording backend"""
+    scheduler = ManualScheduler()
+    server.scheduler = scheduler
+    server.clock = scheduler.time
+    server.output = RecordingBackend(clock=scheduler.time)
+    server.bindings = BindingStore(profile)
+    server.input_state = InputState(server.bindings.table, focused=True)
+    server.router = InputRouter(lambda: server.output)
+    server.router.configure(server.bindings.table)
+    server.recognizer = None
+    server.motion_store = None
+    server.mouse = MouseMotion(lambda: server.output, server.MOUSE_RATE, server.MOUSE_SENSITIVITY)
+    server.mouse.drive(scheduler)
+    return scheduler, server.output
+
+
+def replay(path, speed=0, profile=DEFAULT_PROFILE, verbose=False, handler_time=0.0):
+    """Replay a capture and return (events, stats).
+
+    speed is a multiple of real time, 0 replays as fast as possible.
+    handler_time is how many virtual seconds each batch keeps a
+    connection's handler busy. Messages arriving meanwhile queue up and
+    are handed to the session together, as on a loaded server, so frame
+    coalescing is replayed deterministically. 0 handles every message
+    as it arrives.
+    """
+    scheduler, output = reset_server(profile)
+    reader = CaptureReader(path)
+    sessions = {}
+    backlog = {}  # Connection -> [(message, arrival)] waiting for its handler
+    busy_until = {}  # Connection -> virtual time its handler is free again
+    timings = []
+    errors = 0
+    duration = 0.0
+
+    def handle(connection, batch):
+        nonlocal errors
+        received = time.perf_counter()
+        try:
+            sessions[connection].handle_messages([(message, received) for message, _ in batch],
+                                                 [arrival for _, arrival in batch])
+        except Exception as e:
+            errors += 1
+            print(f"Error replaying message from connection {connection}: {e}")
+        elapsed = time.perf_counter() - received
+        timings.extend([elapsed / len(batch)] * len(batch))
+
+    def work_off(until):
+        """Hand each backlog to its session once the handler is free, up to `until`"""
+        while True:
+            due = [(busy_until[connection], connection) for connection in backlog
+                   if busy_until[connection] <= until]
+            if not due:
+                return
+            free, connection = min(due)
+            scheduler.advance(free)
+            batch = backlog.pop(connection)
+            if len(batch) > server.COALESCE_LIMIT:
+                backlog[connection] = batch[server.COALESCE_LIMIT:]
+                batch = batch[:server.COALESCE_LIMIT]
+            handle(connection, batch)
+            busy_until[connection] = free + handler_time
+
+    log = sys.stdout if verbose else open(os.devnull, 'w')
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        for arrival, connection, kind, message in reader:
+            duration = arrival
+            if speed:
+                delay = started + arrival / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            work_off(arrival)
+            scheduler.advance(arrival)
+
+            if kind == KIND_OPEN:
+                session = sessions[connection] = server.ControllerSession(ReplayClient())
+                session.open()
+            elif kind == KIND_CLOSE:
+                if connection in sessions:
+                    # The handler works off what the connection sent before closing
+                    batch = backlog.pop(connection, None)
+                    if batch:
+                        handle(connection, batch)
+                    sessions.pop(connection).close()
+            elif connection in sessions:
+                if connection in backlog or busy_until.get(connection, arrival) > arrival:
+                    backlog.setdefault(connection, []).append((message, arrival))
+                else:
+                    handle(connection, [(message, arrival)])
+                    busy_until[connection] = arrival + handler_time
+
+        # Connections still open when the capture ended
+        work_off(float('inf'))
+        for session in sessions.values():
+            session.close()
+        scheduler.advance(scheduler.now + DRAIN_TIME)
+    elapsed = time.perf_counter() - started
+    if not verbose:
+        log.close()
+    reader.close()
+
+    timings.sort()
+
+    def percentile(p):
+        if not timings:
+            return 0.0
+        return timings[min(len(timings) - 1, int(len(timings) * p))] * 1e6
+
+    stats = {
+        'messages': len(timings),
+        'errors': errors,
+        'capture_seconds': duration,
+        'elapsed_seconds': elapsed,
+        'messages_per_sec': len(timings) / elapsed if elapsed else 0.0,
+        'mean_us': sum(timings) / len(timings) * 1e6 if timings else 0.0,
+        'p50_us': percentile(0.50),
+        'p99_us': percentile(0.99),
+        'batches': output.batch_count,
+        'events': len(output.events),
+    }
+    return output.events, stats
+
+
+def format_events(events):
+    """One line per injected event: virtual time, kind and arguments"""
+    return "".join(f"{event[0]:10.4f} " + " ".join(str(value) for value in event[1:]) + "\n"
+                   for event in events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help="Capture file written with --capture")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="Multiple of real time, 0 (default) replays as fast as possible")
+    parser.add_argument('--bindings', default=DEFAULT_PROFILE, help="Key binding profile")
+    parser.add_argument('--events', metavar='FILE',
+                        help="Write the injected event stream to FILE, - for stdout")
+    parser.add_argument('--handler-ms', type=float, default=0,
+                        help="Virtual time each batch keeps a connection's handler busy, "
+                             "frames arriving meanwhile are coalesced")
+    parser.add_argument('--verbose', action='store_true', help="Show the server's own output")
+    args = parser.parse_args()
+
+    events, stats = replay(args.capture, args.speed, args.bindings, args.verbose, args.handler_ms / 1000)
+    if args.events == '-':
+        sys.stdout.write(format_events(events))
+    elif args.events:
+        with open(args.events, 'w') as f:
+            f.write(format_events(events))
+
+    print(f"{stats['messages']} messages ({stats['capture_seconds']:.1f} s captured) "
+          f"replayed in {stats['elapsed_seconds']:.3f} s, {stats['messages_per_sec']:,.0f} messages/s")
+    print(f"per message: mean {stats['mean_us']:.1f} us, p50 {stats['p50_us']:.1f} us, "
+          f"p99 {stats['p99_us']:.1f} us")
+    print(f"{stats['events']} events in {stats['batches']} batches, {stats['errors']} errors")
+
+
+if __name__ == '__main__':
+    main()
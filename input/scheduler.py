@@ -0,0 +1,187 @@
+# input/scheduler.py
+"""Timer thread for deferred input events.
+
+Handlers must never sleep: a click-up 50 ms after the click-down, or the next
+scroll notch while a thumbstick is held, is scheduled here instead and run
+on a dedicated thread at its due time. The thread sleeps on a condition
+until shortly before the deadline and then spins, so callbacks run within a
+fraction of a millisecond of their due time even with the coarse default
+timer resolution on Windows.
+"""
+import heapq
+import itertools
+import sys
+import threading
+import time
+from collections import deque
+
+from event_log import log
+
+# Time before a deadline where the thread stops sleeping and starts spinning
+SPIN_THRESHOLD = 0.002
+# Number of recent lateness samples kept for percentiles
+JITTER_SAMPLES = 1024
+
+
+class ScheduledCall:
+    """Handle for a scheduled callback, which can be cancelled before it runs"""
+
+    def __init__(self, due, callback, args):
+        self.due = due
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class InputScheduler:
+    """Runs callbacks at a given delay on a single high-resolution timer thread"""
+
+    def __init__(self, spin_threshold=SPIN_THRESHOLD):
+        self.spin_threshold = spin_threshold
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+
+        # Jitter statistics, lateness of each callback in seconds
+        self.executed = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.max_late = 0.0
+        self.total_late = 0.0
+        self.late_samples = deque(maxlen=JITTER_SAMPLES)
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name="input-scheduler", daemon=True)
+            self.thread.start()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) on the scheduler thread after delay seconds"""
+        call = ScheduledCall(time.perf_counter() + delay, callback, args)
+        if self.thread is None:
+            self.start()
+        with self.condition:
+            heapq.heappush(self.heap, (call.due, next(self.counter), call))
+            # Wake the thread in case this call is due before the current head
+            self.condition.notify()
+        return call
+
+    def run(self):
+        if sys.platform == 'win32':
+            # Raise the system timer resolution to 1 ms for accurate sleeps
+            import ctypes
+            ctypes.windll.winmm.timeBeginPeriod(1)
+
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+                due, _, call = self.heap[0]
+                remaining = due - time.perf_counter()
+                if remaining > self.spin_threshold:
+                    self.condition.wait(remaining - self.spin_threshold)
+                    continue
+                heapq.heappop(self.heap)
+
+            if call.cancelled:
+                self.cancelled += 1
+                continue
+
+            while time.perf_counter() < due:
+                time.sleep(0)
+
+            late = time.perf_counter() - due
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                self.errors += 1
+                log.error('scheduler_error', "Error in scheduled input event: {error}", error=e)
+
+            self.executed += 1
+            self.total_late += late
+            self.max_late = max(self.max_late, late)
+            self.late_samples.append(late)
+
+    def stats(self):
+        """Lateness of executed callbacks in milliseconds"""
+        samples = sorted(self.late_samples)
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+        with self.condition:
+            pending = len(self.heap)
+        return {
+            'executed': self.executed,
+            'cancelled': self.cancelled,
+            'errors': self.errors,
+            'pending': pending,
+            'mean_late_ms': self.total_late / self.executed * 1000 if self.executed else 0.0,
+            'p50_late_ms': percentile(0.50),
+            'p99_late_ms': percentile(0.99),
+            'max_late_ms': self.max_late * 1000,
+        }
+
+
+class ManualScheduler:
+    """Scheduler on a virtual clock that only moves when advance() is called.
+
+    Replays and benchmarks use it in place of InputScheduler so deferred
+    events happen at the same virtual times however fast frames are fed in.
+    """
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.heap = []
+        self.counter = itertools.count()
+        self.executed = 0
+        self.cancelled = 0
+        self.errors = 0
+
+    def time(self):
+        return self.now
+
+    def start(self):
+        pass
+
+    def call_later(self, delay, callback, *args):
+        call = ScheduledCall(self.now + delay, callback, args)
+        heapq.heappush(self.heap, (call.due, next(self.counter), call))
+        return call
+
+    def advance(self, until):
+        """Run every callback due up to `until`, in order, and move the clock there"""
+        while self.heap and self.heap[0][0] <= until:
+            due, _, call = heapq.heappop(self.heap)
+            if call.cancelled:
+                self.cancelled += 1
+                continue
+            self.now = due
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                self.errors += 1
+                log.error('scheduler_error', "Error in scheduled input event: {error}", error=e)
+            self.executed += 1
+        self.now = max(self.now, until)
+
+    def stats(self):
+        # Callbacks run exactly at their virtual due time
+        return {
+            'executed': self.executed,
+            'cancelled': self.cancelled,
+            'errors': self.errors,
+            'pending': len(self.heap),
+            'mean_late_ms': 0.0,
+            'p50_late_ms': 0.0,
+            'p99_late_ms': 0.0,
+            'max_late_ms': 0.0,
+        }
@@ -1,60 +1,90 @@
 # wow/wow_input_server.py
-from flask import Flask
+from flask import Flask, Response, jsonify
 from flask_sock import Sock
-import keyboard
+import argparse
+import itertools
 import json
-import win32gui
-import win32api
-import win32con
+import threading
 import time
 from flask_sock import ConnectionClosed
-import threading
 
-app = Flask(__name__)
-sock = Sock(app)
-
-# Track current key states and their values
-current_states = {
-    'forward': 0,
-    'backward': 0,
-    'left': 0,
-    'right': 0,
-    'jump': 0,
-    'ability1': 0,
-    'ability2': 0,
-    'ability3': 0,
-    'tab': 0,
-    'right_click': 0,
-    'left_click': 0,
-    'xx': 0
-}
+import async_server
+from async_server import run_async_server
+from bindings import DEFAULT_PROFILE, BindingStore
+from broadcast import Broadcaster, SubscriptionError
+from capture import CaptureWriter
+from controller_protocol import PROTOCOL_NAME, ControllerFrameDecoder, ProtocolError
+from event_log import FORMATS, LEVELS, MAX_BYTES, log
+from focus import FocusWatcher
+from input_router import InputRouter
+from input_state import InputState
+from metrics import ClientClock, Metrics, SequenceTracker
+from motion_recognition import MotionRecognizer
+from motion_store import DEFAULT_DIRECTORY, MotionStore, MotionStoreError
+from mouse_motion import DEADZONE, DEFAULT_RATE, MouseMotion
+from output_backends import BACKENDS, NullBackend, create_backend
+from scheduler import InputScheduler
+
+try:
+    import win32gui
+except ImportError:
+    win32gui = None
 
 # Mouse movement settings
-MOUSE_SENSITIVITY = 25  # Adjust this value to change mouse movement speed
-last_mouse_update = time.time()
-MOUSE_UPDATE_INTERVAL = 0.016  # Approximately 60Hz
-
-# Key mappings with thresholds
-KEY_MAPPINGS = {
-    'forward': {'key': 'w', 'threshold': 0.1},
-    'backward': {'key': 's', 'threshold': 0.1},
-    'left': {'key': 'a', 'threshold': 0.1},
-    'right': {'key': 'd', 'threshold': 0.1},
-    'jump': {'key': 'space', 'threshold': 0.5},
-    'ability1': {'key': '1', 'threshold': 0.5},
-    'ability2': {'key': '2', 'threshold': 0.5},
-    'ability3': {'key': '3', 'threshold': 0.5},
-    'tab': {'key': 'tab', 'threshold': 0.5},
-    'right_click': {'threshold': 0.1},
-    'left_click': {'threshold': 0.1},
-    'xx': {'key':'t','threshold': 0.5}
-}
-
-# Global state to track if WoW is focused
-wow_is_focused = False
-
-# Lock for thread safety when updating global state
-state_lock = threading.Lock()
+MOUSE_SENSITIVITY = 25  # Pixels per 1/60 s at full stick deflection
+MOUSE_RATE = DEFAULT_RATE  # Cursor updates per second, see mouse_motion.py
+# Clock for click hold times, replays use a virtual one
+clock = time.time
+# Most queued /ws messages handled as one batch, see ControllerSession.handle_messages
+COALESCE_LIMIT = 64
+
+# Output backend used to inject key and mouse events, replaced in __main__
+output = NullBackend()
+
+# Deferred input events (click releases, scroll repeats) run on this timer
+# thread so that frame handlers never sleep
+scheduler = InputScheduler()
+CLICK_DURATION = 0.05  # How long a single click holds the button down
+
+# Moves the cursor from the latest right stick state of every session
+mouse = MouseMotion(lambda: output, MOUSE_RATE, MOUSE_SENSITIVITY,
+                    is_enabled=lambda: input_state.current.focused)
+
+# Key bindings compiled from the profile file, hot-reloaded while running;
+# loaded in __main__, so processes importing this module don't read profiles
+bindings = None
+
+# Per-stage latency histograms and frame counters, served on /metrics
+metrics = Metrics()
+decode_latency = metrics.histogram('decode')
+broadcast_latency = metrics.histogram('broadcast')
+state_update_latency = metrics.histogram('state_update')
+injection_latency = metrics.histogram('injection')
+handler_latency = metrics.histogram('handler_total')
+recognition_latency = metrics.histogram('motion_recognition')
+# Client timestamp to arrival and to injection, relative to the fastest recent frame
+arrival_delay = metrics.histogram('client_to_server')
+end_to_end_delay = metrics.histogram('client_to_injection')
+
+# Writes every /ws message to a file when started with --capture
+capture = None
+connection_ids = itertools.count(1)
+
+# Motion templates synced from the camera page, created with the first library
+recognizer = None
+MOTION_KEY_PRESS_DURATION = 0.1  # Seconds a press_release motion key stays down
+# Messages that recognize a motion or write motion files, too slow for the asyncio loop
+SLOW_MESSAGE_TYPES = ('pose_sequence', 'store_motion')
+# Motions saved by the camera page, served on /motions; None when not started
+motion_store = None
+
+# Focus and active bindings, published as one immutable snapshot that
+# frame handlers read without locking; created with the bindings
+input_state = None
+
+# Merges the keys and buttons every session presses into the backend,
+# configured with the bindings
+router = InputRouter(lambda: output)
 
 def is_wow_focused():
     """Check if WoW window is focused"""
@@ -63,454 +93,748 @@ def is_wow_focused():
     window_title = win32gui.GetWindowText(win32gui.GetForegroundWindow()).lower()
     return 'warcraft' in window_title
 
-def check_wow_focus():
-    """Background thread to continuously check if WoW is focused"""
-    global wow_is_focused
-    while True:
-        focused = is_wow_focused()
-        with state_lock:
-            if wow_is_focused != focused:
-                wow_is_focused = focused
-                print(f"WoW focus state changed: {'FOCUSED' if focused else 'NOT FOCUSED'}")
-        time.sleep(0.5)  # Check every half second
-
-def update_mouse_position(x_axis, y_axis, use_right_click=False, use_left_click=False):
-    """Update mouse cursor position based on joystick input with smoothing"""
-    global last_mouse_update, last_x_value, last_y_value
-    
-    # Only process mouse movement if WoW is focused
-    with state_lock:
-        if not wow_is_focused:
-            return False
-    
-    current_time = time.time()
-    if current_time - last_mouse_update < MOUSE_UPDATE_INTERVAL:
-        return False
-    
-    last_mouse_update = current_time
-
-    # Apply larger deadzone to prevent drift and snapback
-    if abs(x_axis) < 0.05:
-        x_axis = 0
-    if abs(y_axis) < 0.05:
-        y_axis = 0
-
-    # If stick is in neutral position, release mouse buttons and return
-    if x_axis == 0 and y_axis == 0:
-        if use_right_click:
-            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-        if use_left_click:
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-        return False
-    
-    # Apply smoothing by averaging with previous values
-    if hasattr(update_mouse_position, 'last_x'):
-        smoothed_x = 0.7 * x_axis + 0.3 * update_mouse_position.last_x
-        smoothed_y = 0.7 * y_axis + 0.3 * update_mouse_position.last_y
-    else:
-        smoothed_x = x_axis
-        smoothed_y = y_axis
-    
-    # Store current values for next frame
-    update_mouse_position.last_x = x_axis
-    update_mouse_position.last_y = y_axis
-    
-    # Get current mouse position
-    current_x, current_y = win32gui.GetCursorPos()
-    
-    # Apply non-linear scaling for finer control
-    # Square the value but keep the sign for better precision at low movement
-    x_direction = 1 if smoothed_x > 0 else -1
-    y_direction = 1 if smoothed_y > 0 else -1
-    
-    x_magnitude = abs(smoothed_x) ** 1.5  # Exponential response curve
-    y_magnitude = abs(smoothed_y) ** 1.5
-    
-    # Calculate new position with adjusted sensitivity
-    delta_x = int(x_direction * x_magnitude * MOUSE_SENSITIVITY)
-    delta_y = int(y_direction * y_magnitude * MOUSE_SENSITIVITY)
-    
-    # Move mouse to new position
-    new_x = current_x + delta_x
-    new_y = current_y + delta_y
-    
+def on_bindings_reload(table):
+    """Called by the bindings watcher with a newly compiled table"""
+    router.configure(table)
+    input_state.set_table(table)
+
+def on_focus_change(focused):
+    """Called by the focus watcher when WoW gains or loses focus"""
+    input_state.set_focused(focused)
+    log.info('focus', "WoW focus state changed: {state}", state='FOCUSED' if focused else 'NOT FOCUSED')
+
+active_connections = set()
+
+def release_mouse_button(inputs, button):
+    """Release a mouse button, called from the scheduler thread"""
+    inputs.mouse_up(button)
+    output.flush()
+
+def send_key_command(inputs, key, modifiers, action):
+    """Press or release a key with its modifiers through a session's inputs, for motion key commands"""
+    # Process modifiers (ctrl, shift, alt)
+    if action == "press":
+        for modifier in modifiers:
+            try:
+                inputs.key_down(modifier)
+            except Exception as e:
+                log.error('key_error', "Error pressing modifier {key}: {error}", key=modifier, error=e)
+
+    # Process the main key
     try:
-        win32api.SetCursorPos((new_x, new_y))
-        
-        if use_right_click:
-            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTDOWN, 0, 0, 0, 0)
-        elif use_left_click:
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
-        
+        if action == "press":
+            inputs.key_down(key)
+        elif action == "release":
+            inputs.key_up(key)
+    except Exception as e:
+        log.error('key_error', "Error with key {key} ({action}): {error}", key=key, action=action, error=e)
+
+    # Release modifiers if we're doing a release action
+    if action == "release":
+        for modifier in reversed(modifiers):  # Release in reverse order
+            try:
+                inputs.key_up(modifier)
+            except Exception as e:
+                log.error('key_error', "Error releasing modifier {key}: {error}", key=modifier, error=e)
+
+def release_motion_key(inputs, key, modifiers):
+    """Release a press_release motion key, called from the scheduler thread"""
+    send_key_command(inputs, key, modifiers, 'release')
+    output.flush()
+
+def perform_single_click(inputs, use_right_click=False):
+    """Perform a single click and release of a mouse button"""
+    if not input_state.current.focused:
+        return
+
+    button = 'right' if use_right_click else 'left'
+    try:
+        inputs.mouse_down(button)
+        output.flush()
+        # Release after a short delay so it registers as a click
+        scheduler.call_later(CLICK_DURATION, release_mouse_button, inputs, button)
         return True
     except Exception as e:
-        print(f"Error updating mouse position: {e}")
+        log.error('click_error', "Error performing single click: {error}", error=e)
         return False
 
-def update_mouse_state(action, value):
-    """Update mouse button state"""
-    with state_lock:
-        if not wow_is_focused:
-            return
-    
-    threshold = KEY_MAPPINGS[action]['threshold']
-    was_pressed = current_states[action] >= threshold
-    is_pressed = value >= threshold
-    
-    if was_pressed != is_pressed:
-        try:
-            if action == 'right_click':
-                if is_pressed:
-                    win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTDOWN, 0, 0, 0, 0)
-                else:
-                    win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-            elif action == 'left_click':
-                if is_pressed:
-                    win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
+def wall_time(counter):
+    """time.time() in ms at a time.perf_counter() reading"""
+    return (time.time() - (time.perf_counter() - counter)) * 1000
+
+broadcaster = Broadcaster()
+METRICS_INTERVAL = 0.5  # Seconds between metrics topic updates, the fastest rate subscribers get
+
+def broadcast_data(data, sender):
+    """Queue data for all clients except sender, encoded once per distinct subscription"""
+    broadcaster.publish(data, sender)
+
+class ControllerSession:
+    """Per-connection state and frame handling for the /ws protocol.
+
+    The same session logic is driven by the Flask route and by the asyncio
+    server in async_server.py; `client` only needs a send(text) method, or
+    can be a broadcast Channel that queues messages itself.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.connection_id = next(connection_ids)
+        # Set once the client negotiates the binary frame protocol
+        self.decoder = None
+        # Latency tracing for clients that send 'seq' and 't' with their frames
+        self.sequence = SequenceTracker(metrics.counters)
+        self.clock = ClientClock()
+        # Keys and buttons this session holds, merged with other sessions' by the router
+        self.inputs = router.add_source('controller', self.connection_id)
+        self.motion_inputs = router.add_source('motion', self.connection_id)
+        # Shared table this session's bindings were copied from, and its own copy
+        self.profile_table = None
+        self.table = None
+        # Right stick position, turned into cursor motion by the mouse engine
+        self.stick = mouse.add_stick()
+        self.last_right_click_state = False
+        self.last_left_click_state = False
+        # Keys pressed by motions recognized for this session, as (key, modifiers)
+        self.held_motion_keys = set()
+        self.toggled_motion_keys = set()
+
+        # Add variables to track button press timing and movement
+        self.grip_press_time = None
+        self.trigger_press_time = None
+        self.grip_significant_movement = False
+        self.trigger_significant_movement = False
+        self.last_grip_state = False
+        self.last_trigger_state = False
+        # clock() arrival of the message being processed, for click timing
+        self.frame_time = None
+
+        # Add variables for scroll timing, a held thumbstick scrolls again
+        # every cooldown; the generation stops stale repeats after release
+        self.scroll_held = {'left': False, 'right': False}
+        self.scroll_generation = {'left': 0, 'right': 0}
+        self.scroll_cooldown = 0.15  # Cooldown between scroll actions in seconds
+
+    def open(self):
+        log.info('connect', "WebSocket connection established. Active connections: {connections}",
+                 connection=self.connection_id, connections=len(active_connections) + 1)
+        active_connections.add(self.client)
+        broadcaster.add(self.client)
+        if capture is not None:
+            capture.open_connection(self.connection_id)
+
+    def close(self):
+        if capture is not None:
+            capture.close_connection(self.connection_id)
+        mouse.remove_stick(self.stick)
+        # Stop any scroll repeats still scheduled for this session
+        for side in self.scroll_generation:
+            self.scroll_generation[side] += 1
+        active_connections.discard(self.client)
+        channel = broadcaster.remove(self.client)
+        log.info('disconnect', "Connection removed. Active connections: {connections}",
+                 connection=self.connection_id, connections=len(active_connections))
+        if channel is not None:
+            log.info('broadcast_stats', "Broadcast stats: {stats}", connection=self.connection_id,
+                     stats=channel.stats())
+        log.info('scheduler_stats', "Scheduler jitter: {stats}", stats=scheduler.stats())
+        # Release this session's keys and mouse buttons, others keep theirs
+        self.release_motion_keys()
+        self.release_inputs()
+        router.remove_source(self.motion_inputs)
+        router.remove_source(self.inputs)
+        output.flush()
+
+    def release_inputs(self):
+        """Release every key and mouse button this session holds"""
+        if self.table is not None:
+            self.table.release_all(self.inputs)
+        mouse.set_stick(self.stick, 0, 0)
+        if self.last_right_click_state:
+            self.inputs.mouse_up('right')
+            self.last_right_click_state = False
+        if self.last_left_click_state:
+            self.inputs.mouse_up('left')
+            self.last_left_click_state = False
+
+    def handle_message(self, message, received=None):
+        """Decode and process one /ws message, received is its perf_counter() arrival time"""
+        if received is None:
+            received = time.perf_counter()
+        self.process(self.decode(message, received), received, clock())
+
+    def handle_messages(self, batch, arrivals=None):
+        """Process (message, received) pairs that queued up while the handler was busy.
+
+        A controller frame is skipped when the next frame leaves every
+        button, key and click state the same, so only the newest analog
+        values of a backlog move the cursor. Frames that change a
+        discrete state are processed in order, none of their edges is lost.
+        Click timing uses each frame's arrival, not when the backlog is
+        worked off. arrivals are the messages' clock() arrival times when
+        the caller knows them, as replay.py does.
+        """
+        now = time.perf_counter()
+        now_clock = clock()
+        pending = None
+        for index, (message, received) in enumerate(batch):
+            data = self.decode(message, received)
+            at = now_clock - (now - received) if arrivals is None else arrivals[index]
+            # A lone frame has nothing to be coalesced with, skip its signature
+            if 'type' in data or (pending is None and index == len(batch) - 1):
+                if pending is not None:
+                    self.process(*pending[:3])
+                    pending = None
+                self.process(data, received, at)
+                continue
+            signature = self.frame_signature(data)
+            if pending is not None:
+                if pending[3] == signature:
+                    metrics.counters.add('coalesced_frames')
                 else:
-                    win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-        except Exception as e:
-            print(f"Error updating mouse state: {e}")
-    
-    current_states[action] = value
+                    self.process(*pending[:3])
+            pending = (data, received, at, signature)
+        if pending is not None:
+            self.process(*pending[:3])
+
+    def is_slow(self, batch):
+        """Whether the batch holds a message that should not run on the asyncio loop"""
+        return any(isinstance(message, str) and any(kind in message for kind in SLOW_MESSAGE_TYPES)
+                   for message, _ in batch)
+
+    def decode(self, message, received):
+        """Decode a /ws message and track its sequence number and client clock"""
+        if capture is not None:
+            capture.message(self.connection_id, message, received)
+        if isinstance(message, (bytes, bytearray)):
+            if self.decoder is None:
+                raise ProtocolError("Binary frame received before protocol negotiation")
+            data = self.decoder.decode(message)
+        else:
+            data = json.loads(message)
+        decode_latency.record(time.perf_counter() - received)
+        metrics.counters.add('messages')
+
+        if 'seq' in data:
+            self.sequence.track(data['seq'])
+        client_time = data.get('t')
+        if client_time is not None:
+            arrived = wall_time(received)
+            self.clock.observe(arrived, client_time)
+            arrival_delay.record(self.clock.delay(arrived, client_time) / 1000)
+        return data
+
+    def process(self, data, received, at):
+        """Act on a decoded message and submit the events it produced, at is its clock() arrival"""
+        self.frame_time = at
+        try:
+            # Process motion key commands
+            if 'type' in data and data['type'] == 'motion_key_command':
+                self.handle_motion_key_command(data)
+            elif 'type' in data and data['type'] == 'hello':
+                self.handle_hello(data)
+            elif 'type' in data and data['type'] == 'pose_sequence':
+                self.handle_pose_sequence(data)
+            elif 'type' in data and data['type'] == 'motion_library':
+                self.handle_motion_library(data)
+            elif 'type' in data and data['type'] == 'store_motion':
+                self.handle_store_motion(data)
+            elif 'type' in data and data['type'] == 'subscribe':
+                self.handle_subscribe(data)
+            else:
+                self.handle_controller_frame(data)
+        finally:
+            # Submit everything this frame produced as one batch
+            started = time.perf_counter()
+            output.flush()
+            finished = time.perf_counter()
+            injection_latency.record(finished - started)
+            handler_latency.record(finished - received)
+            client_time = data.get('t')
+            if client_time is not None:
+                end_to_end_delay.record(self.clock.delay(wall_time(finished), client_time) / 1000)
+
+    def frame_signature(self, data):
+        """Everything in a controller frame that presses, releases or clicks.
+
+        Two frames with the same signature only differ in analog values.
+        """
+        table = input_state.current.table
+        signature = []
+        for controller in ('leftController', 'rightController'):
+            state = data.get(controller)
+            if state is None:
+                signature.append(None)
+                continue
+            buttons = state.get('buttons')
+            axes = state.get('axes')
+            signature.append(table.pressed_by(controller, state))
+            signature.append(buttons is not None and buttons.get('thumbstick', 0) > 0.5)
+            if controller == 'rightController':
+                # Click and drag states from handle_right_controller
+                signature.append(buttons is not None and buttons.get('grip', 0) > table.grip_threshold)
+                signature.append(buttons is not None and buttons.get('trigger', 0) > table.trigger_threshold)
+                signature.append(axes is not None and (abs(axes[0]) > 0.01 or abs(axes[1]) > 0.01))
+                signature.append(axes is not None and (abs(axes[0]) >= DEADZONE or abs(axes[1]) >= DEADZONE))
+            signature.append((buttons is None, axes is None))
+        return tuple(signature)
 
-def update_key_state(key, value):
-    """Update key state based on value and threshold"""
-    # Skip if WoW is not focused
-    with state_lock:
-        if not wow_is_focused:
+    def handle_hello(self, data):
+        """Pick the frame protocol from the ones the client offers"""
+        if PROTOCOL_NAME in data.get('protocols', []):
+            self.decoder = ControllerFrameDecoder()
+            protocol = PROTOCOL_NAME
+        else:
+            self.decoder = None
+            protocol = 'json'
+        log.info('protocol', "Client negotiated {protocol} controller frames",
+                 connection=self.connection_id, protocol=protocol)
+        broadcaster.send_to(self.client, {'type': 'hello', 'protocol': protocol})
+
+    def handle_subscribe(self, data):
+        """Send this client only the topics it asks for, see broadcast.py"""
+        reply = {'type': 'subscribed', 'topics': data.get('topics'), 'rate': data.get('rate', 0)}
+        try:
+            broadcaster.subscribe(self.client, data.get('topics'), data.get('rate', 0))
+        except SubscriptionError as e:
+            reply['error'] = str(e)
+        broadcaster.send_to(self.client, reply)
+
+    def handle_motion_key_command(self, data):
+        if not input_state.current.focused:
             return
-    
-    if key in ['right_click', 'left_click']:
-        update_mouse_state(key, value)
-        return
 
-    threshold = KEY_MAPPINGS[key]['threshold']
-    key_code = KEY_MAPPINGS[key]['key']
-    
-    was_pressed = current_states[key] >= threshold
-    is_pressed = value >= threshold
-    
-    if was_pressed != is_pressed:
+        key = data.get('key', '').lower()
+        modifiers = data.get('modifiers', [])
+        action = data.get('action', '')
+
+        log.info('motion_key', "Motion key command: {action} {keys}",
+                 connection=self.connection_id, action=action, keys='+'.join(modifiers + [key]))
+        send_key_command(self.motion_inputs, key, modifiers, action)
+        broadcaster.publish_topic('motion', {'type': 'motion', 'event': 'motion_key', 'key': key,
+                                             'modifiers': modifiers, 'action': action}, self.client)
+
+    def handle_motion_library(self, data):
+        """Replace the motion templates with the camera page's library"""
+        global recognizer
         try:
-            if is_pressed:
-                keyboard.press(key_code)
+            if recognizer is None:
+                recognizer = MotionRecognizer()
+        except RuntimeError as e:
+            log.warning('recognition_unavailable', "Motion recognition unavailable: {error}", error=e)
+            broadcaster.send_to(self.client, {'type': 'motion_library', 'error': str(e)})
+            return
+        try:
+            count = recognizer.load_library(data)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            log.warning('motion_library_error', "Could not load motion templates: {error}", error=e)
+            broadcaster.send_to(self.client, {'type': 'motion_library', 'error': str(e)})
+            return
+        log.info('motion_library', "Loaded {count} motion templates", count=count)
+        broadcaster.send_to(self.client, {'type': 'motion_library', 'templates': count})
+
+    def handle_store_motion(self, data):
+        """Save a motion from the camera page, or only its key mapping and joint importance"""
+        reply = {'type': 'motion_stored', 'name': data.get('name')}
+        try:
+            if motion_store is None:
+                raise MotionStoreError("The motion store is not enabled")
+            if 'poses' in data:
+                motion_store.save(data.get('name'), data['timestamps'], data['poses'],
+                                  data.get('keyMapping'), data.get('importance'))
             else:
-                keyboard.release(key_code)
-        except Exception as e:
-            print(f"Error updating key {key}: {e}")
-    
-    current_states[key] = value
-
-def release_all_inputs():
-    """Release all pressed keys and mouse buttons"""
-    for key in current_states:
-        if key == 'right_click':
-            if current_states[key] >= KEY_MAPPINGS[key]['threshold']:
-                win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-        elif key == 'left_click':
-            if current_states[key] >= KEY_MAPPINGS[key]['threshold']:
-                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-        elif current_states[key] >= KEY_MAPPINGS[key]['threshold']:
-            keyboard.release(KEY_MAPPINGS[key]['key'])
-        current_states[key] = 0
+                motion_store.update(data.get('name'), data.get('keyMapping'), data.get('importance'))
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            log.warning('store_error', "Could not store motion {name!r}: {error}", name=data.get('name'), error=e)
+            reply['error'] = str(e)
+        broadcaster.send_to(self.client, reply)
 
-active_connections = set()
+    def handle_pose_sequence(self, data):
+        """Recognize a motion recorded by the camera page and press its keys"""
+        if recognizer is None:
+            result = {'motion': None, 'reason': 'no_templates'}
+        else:
+            started = time.perf_counter()
+            result = recognizer.recognize(data.get('timestamps'), data.get('poses'), clock() * 1000,
+                                          data.get('settings'))
+            recognition_latency.record(time.perf_counter() - started)
+        if result['motion'] is not None:
+            log.info('motion_detected', "Motion detected: {motion} (score {score:.2f})",
+                     motion=result['motion'], score=result['score'])
+            broadcaster.publish_topic('motion', {'type': 'motion', 'event': 'motion_detected',
+                                                 'motion': result['motion'], 'score': result['score']},
+                                      self.client)
+            if result['keyMapping'] and input_state.current.focused:
+                self.run_motion_key_mapping(result['keyMapping'])
+        broadcaster.send_to(self.client, dict(result, type='motion_result'))
 
-def perform_single_click(use_right_click=False):
-    """Perform a single click and release of a mouse button"""
-    with state_lock:
-        if not wow_is_focused:
+    def run_motion_key_mapping(self, mapping):
+        """Press the keys of a recognized motion like MotionRecorder.executeKeyMapping()"""
+        *modifiers, key = mapping.get('key', '').lower().split('+')
+        combo = (key, tuple(modifiers))
+        behavior = mapping.get('behavior')
+        if behavior == 'press_release':
+            send_key_command(self.motion_inputs, key, modifiers, 'press')
+            scheduler.call_later(MOTION_KEY_PRESS_DURATION, release_motion_key,
+                                 self.motion_inputs, key, modifiers)
+        elif behavior == 'hold':
+            # A new held motion replaces the previous one
+            for held in self.held_motion_keys:
+                send_key_command(self.motion_inputs, held[0], list(held[1]), 'release')
+            send_key_command(self.motion_inputs, key, modifiers, 'press')
+            self.held_motion_keys = {combo}
+        elif behavior == 'toggle':
+            if combo in self.toggled_motion_keys:
+                send_key_command(self.motion_inputs, key, modifiers, 'release')
+                self.toggled_motion_keys.discard(combo)
+            else:
+                send_key_command(self.motion_inputs, key, modifiers, 'press')
+                self.toggled_motion_keys.add(combo)
+        else:
+            log.warning('motion_key_behavior', "Unknown motion key behavior: {behavior}", behavior=behavior)
+
+    def release_motion_keys(self):
+        """Release keys held or toggled on by recognized motions"""
+        for key, modifiers in self.held_motion_keys | self.toggled_motion_keys:
+            send_key_command(self.motion_inputs, key, list(modifiers), 'release')
+        self.held_motion_keys = set()
+        self.toggled_motion_keys = set()
+
+    def handle_controller_frame(self, data):
+        # Broadcast received data to all other connected clients
+        started = time.perf_counter()
+        broadcast_data(data, self.client)
+        broadcasted = time.perf_counter()
+        broadcast_latency.record(broadcasted - started)
+
+        # One snapshot for the whole frame, so focus and bindings never change midway
+        snapshot = input_state.current
+        if snapshot.table is not self.profile_table:
+            if self.table is not None:
+                # The bindings were reloaded, keys held through the old table would stay down
+                self.table.release_all(self.inputs)
+            self.profile_table = snapshot.table
+            self.table = snapshot.table.for_session()
+        table = self.table
+
+        # Only process inputs if WoW is focused
+        if not snapshot.focused:
+            # Release any pressed buttons when WoW loses focus
+            self.release_inputs()
             return
-    
-    try:
-        if use_right_click:
-            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTDOWN, 0, 0, 0, 0)
-            time.sleep(0.05)  # Short delay to register as a click
-            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
+
+        # Process left controller
+        if 'leftController' in data:
+            self.handle_left_controller(data['leftController'], table)
+
+        # Process right controller
+        if 'rightController' in data:
+            self.handle_right_controller(data['rightController'], table)
+
+        state_update_latency.record(time.perf_counter() - broadcasted)
+
+    def handle_left_controller(self, left, table):
+        # Movement from thumbstick and other left controller buttons
+        table.update_controller('leftController', left, self.inputs)
+
+        if 'buttons' in left:
+            # Handle left thumbstick click for mouse scroll in (wheel up)
+            # Scroll up (positive value = zoom in)
+            self.update_scroll('left', left['buttons'].get('thumbstick', 0) > 0.5, 1)
+
+    def update_scroll(self, side, pressed, amount):
+        """Scroll once when a thumbstick is clicked and repeat while it is held"""
+        if pressed and not self.scroll_held[side]:
+            self.scroll_held[side] = True
+            self.scroll_generation[side] += 1
+            self.inputs.scroll(amount)
+            scheduler.call_later(self.scroll_cooldown, self.repeat_scroll,
+                                 side, amount, self.scroll_generation[side])
+        elif not pressed and self.scroll_held[side]:
+            self.scroll_held[side] = False
+            self.scroll_generation[side] += 1
+
+    def repeat_scroll(self, side, amount, generation):
+        """Scheduler callback for a held thumbstick"""
+        if self.scroll_generation[side] != generation:
+            return
+        if input_state.current.focused:
+            self.inputs.scroll(amount)
+            output.flush()
+        scheduler.call_later(self.scroll_cooldown, self.repeat_scroll, side, amount, generation)
+
+    def handle_right_controller(self, right, table):
+        # Check for button states and handle timing
+        if 'buttons' in right:
+            current_grip_state = right['buttons'].get('grip', 0) > table.grip_threshold
+            current_trigger_state = right['buttons'].get('trigger', 0) > table.trigger_threshold
+
+            # Handle right thumbstick click for mouse scroll out (wheel down)
+            # Scroll down (negative value = zoom out)
+            self.update_scroll('right', right['buttons'].get('thumbstick', 0) > 0.5, -1)
+
+            # Handle grip button press and release (right click)
+            if current_grip_state and not self.last_grip_state:
+                # Grip button just pressed
+                self.grip_press_time = self.frame_time
+                self.grip_significant_movement = False
+            elif not current_grip_state and self.last_grip_state:
+                # Grip button just released
+                if self.grip_press_time is not None:
+                    grip_duration = self.frame_time - self.grip_press_time
+                    # If held for less than 0.5 seconds and no significant movement, perform single right click
+                    if grip_duration < 0.5 and not self.grip_significant_movement:
+                        perform_single_click(self.inputs, use_right_click=True)
+                        log.debug('quick_click', "Quick {button} click performed", button='right')
+                self.grip_press_time = None
+
+            # Handle trigger button press and release (left click)
+            if current_trigger_state and not self.last_trigger_state:
+                # Trigger button just pressed
+                self.trigger_press_time = self.frame_time
+                self.trigger_significant_movement = False
+            elif not current_trigger_state and self.last_trigger_state:
+                # Trigger button just released
+                if self.trigger_press_time is not None:
+                    trigger_duration = self.frame_time - self.trigger_press_time
+                    # If held for less than 0.5 seconds and no significant movement, perform single left click
+                    if trigger_duration < 0.5 and not self.trigger_significant_movement:
+                        perform_single_click(self.inputs, use_right_click=False)
+                        log.debug('quick_click', "Quick {button} click performed", button='left')
+                self.trigger_press_time = None
+
+            # Update states for next iteration
+            self.last_grip_state = current_grip_state
+            self.last_trigger_state = current_trigger_state
+
+            # Continue with existing functionality (trigger is bound to left click)
+            table.update_controller('rightController', right, self.inputs)
+            grip_active = current_grip_state
+            trigger_active = current_trigger_state
         else:
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
-            time.sleep(0.05)  # Short delay to register as a click
-            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-        return True
-    except Exception as e:
-        print(f"Error performing single click: {e}")
-        return False
+            grip_active = False
+            trigger_active = False
 
-def broadcast_data(data, sender):
-    """Broadcast data to all clients except sender and remove stale connections"""
-    stale_connections = set()
-    
-    for client in active_connections:
-        if client != sender:
-            try:
-                client.send(json.dumps(data))
-            except ConnectionClosed:
-                stale_connections.add(client)
-            except Exception as e:
-                print(f"Error broadcasting to client: {e}")
-                stale_connections.add(client)
-    
-    # Remove stale connections
-    active_connections.difference_update(stale_connections)
+        # Mouse movement from right thumbstick
+        if 'axes' in right and (abs(right['axes'][0]) > 0.01 or abs(right['axes'][1]) > 0.01):
+            # Mark significant movement if buttons are currently pressed
+            if self.grip_press_time is not None:
+                self.grip_significant_movement = True
+            if self.trigger_press_time is not None:
+                self.trigger_significant_movement = True
+
+            # The mouse engine moves the cursor from this on its own ticks
+            moved = mouse.set_stick(self.stick, right['axes'][0], right['axes'][1])
+            if grip_active:
+                # Use right-click movement when grip is held
+                if moved:
+                    if not self.last_right_click_state:
+                        self.inputs.mouse_down('right')
+                    self.last_right_click_state = True
+                    if self.last_left_click_state:
+                        self.inputs.mouse_up('left')
+                        self.last_left_click_state = False
+            elif trigger_active:
+                # Use left-click movement when trigger is held (unchanged)
+                if moved:
+                    if not self.last_left_click_state:
+                        self.inputs.mouse_down('left')
+                    self.last_left_click_state = True
+                    if self.last_right_click_state:
+                        self.inputs.mouse_up('right')
+                        self.last_right_click_state = False
+            else:
+                # Regular mouse movement (without right-click) when neither is held
+                # Ensure mouse buttons are released
+                if self.last_right_click_state:
+                    self.inputs.mouse_up('right')
+                    self.last_right_click_state = False
+                if self.last_left_click_state:
+                    self.inputs.mouse_up('left')
+                    self.last_left_click_state = False
+        else:
+            mouse.set_stick(self.stick, 0, 0)
+            # Release mouse buttons when thumbstick is neutral
+            if self.last_right_click_state and not grip_active:
+                self.inputs.mouse_up('right')
+                self.last_right_click_state = False
+            if self.last_left_click_state and not trigger_active:
+                self.inputs.mouse_up('left')
+                self.last_left_click_state = False
+
+        # Handle right-click state when grip is pressed but thumbstick isn't moved
+        if grip_active and not self.last_right_click_state and ('axes' not in right or
+                                                             (abs(right['axes'][0]) <= 0.01 and abs(right['axes'][1]) <= 0.01)):
+            self.inputs.mouse_down('right')
+            self.last_right_click_state = True
+        elif not grip_active and self.last_right_click_state:
+            self.inputs.mouse_up('right')
+            self.last_right_click_state = False
+
+def collect_metrics():
+    """Everything served on /metrics"""
+    snapshot = metrics.snapshot()
+    snapshot['backend'] = output.stats()
+    snapshot['broadcast'] = broadcaster.stats()
+    snapshot['scheduler'] = scheduler.stats()
+    snapshot['mouse'] = mouse.stats()
+    snapshot['router'] = router.stats()
+    snapshot['log'] = log.stats()
+    snapshot['connections'] = [stats.as_dict() for stats in list(async_server.connections.values())]
+    return snapshot
+
+def publish_metrics():
+    """Thread sending what /metrics serves to the metrics topic"""
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        if broadcaster.has_subscribers('metrics'):
+            broadcaster.publish_topic('metrics', dict(collect_metrics(), type='metrics'), limited=True)
+
+def list_motions():
+    """Everything served on /motions, the motion store's manifest"""
+    if motion_store is None:
+        return {'version': None, 'motions': []}
+    return motion_store.list()
+
+def read_motion(name):
+    """A stored motion's packed frames for /motions/<name>, or None"""
+    if motion_store is None:
+        return None
+    return motion_store.read(name)
+
+def allow_any_origin(response):
+    # The camera page is served from another port
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+def metrics_endpoint():
+    return jsonify(collect_metrics())
+
+def motions_endpoint():
+    return allow_any_origin(jsonify(list_motions()))
+
+def motion_endpoint(name):
+    data = read_motion(name)
+    if data is None:
+        return allow_any_origin(Response("Unknown motion", status=404))
+    return allow_any_origin(Response(data, mimetype='application/octet-stream'))
 
-@sock.route('/ws')
 def websocket(ws):
-    print(f"WebSocket connection established. Active connections: {len(active_connections) + 1}")
-    active_connections.add(ws)
-    last_right_click_state = False
-    last_left_click_state = False
-    
-    # Add variables to track button press timing and movement
-    grip_press_time = None
-    trigger_press_time = None
-    grip_significant_movement = False
-    trigger_significant_movement = False
-    last_grip_state = False
-    last_trigger_state = False
-    
-    # Add variables for scroll timing
-    last_left_scroll_time = 0
-    last_right_scroll_time = 0
-    scroll_cooldown = 0.15  # Cooldown between scroll actions in seconds
-    
-    # Clean state when new connection is established
-    release_all_inputs()
-    
+    session = ControllerSession(ws)
+    session.open()
+
     try:
         while True:
-            message = ws.receive()
-            data = json.loads(message)
-            
-            # Process motion key commands
-            if 'type' in data and data['type'] == 'motion_key_command':
-                with state_lock:
-                    should_process = wow_is_focused
-                
-                if not should_process:
-                    continue
-                
-                key = data.get('key', '').lower()
-                modifiers = data.get('modifiers', [])
-                action = data.get('action', '')
-                
-                print(f"Motion key command: {action} {'+'.join(modifiers + [key])}")
-                
-                # Process modifiers (ctrl, shift, alt)
-                if action == "press":
-                    for modifier in modifiers:
-                        try:
-                            keyboard.press(modifier)
-                        except Exception as e:
-                            print(f"Error pressing modifier {modifier}: {e}")
-                
-                # Process the main key
-                try:
-                    if action == "press":
-                        keyboard.press(key)
-                    elif action == "release":
-                        keyboard.release(key)
-                except Exception as e:
-                    print(f"Error with key {key} ({action}): {e}")
-                
-                # Release modifiers if we're doing a release action
-                if action == "release":
-                    for modifier in reversed(modifiers):  # Release in reverse order
-                        try:
-                            keyboard.release(modifier)
-                        except Exception as e:
-                            print(f"Error releasing modifier {modifier}: {e}")
-                
-                continue  # Skip the rest of the processing for this message
-            
-            # Process controller data (existing code)
-            # Broadcast received data to all other connected clients
-            broadcast_data(data, ws)
-            
-            # Only process inputs if WoW is focused
-            with state_lock:
-                should_process = wow_is_focused
-            
-            if not should_process:
-                # Release any pressed buttons when WoW loses focus
-                release_all_inputs()
-                continue
-                
-            # Process left controller
-            if 'leftController' in data:
-                left = data['leftController']
-                # Movement from thumbstick
-                if 'axes' in left:
-                    update_key_state('left', abs(min(0, left['axes'][0])))
-                    update_key_state('right', max(0, left['axes'][0]))
-                    update_key_state('forward', abs(min(0, left['axes'][1])))
-                    update_key_state('backward', max(0, left['axes'][1]))
-                
-                # Other left controller buttons
-                if 'buttons' in left:
-                    update_key_state('jump', left['buttons'].get('Y', 0))
-                    update_key_state('tab', left['buttons'].get('X', 0))
-                    #update_key_state('right_click', left['buttons'].get('grip', 0))
-                    #update_key_state('xx', left['buttons'].get('trigger', 0))
-                    
-                    # Handle left thumbstick click for mouse scroll in (wheel up)
-                    if left['buttons'].get('thumbstick', 0) > 0.5:
-                        current_time = time.time()
-                        # Only perform scroll if cooldown has elapsed
-                        if current_time - last_left_scroll_time > scroll_cooldown:
-                            # Scroll up (positive value = zoom in)
-                            win32api.mouse_event(win32con.MOUSEEVENTF_WHEEL, 0, 0, 120, 0)
-                            # print("Mouse scroll in (wheel up)")
-                            last_left_scroll_time = current_time
-            
-            # Process right controller
-            if 'rightController' in data:
-                right = data['rightController']
-                
-                # Check for button states and handle timing
-                if 'buttons' in right:
-                    current_grip_state = right['buttons'].get('grip', 0) > KEY_MAPPINGS['xx']['threshold']
-                    current_trigger_state = right['buttons'].get('trigger', 0) > KEY_MAPPINGS['left_click']['threshold']
-                    
-                    # Handle right thumbstick click for mouse scroll out (wheel down)
-                    if right['buttons'].get('thumbstick', 0) > 0.5:
-                        current_time = time.time()
-                        # Only perform scroll if cooldown has elapsed
-                        if current_time - last_right_scroll_time > scroll_cooldown:
-                            # Scroll down (negative value = zoom out)
-                            win32api.mouse_event(win32con.MOUSEEVENTF_WHEEL, 0, 0, -120, 0)
-                            # print("Mouse scroll out (wheel down)")
-                            last_right_scroll_time = current_time
-                    
-                    # Handle grip button press and release (right click)
-                    if current_grip_state and not last_grip_state:
-                        # Grip button just pressed
-                        grip_press_time = time.time()
-                        grip_significant_movement = False
-                    elif not current_grip_state and last_grip_state:
-                        # Grip button just released
-                        if grip_press_time is not None:
-                            grip_duration = time.time() - grip_press_time
-                            # If held for less than 0.5 seconds and no significant movement, perform single right click
-                            if grip_duration < 0.5 and not grip_significant_movement:
-                                win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTDOWN, 0, 0, 0, 0)
-                                time.sleep(0.05)  # Short delay to register as a click
-                                win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-                                # print("Quick right click performed")
-                        grip_press_time = None
-                    
-                    # Handle trigger button press and release (left click)
-                    if current_trigger_state and not last_trigger_state:
-                        # Trigger button just pressed
-                        trigger_press_time = time.time()
-                        trigger_significant_movement = False
-                    elif not current_trigger_state and last_trigger_state:
-                        # Trigger button just released
-                        if trigger_press_time is not None:
-                            trigger_duration = time.time() - trigger_press_time
-                            # If held for less than 0.5 seconds and no significant movement, perform single left click
-                            if trigger_duration < 0.5 and not trigger_significant_movement:
-                                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
-                                time.sleep(0.05)  # Short delay to register as a click
-                                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-                                # print("Quick left click performed")
-                        trigger_press_time = None
-                    
-                    # Update states for next iteration
-                    last_grip_state = current_grip_state
-                    last_trigger_state = current_trigger_state
-                    
-                    # Continue with existing functionality
-                    update_key_state('left_click', right['buttons'].get('trigger', 0))
-                    grip_active = current_grip_state
-                    trigger_active = current_trigger_state
-                else:
-                    grip_active = False
-                    trigger_active = False
-
-                # Mouse movement from right thumbstick
-                if 'axes' in right and (abs(right['axes'][0]) > 0.01 or abs(right['axes'][1]) > 0.01):
-                    # Mark significant movement if buttons are currently pressed
-                    if grip_press_time is not None:
-                        grip_significant_movement = True
-                    if trigger_press_time is not None:
-                        trigger_significant_movement = True
-                        
-                    if grip_active:
-                        # Use right-click movement when grip is held
-                        moved = update_mouse_position(right['axes'][0], right['axes'][1], True, False)
-                        if moved:
-                            last_right_click_state = True
-                            if last_left_click_state:
-                                win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-                                last_left_click_state = False
-                    elif trigger_active:
-                        # Use left-click movement when trigger is held (unchanged)
-                        moved = update_mouse_position(right['axes'][0], right['axes'][1], False, True)
-                        if moved:
-                            last_left_click_state = True
-                            if last_right_click_state:
-                                win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-                                last_right_click_state = False
-                    else:
-                        # Regular mouse movement (without right-click) when neither is held
-                        update_mouse_position(right['axes'][0], right['axes'][1], False, False)
-                        # Ensure mouse buttons are released
-                        if last_right_click_state:
-                            win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-                            last_right_click_state = False
-                        if last_left_click_state:
-                            win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-                            last_left_click_state = False
-                else:
-                    # Release mouse buttons when thumbstick is neutral
-                    if last_right_click_state and not grip_active:
-                        win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-                        last_right_click_state = False
-                    if last_left_click_state and not trigger_active:
-                        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
-                        last_left_click_state = False
-                        
-                # Handle right-click state when grip is pressed but thumbstick isn't moved
-                if grip_active and not last_right_click_state and ('axes' not in right or 
-                                                                (abs(right['axes'][0]) <= 0.01 and abs(right['axes'][1]) <= 0.01)):
-                    win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTDOWN, 0, 0, 0, 0)
-                    last_right_click_state = True
-                elif not grip_active and last_right_click_state:
-                    win32api.mouse_event(win32con.MOUSEEVENTF_RIGHTUP, 0, 0, 0, 0)
-                    last_right_click_state = False
-    
+            batch = [(ws.receive(), time.perf_counter())]
+            # Whatever queued up while the last batch was handled is coalesced
+            while len(batch) < COALESCE_LIMIT:
+                message = ws.receive(timeout=0)
+                if message is None:
+                    break
+                batch.append((message, time.perf_counter()))
+            session.handle_messages(batch)
+
     except ConnectionClosed:
-        print("WebSocket connection closed normally")
+        log.info('closed', "WebSocket connection closed normally", connection=session.connection_id)
     except Exception as e:
-        print(f"WebSocket error: {e}")
+        log.warning('websocket_error', "WebSocket error: {error}", connection=session.connection_id, error=e)
     finally:
-        active_connections.remove(ws)
-        print(f"Connection removed. Active connections: {len(active_connections)}")
-        # Release all keys and mouse buttons on disconnect
-        release_all_inputs()        
+        session.close()
+
+def create_app():
+    """The Flask app serving /ws and the HTTP endpoints in the default mode"""
+    app = Flask(__name__)
+    app.route('/metrics')(metrics_endpoint)
+    app.route('/motions')(motions_endpoint)
+    app.route('/motions/<path:name>')(motion_endpoint)
+    Sock(app).route('/ws')(websocket)
+    return app
 
 def start_background_threads():
     """Start all background threads"""
-    # Thread to check if WoW is focused
-    focus_thread = threading.Thread(target=check_wow_focus, daemon=True)
-    focus_thread.start()
+    # Writer for everything logged from here on
+    log.start()
+
+    # Timer thread for deferred input events
+    scheduler.start()
+
+    # Fixed-rate cursor motion
+    mouse.start()
+
+    # /metrics for subscribers of the metrics topic
+    threading.Thread(target=publish_metrics, name='metrics-publisher', daemon=True).start()
+
+    # Thread reloading the bindings profile when it changes
+    bindings.start_watching(on_bindings_reload)
+
+    # Focus change notifications, polling where no hook is available
+    FocusWatcher(is_wow_focused, on_focus_change).start()
 
 if __name__ == '__main__':
-    print("Starting WoW VR Input Server with WebSocket on port 5000...")
-    print("Current key mappings:")
-    for action, mapping in KEY_MAPPINGS.items():
-        if action == 'right_click':
-            print(f"  {action}: Right Mouse Button (threshold: {mapping['threshold']})")
-        elif action == 'left_click':
-            print(f"  {action}: Left Mouse Button (threshold: {mapping['threshold']})")
-        else:
-            print(f"  {action}: {mapping['key']} (threshold: {mapping['threshold']})")
-    print("\nMouse sensitivity:", MOUSE_SENSITIVITY)
+    parser = argparse.ArgumentParser(description="WoW VR Input Server")
+    parser.add_argument('--backend', default='auto', choices=['auto'] + sorted(BACKENDS),
+                        help="Input injection backend (default: native backend for this OS)")
+    parser.add_argument('--mode', default='flask', choices=['flask', 'async'],
+                        help="Serve /ws with a Flask thread per connection or on one asyncio event loop")
+    parser.add_argument('--bindings', default=DEFAULT_PROFILE,
+                        help="Key binding profile, reloaded automatically when the file changes")
+    parser.add_argument('--mouse-rate', type=int, default=MOUSE_RATE,
+                        help=f"Cursor updates per second, 250-1000 (default: {MOUSE_RATE})")
+    parser.add_argument('--capture', metavar='FILE',
+                        help="Record every /ws message to FILE for replay.py")
+    parser.add_argument('--motions', default=DEFAULT_DIRECTORY, metavar='DIR',
+                        help="Directory of the motion store (default: input/motions)")
+    parser.add_argument('--log-level', default='info', choices=sorted(LEVELS, key=LEVELS.get),
+                        help="Lowest level of events printed to the console (default: info)")
+    parser.add_argument('--log-file', metavar='FILE',
+                        help="Also write events to FILE, rotated every --log-max-mb")
+    parser.add_argument('--log-file-level', default='debug', choices=sorted(LEVELS, key=LEVELS.get),
+                        help="Lowest level of events written to the log file (default: debug)")
+    parser.add_argument('--log-format', default='jsonl', choices=sorted(FORMATS),
+                        help="Log file format, read binary files with event_log.py dump (default: jsonl)")
+    parser.add_argument('--log-max-mb', type=float, default=MAX_BYTES / 1024 / 1024,
+                        help="Log file size in MB before it is rotated")
+    args = parser.parse_args()
+    if not 250 <= args.mouse_rate <= 1000:
+        parser.error("--mouse-rate must be between 250 and 1000")
+
+    log.configure(args.log_level, args.log_file, args.log_format, args.log_file_level,
+                  int(args.log_max_mb * 1024 * 1024))
+    output = create_backend(args.backend)
+    bindings = BindingStore(args.bindings)
+    input_state = InputState(bindings.table)
+    router.configure(bindings.table)
+    mouse = MouseMotion(lambda: output, args.mouse_rate, MOUSE_SENSITIVITY,
+                        is_enabled=lambda: input_state.current.focused)
+    if args.capture:
+        capture = CaptureWriter(args.capture)
+        print(f"Capturing /ws sessions to {args.capture}")
+    motion_store = MotionStore(args.motions)
+    print(f"Motion store: {len(motion_store)} motions in {args.motions}")
+
+    print(f"Starting WoW VR Input Server with WebSocket on port 5000 ({args.mode} mode)...")
+    print(f"Input backend: {output.name}")
+    print(f"Current key mappings ({bindings.table.name}, {args.bindings}):")
+    print(bindings.table.describe())
+    print(f"\nMouse sensitivity: {MOUSE_SENSITIVITY} ({args.mouse_rate} Hz updates)")
     print("\nMake sure World of Warcraft is running!")
     print("Input commands will only be sent when WoW window is in focus.")
     
     # Start background threads
     start_background_threads()
     
-    app.run(port=5000)
\ No newline at end of file
+    try:
+        if args.mode == 'async':
+            run_async_server(ControllerSession, port=5000,
+                             http_routes={
+                                 '/metrics': lambda: json.dumps(collect_metrics()),
+                                 '/motions': lambda: json.dumps(list_motions()),
+                                 '/motions/': read_motion,
+                             })
+        else:
+            create_app().run(port=5000)
+    finally:
+        output.close()
+        log.stop()
+        if capture is not None:
+            capture.close()